@@ -0,0 +1,259 @@
+import hashlib
+import math
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Set
+
+DEFAULT_MAX_EXACT_ENTRIES = 1_000_000
+DEFAULT_FALSE_POSITIVE_RATE = 0.001
+DEDUP_MODE_EXACT = "exact"
+DEDUP_MODE_BLOOM = "bloom"
+
+
+def line_fingerprint(line: bytes) -> int:
+    """行のバイト列から64ビットのフィンガープリントを求める"""
+    return int.from_bytes(hashlib.blake2b(line, digest_size=8).digest(), "little")
+
+
+class BloomFilter:
+    """
+    固定サイズのブルームフィルタ
+
+    capacity件を加えたときの偽陽性率がfalse_positive_rateになるようにビット数と
+    ハッシュ数を決める。位置は64ビットのフィンガープリントの上下32ビットから
+    二重ハッシュで求める。
+    """
+
+    def __init__(self, capacity: int, false_positive_rate: float):
+        self.capacity = capacity
+        self.bit_count = max(
+            8, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)
+        )
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self.bits = bytearray((self.bit_count + 7) // 8)
+        self.count = 0
+
+    def __contains__(self, fingerprint: int) -> bool:
+        # 含まれない値は立っていないビットに当たった時点で打ち切る
+        bits = self.bits
+        m = self.bit_count
+        position = (fingerprint & 0xFFFFFFFF) % m
+        step = ((fingerprint >> 32) | 1) % m
+        for _ in range(self.hash_count):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+            position += step
+            if position >= m:
+                position -= m
+        return True
+
+    def add(self, fingerprint: int) -> None:
+        """フィンガープリントを1つ加える"""
+        bits = self.bits
+        m = self.bit_count
+        position = (fingerprint & 0xFFFFFFFF) % m
+        step = ((fingerprint >> 32) | 1) % m
+        for _ in range(self.hash_count):
+            bits[position >> 3] |= 1 << (position & 7)
+            position += step
+            if position >= m:
+                position -= m
+        self.count += 1
+
+
+class ScalableBloomFilter:
+    """
+    件数に合わせて段を追加するブルームフィルタ
+
+    各段が容量に達すると、容量をgrowth倍、偽陽性率をtightening倍にした段を追加する。
+    段ごとの偽陽性率の和は false_positive_rate を超えないため、全体の偽陽性率
+    (既に加えていない値を含むと誤判定する確率)はfalse_positive_rate以下になる。
+    first_stageを指定すると、その番号の段から始める（extendで後から連結するため）。
+    """
+
+    def __init__(
+        self,
+        initial_capacity: int,
+        false_positive_rate: float = DEFAULT_FALSE_POSITIVE_RATE,
+        growth: int = 2,
+        tightening: float = 0.5,
+        first_stage: int = 0,
+    ):
+        """
+        Raises:
+            ValueError: 引数が範囲外の場合
+        """
+        if initial_capacity < 1:
+            raise ValueError(f"initial_capacity must be positive: {initial_capacity}")
+        if not 0 < false_positive_rate < 1:
+            raise ValueError(
+                f"false_positive_rate must be in (0, 1): {false_positive_rate}"
+            )
+        if growth < 1 or not 0 < tightening < 1:
+            raise ValueError("growth must be >= 1 and tightening must be in (0, 1)")
+        self.false_positive_rate = false_positive_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.first_stage = first_stage
+        # 初段の偽陽性率 p*(1-r) から始め、等比級数の和が p になるようにする
+        self.filters = [BloomFilter(initial_capacity, self._stage_rate(first_stage))]
+
+    def __contains__(self, fingerprint: int) -> bool:
+        for bloom in self.filters:
+            if fingerprint in bloom:
+                return True
+        return False
+
+    def __len__(self) -> int:
+        return sum(bloom.count for bloom in self.filters)
+
+    def add(self, fingerprint: int) -> None:
+        """フィンガープリントを1つ加える。最後の段が容量に達していれば段を追加する"""
+        last = self.filters[-1]
+        if last.count >= last.capacity:
+            last = BloomFilter(
+                last.capacity * self.growth,
+                self._stage_rate(self.first_stage + len(self.filters)),
+            )
+            self.filters.append(last)
+        last.add(fingerprint)
+
+    def extend(self, other: "ScalableBloomFilter") -> None:
+        """
+        この段の続きの番号から始めたフィルタの段を加え、両方の値を含むフィルタにする
+
+        Raises:
+            ValueError: otherの段の番号や偽陽性率の設定が続きになっていない場合
+        """
+        if (
+            other.first_stage != self.first_stage + len(self.filters)
+            or other.false_positive_rate != self.false_positive_rate
+            or other.tightening != self.tightening
+        ):
+            raise ValueError("other must continue the stages of this filter")
+        self.filters.extend(other.filters)
+
+    def _stage_rate(self, stage: int) -> float:
+        """stage番目の段の偽陽性率"""
+        return (
+            self.false_positive_rate * (1 - self.tightening) * self.tightening**stage
+        )
+
+    @property
+    def size_in_bytes(self) -> int:
+        """ビット配列の合計バイト数"""
+        return sum(len(bloom.bits) for bloom in self.filters)
+
+
+class RecordDeduplicator:
+    """
+    複数のファイルにまたがって重複する行を読み飛ばすためのフィンガープリント集合
+
+    ログのローテーションで同じ行が2つのファイルに現れる場合に使う。
+    取り込み済みのファイルに含まれていた行だけを重複とし、同じファイル内で
+    繰り返される行は重複としない。読み出し中の行のフィンガープリントはcommitまで
+    保留するため、フォーマット不正で集計しなかったファイルの行は記録に残らない。
+
+    max_exact_entries件までは集合で正確に判定し、超えるとScalableBloomFilterに
+    移し替える。以降はfalse_positive_rate以下の確率で、初めての行を重複と誤判定する
+    (重複を見逃すことはない)。1ファイルの保留もmax_exact_entries件を超えると
+    取り込み済みの段の続きとなる仮のフィルタに移し、commitで連結する。
+    """
+
+    def __init__(
+        self,
+        max_exact_entries: int = DEFAULT_MAX_EXACT_ENTRIES,
+        false_positive_rate: float = DEFAULT_FALSE_POSITIVE_RATE,
+    ):
+        """
+        Raises:
+            ValueError: 引数が範囲外の場合
+        """
+        if max_exact_entries < 1:
+            raise ValueError(f"max_exact_entries must be positive: {max_exact_entries}")
+        if not 0 < false_positive_rate < 1:
+            raise ValueError(
+                f"false_positive_rate must be in (0, 1): {false_positive_rate}"
+            )
+        self.max_exact_entries = max_exact_entries
+        self.false_positive_rate = false_positive_rate
+        self.seen: Set[int] = set()
+        self.bloom = None
+        self.pending: List[int] = []
+        self.pending_bloom: Optional[ScalableBloomFilter] = None
+        self.duplicates = 0
+
+    @property
+    def mode(self) -> str:
+        return DEDUP_MODE_EXACT if self.bloom is None else DEDUP_MODE_BLOOM
+
+    def __len__(self) -> int:
+        return len(self.seen) if self.bloom is None else len(self.bloom)
+
+    def is_new(self, line: bytes) -> bool:
+        """
+        行が取り込み済みのファイルに含まれていなければ真を返し、保留に加える。
+        重複なら偽を返し、重複件数を数える。
+        """
+        fingerprint = line_fingerprint(line)
+        if fingerprint in (self.seen if self.bloom is None else self.bloom):
+            self.duplicates += 1
+            return False
+        self.pending.append(fingerprint)
+        if len(self.pending) > self.max_exact_entries:
+            self._spill_pending()
+        return True
+
+    def commit(self) -> None:
+        """保留中のフィンガープリントを取り込み済みとして記録する"""
+        if self.pending_bloom is not None:
+            self._spill_pending()
+            if self.bloom is None:
+                self._switch_to_bloom()
+            self.bloom.extend(self.pending_bloom)
+            self.pending_bloom = None
+        elif self.bloom is None:
+            self.seen.update(self.pending)
+            if len(self.seen) > self.max_exact_entries:
+                self._switch_to_bloom()
+        else:
+            for fingerprint in self.pending:
+                self.bloom.add(fingerprint)
+        self.pending.clear()
+
+    def rollback(self) -> None:
+        """保留中のフィンガープリントを破棄する"""
+        self.pending.clear()
+        self.pending_bloom = None
+
+    @contextmanager
+    def transaction(self) -> Iterator["RecordDeduplicator"]:
+        """正常に抜ければcommitし、例外で抜ければrollbackする"""
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
+
+    def _switch_to_bloom(self) -> None:
+        # 取り込み済みの行は1段に収め、仮のフィルタを2段目から連結できるようにする
+        self.bloom = ScalableBloomFilter(
+            max(1, len(self.seen)), self.false_positive_rate
+        )
+        for fingerprint in self.seen:
+            self.bloom.add(fingerprint)
+        self.seen = set()
+
+    def _spill_pending(self) -> None:
+        """保留中のフィンガープリントを仮のブルームフィルタに移す"""
+        if self.pending_bloom is None:
+            # 取り込み済みの段の続きの番号から始め、偽陽性率の上限を共有する
+            first_stage = 1 if self.bloom is None else len(self.bloom.filters)
+            self.pending_bloom = ScalableBloomFilter(
+                self.max_exact_entries,
+                self.false_positive_rate,
+                first_stage=first_stage,
+            )
+        for fingerprint in self.pending:
+            self.pending_bloom.add(fingerprint)
+        self.pending.clear()
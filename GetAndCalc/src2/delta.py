@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from models import TIME_FORMAT
+
+
+class SummaryDeltaIndex:
+    """
+    前回までに出力したサマリー行のハッシュをSQLiteに保存し、差分の行だけを取り出すクラス
+
+    行は (EndTime, Site) をキーとし、全列の値から求めたハッシュで変化を判定する。
+    今回の集計に含まれない行は削除扱いにしない(収集範囲外になっただけのため)。
+    ハッシュの更新はcommitを呼ぶまで保留するため、出力に失敗した場合は
+    次回も同じ行が差分として出力される。
+    """
+
+    def __init__(self, db_path: str):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self._create_table()
+        self._pending: Dict[Tuple[str, str], str] = {}
+        self.counts = {"inserted": 0, "changed": 0, "unchanged": 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _create_table(self) -> None:
+        with self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS row_hashes (
+                    end_time TEXT NOT NULL,
+                    site TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    PRIMARY KEY (end_time, site)
+                )
+                """
+            )
+
+    def changed_rows(self, statistics: Iterable[Dict]) -> Iterator[Dict]:
+        """
+        前回から追加または変更された行だけを返す。
+
+        Raises:
+            ValueError: 行にEndTimeまたはSiteがない場合
+        """
+        previous = dict(
+            ((end_time, site), digest)
+            for end_time, site, digest in self.connection.execute(
+                "SELECT end_time, site, digest FROM row_hashes"
+            )
+        )
+
+        for stat in statistics:
+            try:
+                key = (stat["EndTime"], stat["Site"])
+            except (KeyError, TypeError):
+                raise ValueError("All elements must have EndTime and Site")
+
+            digest = _row_digest(stat)
+            previous_digest = previous.get(key)
+            if previous_digest == digest:
+                self.counts["unchanged"] += 1
+                continue
+
+            self.counts["inserted" if previous_digest is None else "changed"] += 1
+            self._pending[key] = digest
+            yield stat
+
+    def commit(self) -> None:
+        """差分として出力した行のハッシュを保存する"""
+        with self.connection:
+            self.connection.executemany(
+                """
+                INSERT INTO row_hashes (end_time, site, digest)
+                VALUES (?, ?, ?)
+                ON CONFLICT (end_time, site) DO UPDATE SET
+                    digest = excluded.digest
+                """,
+                (
+                    (end_time, site, digest)
+                    for (end_time, site), digest in self._pending.items()
+                ),
+            )
+        self._pending.clear()
+
+    def latest_end_time(self) -> Optional[str]:
+        """保存済みの行のうち最新の時刻(TIME_FORMAT)を返す。未保存なら None"""
+        return self.connection.execute(
+            "SELECT MAX(end_time) FROM row_hashes"
+        ).fetchone()[0]
+
+    def prune(self, before_endtime: str) -> None:
+        """指定した時刻(TIME_FORMAT)より前の行のハッシュを削除する"""
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM row_hashes WHERE end_time < ?", (before_endtime,)
+            )
+
+    def manifest(self, outputs: List[str]) -> Dict:
+        """差分出力の内容をまとめたマニフェストを返す"""
+        return {
+            "generated_at": datetime.now().strftime(TIME_FORMAT),
+            "outputs": [os.path.basename(path) for path in outputs],
+            "rows": self.counts["inserted"] + self.counts["changed"],
+            **self.counts,
+        }
+
+
+def write_manifest(manifest: Dict, path: str) -> None:
+    """マニフェストを一時ファイルに書き込んでから置き換える"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def _row_digest(stat: Dict) -> str:
+    """列名と値の並びから行のハッシュを求める"""
+    content = "\x1f".join(f"{col}\x1e{value}" for col, value in stat.items())
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
@@ -8,3 +8,9 @@ class CollectionError(Exception):
     """ファイル収集時のエラー"""
 
     pass
+
+
+class ChunkBoundaryError(ValueError):
+    """ファイルを分割して読む際、クォート内の改行が範囲の境界をまたぐときのエラー"""
+
+    pass
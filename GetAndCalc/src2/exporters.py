@@ -1,9 +1,38 @@
 import csv
 import json
 import os
+import queue
+import sqlite3
+import threading
+import uuid
 from abc import ABC, abstractmethod
 from io import StringIO
-from typing import Dict, List
+from itertools import chain, islice
+from operator import itemgetter
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    TextIO,
+    Tuple,
+)
+
+try:
+    import orjson
+except ImportError:  # 無い場合は標準のjsonでエンコードする
+    orjson = None
+
+from models import DEFAULT_SUCCESS_RATE
+
+SQLITE_TABLE_NAME = "success_rate_summary"
+FANOUT_BATCH_SIZE = 1024  # 出力先のスレッドへまとめて渡す行数
+FANOUT_QUEUE_BATCHES = 16  # 出力先ごとに溜めておけるバッチ数
+
+ExportSink = Callable[[Iterable[Dict]], None]
 
 
 class StatisticsFormatter(ABC):
@@ -13,27 +42,95 @@ class StatisticsFormatter(ABC):
     def format(self, statistics: List[Dict]) -> str:
         pass
 
+    def write(self, statistics: Iterable[Dict], file: TextIO) -> None:
+        """
+        統計結果をファイルへ書き込む。
+        逐次書き込みに対応しないフォーマッタは全件を文字列にしてから書き込む。
+        """
+        file.write(self.format(list(statistics)))
+
 
 class CSVFormatter(StatisticsFormatter):
-    """CSV形式でフォーマットするクラス"""
+    """
+    CSV形式でフォーマットするクラス
+
+    schemaに列名を指定すると、列の取り出しを一度だけ組み立てて各行に適用する。
+    この場合は行ごとのキーの一致確認を行わず、schemaにない列は出力しない。
+    """
+
+    def __init__(self, schema: Optional[Sequence[str]] = None):
+        self.schema = None
+        self._row_getter = None
+        if schema is not None:
+            self.schema, self._row_getter = _compile_schema(schema)
 
     def format(self, statistics: List[Dict]) -> str:
-        if not statistics:
-            return ""
+        output = StringIO()
+        self.write(statistics, output)
+        return output.getvalue()
 
-        if not all(isinstance(stat, dict) for stat in statistics):
-            raise ValueError("All elements must be of type dict")
+    def write(self, statistics: Iterable[Dict], file: TextIO) -> None:
+        """
+        統計結果を1行ずつCSVとして書き込む。
 
-        headers = statistics[0].keys()
+        Raises:
+            ValueError: 要素がdictでない、またはキーが先頭の要素(schema指定時はschema)と一致しない場合
+        """
+        rows = iter(statistics)
+        first = next(rows, None)
+        if first is None:
+            return
+        if self.schema is not None:
+            self._write_with_schema(chain((first,), rows), file)
+            return
+        if not isinstance(first, dict):
+            raise ValueError("All elements must be of type dict")
 
-        if not all(set(stat.keys()) == set(headers) for stat in statistics):
-            raise ValueError("All elements must have the same keys")
+        headers = first.keys()
+        header_set = set(headers)
 
-        output = StringIO()
-        writer = csv.DictWriter(output, headers)
+        writer = csv.DictWriter(file, headers)
         writer.writeheader()
-        writer.writerows(statistics)
-        return output.getvalue()
+        writer.writerow(first)
+        for stat in rows:
+            if not isinstance(stat, dict):
+                raise ValueError("All elements must be of type dict")
+            if stat.keys() != header_set:
+                raise ValueError("All elements must have the same keys")
+            writer.writerow(stat)
+
+    def _write_with_schema(self, statistics: Iterator[Dict], file: TextIO) -> None:
+        writer = csv.writer(file)
+        writer.writerow(self.schema)
+        try:
+            writer.writerows(map(self._row_getter, statistics))
+        except KeyError as e:
+            raise ValueError(f"Element is missing schema column: {e}")
+        except TypeError:
+            raise ValueError("All elements must be of type dict")
+
+
+def _compile_schema(
+    schema: Sequence[str],
+) -> Tuple[List[str], Callable[[Dict], Tuple]]:
+    """
+    列名の並びを検証し、行から列の値をその順に取り出す関数を組み立てる。
+
+    Raises:
+        ValueError: 列名が空、文字列でない、または重複している場合
+    """
+    columns = list(schema)
+    if not columns:
+        raise ValueError("Schema must have at least one column")
+    if not all(isinstance(col, str) for col in columns):
+        raise ValueError("Schema columns must be of type str")
+    if len(set(columns)) != len(columns):
+        raise ValueError("Schema columns must be unique")
+
+    if len(columns) == 1:
+        column = columns[0]
+        return columns, lambda stat: (stat[column],)
+    return columns, itemgetter(*columns)
 
 
 class JSONFormatter(StatisticsFormatter):
@@ -42,6 +139,39 @@ class JSONFormatter(StatisticsFormatter):
     def format(self, statistics: List[Dict]) -> str:
         return json.dumps(statistics, ensure_ascii=False, indent=2)
 
+    def write(self, statistics: Iterable[Dict], file: TextIO) -> None:
+        """統計結果を1要素ずつJSON配列として書き込む(formatと同じ出力になる)"""
+        separator = "[\n"
+        for stat in statistics:
+            element = json.dumps(stat, ensure_ascii=False, indent=2)
+            file.write(separator)
+            file.write("  " + element.replace("\n", "\n  "))
+            separator = ",\n"
+        file.write("[]" if separator == "[\n" else "\n]")
+
+
+class NDJSONFormatter(StatisticsFormatter):
+    """1行に1要素のJSON(NDJSON)形式でフォーマットするクラス"""
+
+    def format(self, statistics: List[Dict]) -> str:
+        output = StringIO()
+        self.write(statistics, output)
+        return output.getvalue()
+
+    def write(self, statistics: Iterable[Dict], file: TextIO) -> None:
+        """統計結果を1要素ずつエンコードし、1行ずつ書き込む"""
+        encode = _ndjson_encoder()
+        for stat in statistics:
+            file.write(encode(stat))
+            file.write("\n")
+
+
+def _ndjson_encoder() -> Callable[[Dict], str]:
+    """1要素を改行を含まないJSON文字列にする関数を返す。orjsonがあればそちらを使う"""
+    if orjson is not None:
+        return lambda stat: orjson.dumps(stat).decode("utf-8")
+    return json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
 
 class StatisticsExporter:
     """統計結果のエクスポートを担当するクラス"""
@@ -49,14 +179,216 @@ class StatisticsExporter:
     def __init__(self, formatter: StatisticsFormatter):
         self.formatter = formatter
 
-    def export(self, statistics: List[Dict], output_path: str) -> None:
-        """統計結果をファイルに出力"""
-        formatted_data = self.formatter.format(statistics)
+    def export(self, statistics: Iterable[Dict], output_path: str) -> None:
+        """
+        統計結果をファイルに出力する。
+        出力先と同じディレクトリの一時ファイルへ逐次書き込み、完了後に置き換えるため、
+        出力先に書きかけのファイルが現れることはない。
+        """
         self._ensure_directory(output_path)
+        temp_path = self._temp_path(output_path)
 
-        with open(output_path, "w", encoding="utf-8") as file:
-            file.write(formatted_data)
+        try:
+            with open(temp_path, "x", encoding="utf-8") as file:
+                self.formatter.write(statistics, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, output_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def append(self, statistics: Iterable[Dict], output_path: str) -> None:
+        """
+        統計結果を既存ファイルの末尾に追記する。
+        NDJSONのように追記しても形式が崩れないフォーマッタで使う。
+        """
+        self._ensure_directory(output_path)
+
+        with open(output_path, "a", encoding="utf-8") as file:
+            self.formatter.write(statistics, file)
 
     def _ensure_directory(self, file_path: str) -> None:
         directory = os.path.dirname(file_path)
-        os.makedirs(directory, exist_ok=True)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _temp_path(self, file_path: str) -> str:
+        """出力先と同じディレクトリに、出力ファイル名と衝突しない一時ファイル名を作る"""
+        directory, name = os.path.split(file_path)
+        return os.path.join(directory, f".{name}.{uuid.uuid4().hex}.tmp")
+
+
+class SQLiteStatisticsExporter:
+    """
+    統計結果をSQLiteデータベースへ一括でupsertするクラス
+
+    RecordAggregator.summarizeと同じ (EndTime, Site, App) 単位の行を受け取り、
+    そのまま保存する。CSV向けにサイト単位へまとめた行は使わないため、
+    集計に現れなかったアプリの行は作らず、分ごとの件数もそのまま残る。
+    同じキーの行は最新の実行結果で上書きする。
+    期間やサイトを指定した検索がインデックスで引けるよう、
+    (EndTime, Site, App) の主キーと (Site, EndTime) のインデックスを作成する。
+    """
+
+    def export(self, statistics: Iterable[Dict], output_path: str) -> None:
+        """
+        統計結果をデータベースに出力する。
+        全行を1つのトランザクションで書き込み、失敗した場合は何も反映しない。
+
+        Raises:
+            ValueError: 要素がdictでない、または必要な列がない場合
+        """
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        connection = sqlite3.connect(output_path)
+        try:
+            with connection:
+                self._create_table(connection)
+                connection.executemany(
+                    f"""
+                    INSERT INTO {SQLITE_TABLE_NAME}
+                        (end_time, site, app, total, success, success_rate)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (end_time, site, app) DO UPDATE SET
+                        total = excluded.total,
+                        success = excluded.success,
+                        success_rate = excluded.success_rate
+                    """,
+                    self._to_rows(statistics),
+                )
+        finally:
+            connection.close()
+
+    def _create_table(self, connection: sqlite3.Connection) -> None:
+        connection.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {SQLITE_TABLE_NAME} (
+                end_time TEXT NOT NULL,
+                site TEXT NOT NULL,
+                app TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                success INTEGER NOT NULL,
+                success_rate REAL NOT NULL,
+                PRIMARY KEY (end_time, site, app)
+            )
+            """
+        )
+        connection.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS idx_{SQLITE_TABLE_NAME}_site_end_time
+            ON {SQLITE_TABLE_NAME} (site, end_time)
+            """
+        )
+
+    def _to_rows(self, statistics: Iterable[Dict]) -> Iterator[Tuple]:
+        """(EndTime, Site, App) 単位の行を挿入する値の組にする"""
+        for stat in statistics:
+            if not isinstance(stat, dict):
+                raise ValueError("All elements must be of type dict")
+            try:
+                total = int(stat["TotalCount"])
+                success = int(stat["SuccessCount"])
+                row = (stat["EndTime"], stat["Site"], stat["App"], total, success)
+            except KeyError as e:
+                raise ValueError(f"All elements must have the same keys: {e}")
+            yield row + (success / total * 100 if total else DEFAULT_SUCCESS_RATE,)
+
+
+class FanOutExporter:
+    """
+    統計結果を1回だけ走査し、複数の出力先へ同時に書き込むクラス
+
+    出力先は行のイテラブルを受け取る関数で、それぞれ専用のスレッドで実行する。
+    行はバッチにまとめ、出力先ごとの上限付きキューで渡すため、
+    遅い出力先があっても溜まる行数は一定に収まる。
+    統計結果の走査中に例外が起きた場合は全出力先を中断させて再送出する。
+    出力先で起きた例外は、他の出力先が書き終えてから再送出する。
+    """
+
+    def __init__(
+        self,
+        sinks: List[ExportSink],
+        batch_size: int = FANOUT_BATCH_SIZE,
+        queue_batches: int = FANOUT_QUEUE_BATCHES,
+    ):
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.queue_batches = queue_batches
+
+    def export(self, statistics: Iterable[Dict]) -> None:
+        """統計結果を全出力先に書き込む"""
+        workers = [_SinkWorker(sink, self.queue_batches) for sink in self.sinks]
+        for worker in workers:
+            worker.start()
+
+        try:
+            rows = iter(statistics)
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    break
+                for worker in workers:
+                    worker.batches.put(batch)
+        except BaseException:
+            self._finish(workers, _ABORT)
+            raise
+
+        self._finish(workers, _END)
+        for worker in workers:
+            if worker.error is not None:
+                raise worker.error
+
+    def _finish(self, workers: List["_SinkWorker"], marker: object) -> None:
+        for worker in workers:
+            worker.batches.put(marker)
+        for worker in workers:
+            worker.join()
+
+
+_END = object()
+_ABORT = object()
+
+
+class _FanOutAborted(Exception):
+    """統計結果の走査が失敗し、出力を中断するときに出力先へ送出する例外"""
+
+
+class _SinkWorker(threading.Thread):
+    """1つの出力先へキューから受け取った行を渡すスレッド"""
+
+    def __init__(self, sink: ExportSink, queue_batches: int):
+        super().__init__(daemon=True)
+        self.sink = sink
+        self.batches: queue.Queue = queue.Queue(queue_batches)
+        self.error: Optional[BaseException] = None
+        self._closed = False
+
+    def run(self) -> None:
+        try:
+            self.sink(self._rows())
+        except _FanOutAborted:
+            pass
+        except BaseException as e:
+            self.error = e
+        # 出力先が途中で止まっても、送り手が詰まらないよう残りを読み捨てる
+        while not self._closed:
+            self._next_batch()
+
+    def _next_batch(self) -> object:
+        batch = self.batches.get()
+        if batch is _END or batch is _ABORT:
+            self._closed = True
+        return batch
+
+    def _rows(self) -> Iterator[Dict]:
+        while True:
+            batch = self._next_batch()
+            if batch is _END:
+                return
+            if batch is _ABORT:
+                raise _FanOutAborted()
+            yield from batch
@@ -1,16 +1,66 @@
 import json
 import logging
 import os
-from datetime import datetime
-from typing import Dict, List
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Dict, Iterable, List, Optional
 
-from exporters import CSVFormatter, StatisticsExporter
+from dedup import RecordDeduplicator
+from delta import SummaryDeltaIndex, write_manifest
+from exporters import (
+    CSVFormatter,
+    FanOutExporter,
+    NDJSONFormatter,
+    SQLiteStatisticsExporter,
+    StatisticsExporter,
+)
 from file_collector import FileCollector
-from models import RecordAggregator, RecordReader
+from models import (
+    AGGREGATE_ENGINE_PYTHON,
+    DEFAULT_SUCCESS_RULES,
+    READER_MODE_COLUMNAR,
+    READER_MODE_TEXT,
+    TIME_FORMAT,
+    RecordAggregator,
+    RecordFilter,
+    RecordReader,
+    aggregate_file,
+    aggregate_range,
+    create_aggregator,
+    merge_aggregators,
+)
+from rollup_store import RollupStore
+from sampling import SampledRecordAggregator
+from spill import SpillingRecordAggregator
+from state_store import AggregationStateStore
+from success_rules import SuccessRules
 
-from exceptions import CollectionError
+from exceptions import ChunkBoundaryError, CollectionError
 
 BASE_DIR = ""
+AGGREGATE_ENGINE = AGGREGATE_ENGINE_PYTHON  # "python" または "numpy"
+READER_MODE = READER_MODE_TEXT  # "text"、"mmap" または "columnar"(列形式のサイドカーを使う)
+AGGREGATE_WORKERS = 1  # 2以上でファイル単位にプロセスプールで並列集計
+FILES_IN_FLIGHT_PER_WORKER = 2  # 並列集計時、結果を取り込む前に投入しておくワーカーあたりのファイル数
+CHUNK_SIZE = 64 * 1024 * 1024  # 並列集計時、これを超えるファイルはファイル内も分割する
+INCREMENTAL_AGGREGATE = False  # Trueで集計状態を保存し、前回からの差分だけを集計する
+STATE_RETENTION_MINUTES = 24 * 60  # 保存した集計状態を保持する期間
+MAX_GROUPS = 0  # 1以上でメモリ上の集計キー数の上限。超えた分は一時ファイルに書き出す
+EXPORT_SQLITE = False  # TrueでCSVに加えてSQLiteデータベースにも集計結果を出力する
+EXPORT_NDJSON = False  # TrueでCSVに加えてNDJSONファイルにも集計結果を追記する
+DELTA_EXPORT = False  # Trueで前回の出力から追加・変更された行だけを出力する
+# 読み出し時に絞り込む条件。例: RecordFilter(sites={"SiteA"}, start="2024/01/01 00:00:00")
+# 除外した行の時刻の形式不正は検出しないため、絞り込まない場合に不正として
+# 集計しないファイルも集計されることがある
+RECORD_FILTER = None
+# 0より大きい値(1以下)で、各ファイルの区間をこの割合だけ抽出して件数と成功率を推定する
+SAMPLE_RATE = 0
+DEDUPLICATE = False  # Trueでローテーションなどで複数のファイルに現れた同じ行を1回だけ数える
+DEDUP_MAX_EXACT_ROWS = 1_000_000  # これを超えると重複判定をブルームフィルタに切り替える
+DEDUP_FALSE_POSITIVE_RATE = 0.001  # ブルームフィルタで初めての行を重複と誤判定する確率の上限
+ROLLUP_STORE = False  # Trueで集計結果を1分・5分・1時間・1日単位でSQLiteに蓄積する
 
 start_datetime = datetime.now()
 start_date = start_datetime.strftime("%Y%m%d")
@@ -22,8 +72,76 @@ class Main:
     データ収集、集計、エクスポートを行うメイン処理クラス。
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        aggregate_engine: str = AGGREGATE_ENGINE_PYTHON,
+        reader_mode: str = READER_MODE_TEXT,
+        workers: int = 1,
+        chunk_size: int = CHUNK_SIZE,
+        incremental: bool = False,
+        max_groups: int = 0,
+        export_sqlite: bool = False,
+        export_ndjson: bool = False,
+        delta_export: bool = False,
+        record_filter: Optional[RecordFilter] = None,
+        sample_rate: float = 0,
+        deduplicate: bool = False,
+        rollup_store: bool = False,
+    ):
+        """
+        Raises:
+            ValueError: 同時に使えない設定を指定した場合
+        """
+        if incremental and record_filter is not None:
+            # 保存済みの集計状態と絞り込み条件が食い違うため併用しない
+            raise ValueError(
+                "record_filter cannot be used with incremental aggregation"
+            )
+        if incremental and reader_mode == READER_MODE_COLUMNAR:
+            # 累積集計は追記されたバイト範囲だけを読むため、ファイル全体を対象とする
+            # サイドカーは使えない（text/mmapはどちらも同じ行を返すバイト列の走査で読む）
+            raise ValueError(
+                "columnar reader_mode cannot be used with incremental aggregation"
+            )
+        if sample_rate and (incremental or delta_export):
+            # 推定値を保存済みの集計状態や出力済みの行と混ぜないため併用しない
+            raise ValueError(
+                "sample_rate cannot be used with incremental aggregation "
+                "or delta export"
+            )
+        if sample_rate and rollup_store:
+            raise ValueError("sample_rate cannot be used with rollup_store")
+        if deduplicate and (
+            incremental
+            or sample_rate
+            or workers > 1
+            or reader_mode == READER_MODE_COLUMNAR
+        ):
+            # 重複判定は元の行を1プロセスで順に読む場合だけ行える
+            raise ValueError(
+                "deduplicate requires sequential text or mmap reading "
+                "without incremental aggregation or sampling"
+            )
         self.logger = logging.getLogger(__name__)
+        self.aggregate_engine = aggregate_engine
+        self.reader_mode = reader_mode
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.incremental = incremental
+        self.max_groups = max_groups
+        self.export_sqlite = export_sqlite
+        self.export_ndjson = export_ndjson
+        self.delta_export = delta_export
+        self.record_filter = record_filter
+        self.sample_rate = sample_rate
+        self.deduplicator = (
+            RecordDeduplicator(DEDUP_MAX_EXACT_ROWS, DEDUP_FALSE_POSITIVE_RATE)
+            if deduplicate
+            else None
+        )
+        self.rollup_store = rollup_store
+        self.success_rules = DEFAULT_SUCCESS_RULES
+        self.summary_header = None
         self.log_file_path = self._get_log_file_path()
         self._setup_logging()
         self._setup_paramiko_logging()
@@ -61,7 +179,7 @@ class Main:
         paramiko_logger.addHandler(paramiko_null_handler)
         paramiko_logger.propagate = False
 
-    def run(self, sftp_config_path: str) -> None:
+    def run(self, sftp_config_path: str, success_rules_path: str = "") -> None:
         """
         メイン処理を実行する。
 
@@ -71,6 +189,7 @@ class Main:
         try:
             self.logger.info("Starting config load")
             sftp_config = self._load_config(sftp_config_path)
+            self.success_rules = self._load_success_rules(success_rules_path)
 
             self.logger.info("Starting file collection")
             collected_files = self._collect_files(sftp_config)
@@ -85,7 +204,7 @@ class Main:
                 return
 
             self.logger.info("Starting statistics export")
-            self._export_csv(summary_records)
+            self._export_summary(summary_records)
 
             self.logger.info("Aggregate completed successfully")
         except Exception as e:
@@ -102,6 +221,18 @@ class Main:
         with open(config_path, "r", encoding="utf-8") as f:
             return json.load(f)
 
+    def _load_success_rules(self, config_path: str) -> SuccessRules:
+        """
+        成功判定規則の設定ファイルを読み込む。ファイルがなければ既定の規則を使う。
+
+        Raises:
+            ValueError: 設定の形式が不正な場合
+        """
+        if not config_path or not os.path.exists(config_path):
+            self.logger.info("Success rules file not found, using default rules")
+            return DEFAULT_SUCCESS_RULES
+        return SuccessRules.load(config_path)
+
     def _collect_files(self, sftp_config: Dict) -> List[str]:
         """
         SFTPサーバーからファイルを収集する。
@@ -133,42 +264,346 @@ class Main:
         """
         収集したファイルからレコードを集計する。
         """
-        aggregator = RecordAggregator()
+        if self.sample_rate:
+            aggregator = self._aggregate_records_sampled(local_files)
+        elif self.incremental:
+            aggregator = self._aggregate_records_incremental(local_files)
+        elif self.workers > 1:
+            aggregator = self._aggregate_records_parallel(local_files)
+        else:
+            aggregator = self._new_aggregator()
+            for fp in local_files:
+                try:
+                    encoded = RecordReader.read_encoded(
+                        fp,
+                        self.reader_mode,
+                        self.success_rules,
+                        self.record_filter,
+                        self.deduplicator,
+                    )
+                    aggregator.process_encoded(encoded)
+                    self.logger.info(f"Successfully aggregated file: {fp}")
+                except Exception as e:
+                    self._log_aggregate_failure(fp, e)
+            if self.deduplicator is not None:
+                self.logger.info(
+                    f"Skipped {self.deduplicator.duplicates} duplicate rows "
+                    f"({self.deduplicator.mode} mode)"
+                )
+
+        self.summary_header = aggregator.summary_header()
+        if isinstance(aggregator, SpillingRecordAggregator):
+            with aggregator:
+                self._update_rollups(aggregator)
+                self._export_entries(aggregator)
+                return aggregator.format_summary(by_minute=self.incremental)
+        self._update_rollups(aggregator)
+        self._export_entries(aggregator)
+        # 累積集計は複数回の実行分の時刻を持つため、サイトごとにまとめず分ごとに出力する
+        return aggregator.format_summary(by_minute=self.incremental)
+
+    def _update_rollups(self, aggregator: RecordAggregator) -> None:
+        """
+        集計結果を粒度ごとのロールアップに反映する。同じ分の値は今回の集計結果で置き換える。
+        """
+        if not self.rollup_store:
+            return
+        db_path = os.path.join(BASE_DIR, "OUTPUT", "success_rate_rollups.db")
+        with RollupStore(db_path) as store:
+            changed = store.update(aggregator.iter_entries())
+        self.logger.info(f"Rollups updated: {changed} changed rows")
+
+    def _export_entries(self, aggregator: RecordAggregator) -> None:
+        """
+        集計結果を(EndTime, Site, App)単位の行のままSQLiteに蓄積する。
+        CSV向けにサイト単位へまとめた行ではなく、集計キーごとの結果を渡す。
+        """
+        if not self.export_sqlite or self.sample_rate:
+            return
+        db_path = os.path.join(BASE_DIR, "OUTPUT", "success_rate_summary.db")
+        SQLiteStatisticsExporter().export(aggregator.iter_summary(), db_path)
+        self.logger.info(f"Exported successfully: {db_path}")
+
+    def _new_aggregator(self) -> RecordAggregator:
+        """
+        設定に応じた集計用のアグリゲータを生成する。
+        集計キー数の上限を指定した場合はpythonエンジンで一時ファイルに書き出しながら集計する。
+        """
+        if self.max_groups:
+            return SpillingRecordAggregator(
+                max_groups=self.max_groups, success_rules=self.success_rules
+            )
+        return create_aggregator(self.aggregate_engine, self.success_rules)
+
+    def _aggregate_records_sampled(self, local_files: List[str]) -> RecordAggregator:
+        """
+        各ファイルの一部の区間だけを読み、件数と成功率を信頼区間つきで推定する。
+        """
+        aggregator = SampledRecordAggregator(
+            self.sample_rate, success_rules=self.success_rules
+        )
         for fp in local_files:
             try:
-                with open(fp, "r", encoding="utf-8") as f:
-                    records = RecordReader.from_textio(f)
-                    aggregator.process(records)
-                self.logger.info(f"Successfully aggregated file: {fp}")
-            except OSError as e:
-                self.logger.warning(f"Failed to open file {fp}: {e}")
-            except ValueError as e:
-                self.logger.warning(f"Invalid format file, nocounted {fp}: {e}")
+                count = aggregator.process_file(fp, self.record_filter)
+                self.logger.info(f"Successfully sampled file: {fp} ({count} rows)")
+            except Exception as e:
+                self._log_aggregate_failure(fp, e)
+        return aggregator
+
+    def _aggregate_records_incremental(
+        self, local_files: List[str]
+    ) -> RecordAggregator:
+        """
+        前回の実行以降に追記された行だけを集計して保存し、保存済みの集計結果全体を返す。
+        保存済みの集計結果は、実行時刻ではなく最新の終了時刻から保持期間より前の分を削除する。
+        """
+        with AggregationStateStore(self._get_state_db_path()) as store:
+            for fp in local_files:
+                try:
+                    count = store.aggregate_file(
+                        self._build_file_key(fp),
+                        fp,
+                        self.aggregate_engine,
+                        self.success_rules,
+                    )
+                    self.logger.info(
+                        f"Successfully aggregated file: {fp} ({count} new)"
+                    )
+                except Exception as e:
+                    self._log_aggregate_failure(fp, e)
+
+            latest = store.latest_endtime()
+            if latest is not None:
+                store.prune(latest - STATE_RETENTION_MINUTES)
+            return store.load(self._new_aggregator())
+
+    def _get_state_db_path(self) -> str:
+        """
+        集計状態を保存するSQLiteファイルのパスを生成する。
+        """
+        return os.path.join(BASE_DIR, "STATE", "aggregation_state.db")
+
+    def _build_file_key(self, local_path: str) -> str:
+        """
+        実行ごとに異なる受信ディレクトリに依らない、ファイルの識別キーを構築する。
+        """
+        child_dir = os.path.basename(os.path.dirname(local_path))
+        return os.path.join(child_dir, os.path.basename(local_path))
+
+    def _aggregate_records_parallel(self, local_files: List[str]) -> RecordAggregator:
+        """
+        ファイルごとの集計をプロセスプールで並列に行い、結果を合算する。
+        chunk_sizeを超えるファイルは改行位置で区切ったバイト範囲ごとに並列で集計する。
+
+        投入するファイル数をワーカー数の一定倍までに抑え、1ファイル分の結果が揃うたびに
+        アグリゲータへ取り込む。ファイルごとの結果を全ファイル分保持しないため、
+        集計キー数の上限を指定した場合もメモリ使用量は上限付近に収まる。
+        """
+        aggregator = self._new_aggregator()
+        in_flight: deque = deque()
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for fp in local_files:
+                in_flight.append((fp, self._submit_file(executor, fp)))
+                if len(in_flight) >= self.workers * FILES_IN_FLIGHT_PER_WORKER:
+                    self._merge_file_result(aggregator, *in_flight.popleft())
+            while in_flight:
+                self._merge_file_result(aggregator, *in_flight.popleft())
+        return aggregator
+
+    def _merge_file_result(
+        self, aggregator: RecordAggregator, file_path: str, futures: List[Future]
+    ) -> None:
+        """
+        1ファイル分の集計結果をアグリゲータに取り込む。失敗した場合はログに残して読み飛ばす。
+        """
+        try:
+            aggregator.merge(self._collect_file_result(file_path, futures))
+            self.logger.info(f"Successfully aggregated file: {file_path}")
+        except Exception as e:
+            self._log_aggregate_failure(file_path, e)
+
+    def _submit_file(
+        self, executor: ProcessPoolExecutor, file_path: str
+    ) -> List[Future]:
+        """
+        1ファイル分の集計をプロセスプールに投入する。
+        """
+        try:
+            split = os.path.getsize(file_path) > self.chunk_size
+        except OSError:
+            split = False  # 開けないファイルのエラーはワーカー側で報告させる
+
+        if not split:
+            return [
+                executor.submit(
+                    aggregate_file,
+                    file_path,
+                    self.aggregate_engine,
+                    self.reader_mode,
+                    self.success_rules,
+                    self.record_filter,
+                )
+            ]
+
+        try:
+            header, ranges = RecordReader.split_ranges(file_path, self.chunk_size)
+        except Exception as e:
+            failed: Future = Future()
+            failed.set_exception(e)
+            return [failed]
+
+        return [
+            executor.submit(
+                aggregate_range,
+                file_path,
+                header,
+                start,
+                end,
+                self.aggregate_engine,
+                self.success_rules,
+                self.record_filter,
+            )
+            for start, end in ranges
+        ]
+
+    def _collect_file_result(
+        self, file_path: str, futures: List[Future]
+    ) -> RecordAggregator:
+        """
+        1ファイル分の集計結果を合算する。1範囲でも失敗すればファイル全体を集計しない。
+
+        Raises:
+            OSError: ファイルを開けない場合
+            ValueError: フォーマット不正の場合
+        """
+        partials = []
+        errors = []
+        for future in futures:
+            try:
+                partials.append(future.result())
             except Exception as e:
-                self.logger.warning(f"Failed aggregate {fp}: {e}")
-        return aggregator.format_summary()
+                errors.append(e)
 
-    def _export_csv(self, summary_records: List[Dict]) -> None:
+        if any(isinstance(e, ChunkBoundaryError) for e in errors):
+            self.logger.info(
+                f"Quoted newline across chunks, re-aggregating: {file_path}"
+            )
+            return aggregate_file(
+                file_path,
+                self.aggregate_engine,
+                self.reader_mode,
+                self.success_rules,
+                self.record_filter,
+            )
+        if errors:
+            raise errors[0]
+
+        aggregator = merge_aggregators(partials)
+        # 絞り込み時は条件を満たす行が無いだけの場合があるため空でも正常とする
+        if not aggregator.site_app_stats and self.record_filter is None:
+            raise ValueError("No data rows found in the file")
+        return aggregator
+
+    def _log_aggregate_failure(self, file_path: str, error: Exception) -> None:
         """
-        集計結果をCSVファイルにエクスポートする。
+        集計に失敗したファイルを例外の種類に応じてログに残す。
+        """
+        if isinstance(error, OSError):
+            self.logger.warning(f"Failed to open file {file_path}: {error}")
+        elif isinstance(error, ValueError):
+            self.logger.warning(f"Invalid format file, nocounted {file_path}: {error}")
+        else:
+            self.logger.warning(f"Failed aggregate {file_path}: {error}")
+
+    def _export_summary(self, summary_records: Iterable[Dict]) -> None:
+        """
+        集計結果を有効な形式すべてにエクスポートする。
+        集計結果は1回だけ走査し、形式ごとのスレッドで同時に書き込む。
+        サイト単位の行は全時刻の集計結果をまとめて作るため、集計結果はformat_summaryの
+        リストとして受け取る。並列になるのは出力先ごとの書き込みだけで、行の生成は含まない。
 
         Raises:
             FileWriteError: ファイル書き込みエラー
         """
+        output_dir = os.path.join(BASE_DIR, "OUTPUT")
 
+        # CSVは実行ごとに作成し、NDJSONは実行をまたいで同じファイルに蓄積する
+        # (SQLiteへは集計時に集計キーごとの行を蓄積する)
+        stats_name = "success_rate_summary"
+        if self.sample_rate:
+            # 推定値は蓄積先に混ぜず、実行ごとのCSVにだけ出力する
+            stats_name = "success_rate_estimate"
+        elif self.delta_export:
+            stats_name += "_delta"
         stats_path = os.path.join(
-            os.path.join(BASE_DIR, "OUTPUT"),
-            f"success_rate_summary_{start_date}{start_hhmm}.csv",
+            output_dir, f"{stats_name}_{start_date}{start_hhmm}.csv"
         )
-        exporter = StatisticsExporter(CSVFormatter())
-        exporter.export(summary_records, stats_path)
-        self.logger.info(f"Exported successfully: {stats_path}")
+        csv_exporter = StatisticsExporter(CSVFormatter(self.summary_header))
+        sinks = {stats_path: partial(csv_exporter.export, output_path=stats_path)}
+
+        if self.export_ndjson and not self.sample_rate:
+            # ログ転送ツールで追跡できるよう追記する
+            ndjson_path = os.path.join(output_dir, "success_rate_summary.ndjson")
+            ndjson_exporter = StatisticsExporter(NDJSONFormatter())
+            sinks[ndjson_path] = partial(
+                ndjson_exporter.append, output_path=ndjson_path
+            )
+
+        if self.delta_export:
+            self._export_delta(summary_records, sinks, stats_path)
+        else:
+            FanOutExporter(list(sinks.values())).export(summary_records)
+        for path in sinks:
+            self.logger.info(f"Exported successfully: {path}")
+
+    def _export_delta(
+        self, summary_records: Iterable[Dict], sinks: Dict, stats_path: str
+    ) -> None:
+        """
+        前回の出力から追加・変更された行だけを各形式にエクスポートし、マニフェストを作成する。
+        全形式の出力に成功した場合のみ、出力した行を次回の比較対象として保存する。
+        """
+        index_path = os.path.join(BASE_DIR, "STATE", "export_index.db")
+        with SummaryDeltaIndex(index_path) as index:
+            FanOutExporter(list(sinks.values())).export(
+                index.changed_rows(summary_records)
+            )
+            index.commit()
+
+            # 過去分を遡って出力した行を直後に消さないよう、最新の時刻から数える
+            latest = index.latest_end_time()
+            if latest is not None:
+                retention = timedelta(minutes=STATE_RETENTION_MINUTES)
+                cutoff = datetime.strptime(latest, TIME_FORMAT) - retention
+                index.prune(cutoff.strftime(TIME_FORMAT))
+
+            manifest_path = f"{os.path.splitext(stats_path)[0]}.manifest.json"
+            write_manifest(index.manifest(list(sinks)), manifest_path)
+            self.logger.info(
+                f"Delta exported: {index.counts['inserted']} inserted, "
+                f"{index.counts['changed']} changed, "
+                f"{index.counts['unchanged']} unchanged"
+            )
 
 
 if __name__ == "__main__":
     script_dir = os.path.dirname(os.path.abspath(__file__))
     config_dir = os.path.join(script_dir, "../config")
     sftp_config = os.path.join(config_dir, "sftp_config.json")
+    success_rules = os.path.join(config_dir, "success_rules.json")
 
-    manager = Main()
-    manager.run(sftp_config)
+    manager = Main(
+        aggregate_engine=AGGREGATE_ENGINE,
+        reader_mode=READER_MODE,
+        workers=AGGREGATE_WORKERS,
+        incremental=INCREMENTAL_AGGREGATE,
+        max_groups=MAX_GROUPS,
+        export_sqlite=EXPORT_SQLITE,
+        export_ndjson=EXPORT_NDJSON,
+        delta_export=DELTA_EXPORT,
+        record_filter=RECORD_FILTER,
+        sample_rate=SAMPLE_RATE,
+        deduplicate=DEDUPLICATE,
+        rollup_store=ROLLUP_STORE,
+    )
+    manager.run(sftp_config, success_rules)
@@ -1,13 +1,124 @@
 import csv
-from collections import defaultdict
+import heapq
+import io
+import mmap
+import os
+from array import array
+from collections import Counter, defaultdict
+from contextlib import nullcontext
 from datetime import datetime, timedelta
-from typing import DefaultDict, Dict, Iterator, List, TextIO, Tuple
+from functools import lru_cache
+from itertools import compress
+from operator import attrgetter
+from typing import (
+    Callable,
+    DefaultDict,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    TextIO,
+    Tuple,
+)
+
+from dedup import RecordDeduplicator
+from exceptions import ChunkBoundaryError
+from sidecar import content_hash, load_sidecar, sidecar_path, write_sidecar
+from success_rules import SuccessRules
+
+try:
+    import numpy as np
+except ImportError:  # numpyエンジンを使わない場合は不要
+    np = None
 
 CSV_HEADER_END_TIME = "End Time Local"
 CSV_HEADER_SITE = "Site"
 CSV_HEADER_APP = "APP"
 CSV_HEADER_RC = "RC"
+REQUIRED_FIELDS = [
+    CSV_HEADER_END_TIME,
+    CSV_HEADER_SITE,
+    CSV_HEADER_APP,
+    CSV_HEADER_RC,
+]
+TIME_FORMAT = "%Y/%m/%d %H:%M:%S"
+TIME_CACHE_SIZE = 4096
 DEFAULT_SUCCESS_RATE = 100.00
+AGGREGATE_ENGINE_PYTHON = "python"
+AGGREGATE_ENGINE_NUMPY = "numpy"
+READER_MODE_TEXT = "text"
+READER_MODE_MMAP = "mmap"
+READER_MODE_COLUMNAR = "columnar"
+RECORD_DIMENSIONS = ("endtime", "site", "app")
+TIME_DIMENSION = "endtime"
+DIMENSION_COLUMNS = {"endtime": "EndTime", "site": "Site", "app": "App", "cc": "CC"}
+
+RowSink = Callable[[Tuple[int, str, str, str]], None]
+
+
+_EPOCH = datetime(1970, 1, 1)
+_ONE_MINUTE = timedelta(minutes=1)
+
+
+@lru_cache(maxsize=TIME_CACHE_SIZE)
+def _minute_prefix_to_epoch(prefix: str) -> int:
+    """
+    "YYYY/MM/DD HH:MM"をエポックからの経過分に変換する
+    (エラーメッセージには呼び出し元が元の時刻文字列を含める)
+
+    Raises:
+        ValueError: 日付・時刻として不正な場合
+    """
+    if not (
+        prefix[4] == "/"
+        and prefix[7] == "/"
+        and prefix[10] == " "
+        and prefix[13] == ":"
+        and prefix[0:4].isdigit()
+        and prefix[5:7].isdigit()
+        and prefix[8:10].isdigit()
+        and prefix[11:13].isdigit()
+        and prefix[14:16].isdigit()
+    ):
+        raise ValueError("invalid date or time")
+
+    dt = datetime(
+        int(prefix[0:4]),
+        int(prefix[5:7]),
+        int(prefix[8:10]),
+        int(prefix[11:13]),
+        int(prefix[14:16]),
+    )
+    return (dt - _EPOCH) // _ONE_MINUTE
+
+
+@lru_cache(maxsize=TIME_CACHE_SIZE)
+def format_epoch_minute(epoch_minute: int) -> str:
+    """エポックからの経過分を出力用の時刻文字列に変換する"""
+    return (_EPOCH + timedelta(minutes=epoch_minute)).strftime(TIME_FORMAT)
+
+
+def _new_counts() -> Dict[str, int]:
+    """集計キーごとの件数の初期値を返す（プロセス間で受け渡せるよう関数で定義）"""
+    return {"total": 0, "success": 0}
+
+
+class _DecodeCache(dict):
+    """バイト列をUTF-8でデコードした文字列を値ごとに1回だけ生成するキャッシュ"""
+
+    def __missing__(self, key: bytes) -> str:
+        value = self[key] = key.decode("utf-8")
+        return value
+
+
+class _EpochMinuteCache(dict):
+    """End Time Localのバイト列から丸めたエポック分を値ごとに1回だけ求めるキャッシュ"""
+
+    def __missing__(self, key: bytes) -> int:
+        value = self[key] = RecordReader.to_epoch_minute(key.decode("utf-8"))
+        return value
 
 
 class AggregationRecord:
@@ -19,36 +130,780 @@ class AggregationRecord:
     }
     APP_NAMES = list(APP_SUCCESS_RESULTS.keys())
 
-    def __init__(self, endtime: str, site: str, app: str, rc: str):
+    __slots__ = ("endtime", "site", "app", "is_success")
+
+    def __init__(
+        self,
+        endtime: int,
+        site: str,
+        app: str,
+        rc: str,
+        success_rules: Optional[SuccessRules] = None,
+    ):
         self.endtime = endtime
         self.site = site
         self.app = app
-        self.is_success = rc in self.APP_SUCCESS_RESULTS.get(self.app, [])
+        self.is_success = (success_rules or DEFAULT_SUCCESS_RULES).is_success(app, rc)
+
+
+# 設定ファイルを指定しないときの成功判定規則
+DEFAULT_SUCCESS_RULES = SuccessRules.from_dict(AggregationRecord.APP_SUCCESS_RESULTS)
+
+
+class EncodedRecords:
+    """
+    1ファイル分のレコードを辞書符号化して保持するクラス
+
+    (endtime, site, app)の組を出現順に整数コードへ符号化し、行ごとには
+    コードと成否だけを配列に持つ。AggregationRecordを行ごとに生成しない。
+    """
+
+    __slots__ = ("groups", "group_codes", "successes")
+
+    def __init__(self):
+        self.groups: List[Tuple[int, str, str]] = []
+        self.group_codes = array("I")
+        self.successes = array("B")
+
+    def __len__(self) -> int:
+        return len(self.group_codes)
+
+    @classmethod
+    def from_rows(
+        cls,
+        rows: Iterable[Tuple[int, str, str, str]],
+        success_rules: Optional[SuccessRules] = None,
+    ) -> "EncodedRecords":
+        """(endtime, site, app, rc)の行を符号化する"""
+        encoded = cls()
+        encode = encoded.encoder(success_rules)
+        for row in rows:
+            encode(row)
+        return encoded
+
+    def encoder(
+        self, success_rules: Optional[SuccessRules] = None
+    ) -> RowSink:
+        """
+        (endtime, site, app, rc)の行を1行ずつ符号化して追加する関数を返す
+
+        読み出し関数のsinkに渡すと、行のリストを作らずに直接符号化できる。
+        """
+        is_success = (success_rules or DEFAULT_SUCCESS_RULES).is_success
+        groups = self.groups
+        group_index = {key: code for code, key in enumerate(groups)}
+        # 行のタプルをそのままキーにして、組のコードと成否を1回の参照で引く
+        row_index: Dict[Tuple[int, str, str, str], Tuple[int, bool]] = {}
+        append_code = self.group_codes.append
+        append_success = self.successes.append
+
+        def encode(row: Tuple[int, str, str, str]) -> None:
+            entry = row_index.get(row)
+            if entry is None:
+                endtime, site, app, rc = row
+                key = (endtime, site, app)
+                code = group_index.get(key)
+                if code is None:
+                    code = group_index[key] = len(groups)
+                    groups.append(key)
+                entry = row_index[row] = (code, is_success(app, rc))
+            append_code(entry[0])
+            append_success(entry[1])
+
+        return encode
+
+
+class RecordFilter:
+    """
+    読み出し時に行を絞り込む条件
+
+    sites/appsは残す値の集合、start/endは"%Y/%m/%d %H:%M:%S"形式の時刻で、
+    分に丸めた時刻がstart以上end未満の行を残す。指定しない条件は絞り込まない。
+    サイトとアプリは生の値のまま照合し、時刻はそれらを通過した行だけ解析する。
+    そのため除外した行の時刻の形式不正は検出しない（必須フィールドの欠損は検出する）。
+    """
+
+    __slots__ = ("sites", "apps", "start", "end", "site_bytes", "app_bytes")
+
+    def __init__(
+        self,
+        sites: Optional[Iterable[str]] = None,
+        apps: Optional[Iterable[str]] = None,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+    ):
+        self.sites = None if sites is None else frozenset(sites)
+        self.apps = None if apps is None else frozenset(apps)
+        self.start = None if start is None else RecordReader.to_epoch_minute(start)
+        self.end = None if end is None else RecordReader.to_epoch_minute(end)
+        # mmapモードでデコード前のバイト列のまま照合するための集合
+        self.site_bytes = _encode_values(self.sites)
+        self.app_bytes = _encode_values(self.apps)
+
+    def accepts(self, endtime: int, site: str, app: str) -> bool:
+        """正規化済みの値が条件を満たすかを返す"""
+        return self.accepts_fields(site, app) and self.accepts_time(endtime)
+
+    def accepts_fields(self, site: str, app: str) -> bool:
+        """サイトとアプリが条件を満たすかを返す"""
+        return (self.sites is None or site in self.sites) and (
+            self.apps is None or app in self.apps
+        )
+
+    def accepts_time(self, endtime: int) -> bool:
+        """エポック分の時刻が範囲内かを返す"""
+        return (self.start is None or endtime >= self.start) and (
+            self.end is None or endtime < self.end
+        )
+
+    def filter_rows(
+        self, rows: Iterable[Tuple[int, str, str, str]]
+    ) -> List[Tuple[int, str, str, str]]:
+        """解析済みの行から条件を満たす行だけを返す"""
+        return [row for row in rows if self.accepts(row[0], row[1], row[2])]
+
+
+def _dedup_scope(deduplicator: Optional[RecordDeduplicator]):
+    """
+    1ファイル分の読み出しの範囲。正常に終われば重複判定用の行を記録し、
+    例外で終われば破棄する。
+    """
+    return nullcontext() if deduplicator is None else deduplicator.transaction()
+
+
+def _encode_values(values: Optional[frozenset]) -> Optional[frozenset]:
+    if values is None:
+        return None
+    return frozenset(value.encode("utf-8") for value in values)
 
 
 class RecordReader:
     """CSVからレコードを読み出すクラス"""
 
     @staticmethod
-    def from_textio(textio: TextIO) -> Iterator[AggregationRecord]:
+    def from_textio(
+        textio: TextIO,
+        success_rules: Optional[SuccessRules] = None,
+        record_filter: Optional[RecordFilter] = None,
+    ) -> Iterator[AggregationRecord]:
         """
         ファイルオブジェクトからレコードのイテレータを生成
 
         - ヘッダに取得対象キーの一部でも欠損する場合は処理しない
         - データ行にフォーマット不正を含むレコード群は処理しない
+        - record_filterを指定した場合は条件を満たす行だけを生成する
+        """
+        rows = RecordReader.read_rows(textio, record_filter=record_filter)
+        for endtime, site, app, rc in rows:
+            yield AggregationRecord(endtime, site, app, rc, success_rules)
+
+    @staticmethod
+    def stream_textio(
+        textio: TextIO,
+        success_rules: Optional[SuccessRules] = None,
+        on_invalid: Optional[Callable[[ValueError], None]] = None,
+    ) -> Iterator[AggregationRecord]:
+        """
+        ファイルオブジェクトから1行ずつ検証してレコードを生成（ライブフィード用）
+
+        行をバッファしないため、不正な行より前のレコードはそのまま返る。
+        on_invalidを指定した場合、不正な行はその例外をon_invalidに渡して読み飛ばす。
+
+        Raises:
+            ValueError: ヘッダが欠けている場合、またはon_invalidを指定せず
+                必須フィールドや時刻が不正な行がある場合
+        """
+        projected = RecordReader._project_textio(textio)
+        for line_num, values in enumerate(projected, start=1):
+            try:
+                RecordReader._check_values(values, line_num)
+                endtime, site, app, rc = values
+                epoch_minute = RecordReader.to_epoch_minute(endtime)
+            except ValueError as e:
+                if on_invalid is None:
+                    raise
+                on_invalid(e)
+                continue
+            yield AggregationRecord(epoch_minute, site, app, rc, success_rules)
+
+    @staticmethod
+    def from_file(
+        file_path: str,
+        mode: str = READER_MODE_TEXT,
+        success_rules: Optional[SuccessRules] = None,
+        record_filter: Optional[RecordFilter] = None,
+        deduplicator: Optional[RecordDeduplicator] = None,
+    ) -> Iterator[AggregationRecord]:
+        """
+        ファイルパスからレコードのイテレータを生成
+
+        Raises:
+            OSError: ファイルを開けない場合
+            ValueError: フォーマット不正、または未知の読み出しモードの場合
+        """
+        rows = RecordReader.read_file_rows(file_path, mode, record_filter, deduplicator)
+        for endtime, site, app, rc in rows:
+            yield AggregationRecord(endtime, site, app, rc, success_rules)
+
+    @staticmethod
+    def read_encoded(
+        file_path: str,
+        mode: str = READER_MODE_TEXT,
+        success_rules: Optional[SuccessRules] = None,
+        record_filter: Optional[RecordFilter] = None,
+        deduplicator: Optional[RecordDeduplicator] = None,
+    ) -> EncodedRecords:
+        """
+        ファイルパスから辞書符号化したレコードを読み出す
+
+        Raises:
+            OSError: ファイルを開けない場合
+            ValueError: フォーマット不正、または未知の読み出しモードの場合
+        """
+        encoded = EncodedRecords()
+        RecordReader.read_file_rows(
+            file_path,
+            mode,
+            record_filter,
+            deduplicator,
+            sink=encoded.encoder(success_rules),
+        )
+        return encoded
+
+    @staticmethod
+    def read_file_rows(
+        file_path: str,
+        mode: str = READER_MODE_TEXT,
+        record_filter: Optional[RecordFilter] = None,
+        deduplicator: Optional[RecordDeduplicator] = None,
+        sink: Optional[RowSink] = None,
+    ) -> List[Tuple[int, str, str, str]]:
+        """
+        読み出しモードに応じてファイルを解析し、(endtime, site, app, rc)のリストを返す
+
+        deduplicatorを指定すると、取り込み済みのファイルと重複する行を読み飛ばす。
+        列形式のサイドカーは元の行を持たないため、columnarモードでは指定できない。
+        sinkを指定すると、行をリストに溜めずに1行ずつsinkに渡して空のリストを返す。
+        途中で例外になった場合もそれまでの行は渡し済みのため、sink側で破棄すること。
+
+        Raises:
+            OSError: ファイルを開けない場合
+            ValueError: フォーマット不正、または未知の読み出しモードの場合
+        """
+        if mode == READER_MODE_TEXT:
+            with open(file_path, "r", encoding="utf-8") as f:
+                return RecordReader.read_rows(
+                    f,
+                    record_filter=record_filter,
+                    deduplicator=deduplicator,
+                    sink=sink,
+                )
+        if mode == READER_MODE_MMAP:
+            return RecordReader.read_rows_mmap(
+                file_path, record_filter, deduplicator, sink
+            )
+        if mode == READER_MODE_COLUMNAR:
+            if deduplicator is not None:
+                raise ValueError("Deduplication is not supported in columnar mode")
+            return RecordReader.read_rows_columnar(file_path, record_filter, sink)
+        raise ValueError(f"Unknown reader mode: {mode}")
+
+    @staticmethod
+    def read_rows(
+        textio: TextIO,
+        extra_fields: Sequence[str] = (),
+        record_filter: Optional[RecordFilter] = None,
+        deduplicator: Optional[RecordDeduplicator] = None,
+        sink: Optional[RowSink] = None,
+    ) -> List[Tuple[int, str, str, str]]:
+        """
+        ファイルを1パスで検証・解析し、(endtime, site, app, rc)のリストを返す
+
+        ファイル全体の検証が済むまで行をバッファするため、不正な行が1行でも
+        あれば何も返さない。シークしないのでパイプやSFTPのファイルも読める。
+        extra_fieldsを指定すると、その列の値を各行の末尾に加える（空でもよい）。
+        record_filterを指定すると、条件を満たす行だけを返す（0件でもよい）。
+        deduplicatorを指定すると、取り込み済みのファイルと重複する行を返さない。
+        行のフィンガープリントは全列の値から求める。
+        sinkを指定すると、行をリストに溜めずに1行ずつsinkに渡す（read_file_rowsを参照）。
+
+        Raises:
+            ValueError: ヘッダや必須フィールドの欠損、データ行がない場合
+        """
+        with _dedup_scope(deduplicator):
+            projected = RecordReader._project_textio(textio, extra_fields, deduplicator)
+            return RecordReader._collect_rows(
+                projected, len(extra_fields), record_filter, sink
+            )
+
+    @staticmethod
+    def read_rows_columnar(
+        file_path: str,
+        record_filter: Optional[RecordFilter] = None,
+        sink: Optional[RowSink] = None,
+    ) -> List[Tuple[int, str, str, str]]:
+        """
+        ファイルの隣にある列形式のサイドカーをメモリマップし、(endtime, site, app, rc)の
+        リストを返す。サイドカーが無いか、ファイルの内容のハッシュと一致しない場合は
+        ファイルをmmapモードで解析し、次回のためにサイドカーを書き出す。
+
+        サイドカーはsite/app/rcを辞書符号化したコードとエポック分の列で、
+        成功判定の規則に依存しないため、規則を変えて集計し直す場合にも使える。
+        record_filterを指定した場合も全行をサイドカーに残し、返す行だけを絞り込む。
+        sinkを指定すると、行を1行ずつsinkに渡して空のリストを返す。サイドカーを
+        書き出す場合は列に分けるために一度全行を読み込む。
+
+        Raises:
+            OSError: ファイルを開けない場合
+            ValueError: フォーマット不正の場合
         """
-        reader = csv.DictReader(textio)
-        RecordReader.validate_lines(reader)
-
-        textio.seek(0)  # ファイルポインタを先頭に戻す
-        reader = csv.DictReader(textio)
-        for line in reader:
-            yield AggregationRecord(
-                endtime=RecordReader.normalize_time(line[CSV_HEADER_END_TIME]),
-                site=line[CSV_HEADER_SITE],
-                app=line[CSV_HEADER_APP],
-                rc=line[CSV_HEADER_RC],
+        digest = content_hash(file_path)
+        path = sidecar_path(file_path)
+        loaded = load_sidecar(path, digest)
+        if loaded is not None:
+            dictionaries, columns = loaded
+            rows = zip(
+                columns["endtime"],
+                map(dictionaries["site"].__getitem__, columns["site"]),
+                map(dictionaries["app"].__getitem__, columns["app"]),
+                map(dictionaries["rc"].__getitem__, columns["rc"]),
             )
+        else:
+            rows = RecordReader.read_rows_mmap(file_path)
+            dictionaries, columns = RecordReader._encode_columns(rows)
+            try:
+                write_sidecar(path, digest, dictionaries, columns)
+            except OSError:
+                pass  # サイドカーは再解析を省くためだけのもので、書けなくても集計は続ける
+
+        if record_filter is not None:
+            rows = (row for row in rows if record_filter.accepts(*row[:3]))
+        if sink is None:
+            return list(rows)
+        for row in rows:
+            sink(row)
+        return []
+
+    @staticmethod
+    def _encode_columns(
+        rows: List[Tuple[int, str, str, str]],
+    ) -> Tuple[Dict[str, List[str]], Dict[str, array]]:
+        """行をエポック分の列と、site/app/rcを辞書符号化したコードの列に分ける"""
+        dictionaries: Dict[str, List[str]] = {"site": [], "app": [], "rc": []}
+        columns = {
+            "endtime": array("i", (row[0] for row in rows)),
+            "site": array("I"),
+            "app": array("I"),
+            "rc": array("I"),
+        }
+        for position, name in enumerate(("site", "app", "rc"), start=1):
+            values = dictionaries[name]
+            index: Dict[str, int] = {}
+            codes = columns[name]
+            for row in rows:
+                value = row[position]
+                code = index.get(value)
+                if code is None:
+                    code = index[value] = len(values)
+                    values.append(value)
+                codes.append(code)
+        return dictionaries, columns
+
+    @staticmethod
+    def read_rows_mmap(
+        file_path: str,
+        record_filter: Optional[RecordFilter] = None,
+        deduplicator: Optional[RecordDeduplicator] = None,
+        sink: Optional[RowSink] = None,
+    ) -> List[Tuple[int, str, str, str]]:
+        """
+        ファイルをメモリマップしてバイト列のまま必要な4列だけを取り出し、
+        (endtime, site, app, rc)のリストを返す
+
+        クォートを含む行だけcsvモジュールで解析する。検証内容はread_rowsと同じ。
+        record_filterのサイトとアプリはデコード前のバイト列のまま照合する。
+        deduplicatorを指定すると、取り込み済みのファイルと重複する行を返さない。
+        行のフィンガープリントは改行を除いた行のバイト列から求める。
+        sinkを指定すると、行をリストに溜めずに1行ずつsinkに渡す（read_file_rowsを参照）。
+
+        Raises:
+            OSError: ファイルを開けない場合
+            ValueError: ヘッダや必須フィールドの欠損、データ行がない場合
+        """
+        with open(file_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return RecordReader._collect_rows(RecordReader._project_lines([]))
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            with mapped as mm, _dedup_scope(deduplicator):
+                header = RecordReader._parse_header(mm.readline())
+                indexes = RecordReader._resolve_indexes(header)
+                rows, line_count = RecordReader._scan_lines(
+                    mm.readline,
+                    indexes,
+                    record_filter=record_filter,
+                    deduplicator=deduplicator,
+                    sink=sink,
+                )
+                if not line_count:
+                    raise ValueError("No data rows found in the file")
+        return rows
+
+    @staticmethod
+    def split_ranges(
+        file_path: str, chunk_size: int
+    ) -> Tuple[List[str], List[Tuple[int, int]]]:
+        """
+        ファイルのヘッダと、データ部を改行位置で区切ったバイト範囲のリストを返す
+
+        各範囲はおおよそchunk_sizeバイトで、行の途中では区切らない。
+
+        Raises:
+            OSError: ファイルを開けない場合
+            ValueError: 必須ヘッダが欠けている場合
+        """
+        with open(file_path, "rb") as f:
+            header = RecordReader._parse_header(f.readline())
+            RecordReader._resolve_indexes(header)
+
+            size = os.fstat(f.fileno()).st_size
+            ranges = []
+            start = f.tell()
+            while start < size:
+                f.seek(min(start + chunk_size, size))
+                f.readline()  # 次の改行まで進めて範囲の終端を行頭に揃える
+                end = f.tell()
+                ranges.append((start, end))
+                start = end
+        return header, ranges
+
+    @staticmethod
+    def read_header(file_path: str) -> Tuple[List[str], int]:
+        """
+        ファイルのヘッダと、データ部の開始バイト位置を返す
+
+        Raises:
+            OSError: ファイルを開けない場合
+            ValueError: 必須ヘッダが欠けている場合
+        """
+        with open(file_path, "rb") as f:
+            header = RecordReader._parse_header(f.readline())
+            RecordReader._resolve_indexes(header)
+            return header, f.tell()
+
+    @staticmethod
+    def complete_lines_end(file_path: str, block_size: int = 65536) -> int:
+        """
+        最後の改行の直後のバイト位置を返す（書き込み途中の末尾行を除くため）
+
+        Raises:
+            OSError: ファイルを開けない場合
+        """
+        with open(file_path, "rb") as f:
+            end = os.fstat(f.fileno()).st_size
+            while end > 0:
+                start = max(0, end - block_size)
+                f.seek(start)
+                pos = f.read(end - start).rfind(b"\n")
+                if pos >= 0:
+                    return start + pos + 1
+                end = start
+        return 0
+
+    @staticmethod
+    def read_rows_range(
+        file_path: str,
+        header: List[str],
+        start: int,
+        end: int,
+        record_filter: Optional[RecordFilter] = None,
+        sink: Optional[RowSink] = None,
+    ) -> List[Tuple[int, str, str, str]]:
+        """
+        split_rangesで求めたバイト範囲だけを解析し、正規化した行のリストを返す
+
+        ヘッダの列対応はsplit_rangesで読んだものを使う。範囲内にデータ行が
+        なくても例外にはしない（ファイル全体での判定は呼び出し側で行う）。
+        範囲より前の行数はわからないため、エラーメッセージには行番号ではなく
+        範囲のバイト位置を含める。
+        sinkを指定すると、行をリストに溜めずに1行ずつsinkに渡す（read_file_rowsを参照）。
+
+        Raises:
+            OSError: ファイルを開けない場合
+            ChunkBoundaryError: クォート内の改行が範囲の終端をまたぐ場合
+            ValueError: 必須フィールドが欠けている場合
+        """
+        indexes = RecordReader._resolve_indexes(header)
+        with open(file_path, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start)
+
+        try:
+            rows, _ = RecordReader._scan_lines(
+                io.BytesIO(data).readline,
+                indexes,
+                strict_quotes=True,
+                record_filter=record_filter,
+                number_lines=False,
+                sink=sink,
+            )
+            return rows
+        except ChunkBoundaryError:
+            raise
+        except ValueError as e:
+            raise ValueError(f"{e} (bytes {start}-{end})")
+
+    @staticmethod
+    def _parse_header(line: bytes) -> List[str]:
+        """ヘッダ行のバイト列を列名のリストにする"""
+        return next(csv.reader([line.decode("utf-8")]), [])
+
+    @staticmethod
+    def _resolve_indexes(
+        header: List[str], extra_fields: Sequence[str] = ()
+    ) -> List[int]:
+        """
+        ヘッダから必須フィールド（と追加の列）の列番号を求める
+
+        Raises:
+            ValueError: 必須ヘッダや追加の列が欠けている場合
+        """
+        fields = REQUIRED_FIELDS + list(extra_fields)
+        missing_headers = [field for field in fields if field not in header]
+        if missing_headers:
+            raise ValueError(f"Missing required headers: {', '.join(missing_headers)}")
+
+        # 同名の列が複数ある場合はcsv.DictReaderと同じく後方の列を使う
+        column_index = {name: i for i, name in enumerate(header)}
+        return [column_index[field] for field in fields]
+
+    @staticmethod
+    def _project_lines(
+        lines: Iterator[List[str]],
+        extra_fields: Sequence[str] = (),
+        deduplicator: Optional[RecordDeduplicator] = None,
+    ) -> Iterator[Optional[List[str]]]:
+        """
+        csv.readerの行から必須フィールド（と追加の列）の値だけを取り出す。
+        deduplicatorを指定した場合、重複する行はNoneとして返す。
+        """
+        lines = iter(lines)
+        header = next(lines, None) or []
+        indexes = RecordReader._resolve_indexes(header, extra_fields)
+        width = max(indexes) + 1
+        for line in lines:
+            if not line:
+                continue  # 空行はcsv.DictReaderと同じく読み飛ばす
+            if deduplicator is not None and not deduplicator.is_new(
+                "\x1f".join(line).encode("utf-8")
+            ):
+                yield None
+                continue
+            if len(line) >= width:
+                yield [line[i] for i in indexes]
+            else:
+                yield [line[i] if i < len(line) else "" for i in indexes]
+
+    @staticmethod
+    def _project_textio(
+        textio: TextIO,
+        extra_fields: Sequence[str] = (),
+        deduplicator: Optional[RecordDeduplicator] = None,
+    ) -> Iterator[Optional[List[str]]]:
+        """テキストファイルから必須フィールド（と追加の列）の値だけを取り出す"""
+        return RecordReader._project_lines(
+            csv.reader(textio), extra_fields, deduplicator
+        )
+
+    @staticmethod
+    def _scan_lines(
+        readline: Callable[[], bytes],
+        indexes: List[int],
+        strict_quotes: bool = False,
+        record_filter: Optional[RecordFilter] = None,
+        deduplicator: Optional[RecordDeduplicator] = None,
+        number_lines: bool = True,
+        sink: Optional[RowSink] = None,
+    ) -> Tuple[List[Tuple[int, str, str, str]], int]:
+        """
+        バイト列の行を走査し、正規化した行のリストとデータ行の数を返す
+
+        strict_quotesが真の場合、閉じられないまま終端に達したクォートを
+        ChunkBoundaryErrorとする。record_filterを指定した場合、サイトとアプリは
+        デコード前に照合し、時刻は照合を通過した行だけ変換する。
+        deduplicatorを指定した場合、重複する行は検証せずに読み飛ばす。
+        number_linesが偽の場合、エラーメッセージに行番号を含めない
+        （ファイルの途中から読む場合など）。
+        sinkを指定した場合、行はリストに溜めずにsinkに渡し、空のリストを返す。
+
+        Raises:
+            ChunkBoundaryError: strict_quotes指定時にクォートが閉じられない場合
+            ValueError: 必須フィールドが欠けている場合
+        """
+        end_i, site_i, app_i, rc_i = indexes
+        width = max(indexes) + 1
+
+        decoded = _DecodeCache()
+        epoch_minutes = _EpochMinuteCache()
+        filtering = record_filter is not None
+        if filtering:
+            site_bytes = record_filter.site_bytes
+            app_bytes = record_filter.app_bytes
+            accepts_time = record_filter.accepts_time
+        deduplicating = deduplicator is not None
+        rows = []
+        append = rows.append if sink is None else sink
+        line_num = 0
+        for line in iter(readline, b""):
+            if b'"' in line:
+                # クォート内の改行を含めて1レコード分を読み、csvモジュールに任せる
+                while RecordReader._ends_in_quotes(line):
+                    rest = readline()
+                    if not rest:
+                        if strict_quotes:
+                            raise ChunkBoundaryError(
+                                "Quoted field crosses the end of the byte range"
+                            )
+                        break
+                    line += rest
+                fields = next(csv.reader([line.decode("utf-8")]), [])
+                if not fields:
+                    continue
+                line_num += 1
+                if deduplicating and not deduplicator.is_new(line.rstrip(b"\r\n")):
+                    continue
+                values = [fields[i] if i < len(fields) else "" for i in indexes]
+                RecordReader._check_values(values, line_num if number_lines else None)
+                endtime, site, app, rc = values
+                minute = RecordReader.to_epoch_minute(endtime)
+                if filtering and not record_filter.accepts(minute, site, app):
+                    continue
+                append((minute, site, app, rc))
+                continue
+
+            line = line.rstrip(b"\r\n")
+            if not line:
+                continue  # 空行はcsv.DictReaderと同じく読み飛ばす
+            line_num += 1
+            if deduplicating and not deduplicator.is_new(line):
+                continue
+
+            fields = line.split(b",")
+            if len(fields) < width:
+                fields += [b""] * (width - len(fields))
+            endtime = fields[end_i]
+            site = fields[site_i]
+            app = fields[app_i]
+            rc = fields[rc_i]
+            if not (endtime and site and app and rc):
+                RecordReader._check_values(
+                    [endtime, site, app, rc], line_num if number_lines else None
+                )
+            if filtering:
+                if site_bytes is not None and site not in site_bytes:
+                    continue
+                if app_bytes is not None and app not in app_bytes:
+                    continue
+                if not accepts_time(epoch_minutes[endtime]):
+                    continue
+            append((epoch_minutes[endtime], decoded[site], decoded[app], decoded[rc]))
+
+        return rows, line_num
+
+    @staticmethod
+    def _ends_in_quotes(record: bytes) -> bool:
+        """
+        レコードのバイト列がクォートで囲まれたフィールドの途中で終わっているかを返す
+
+        csvモジュールと同じく、フィールドの先頭にあるクォートだけを囲みの開始とみなし、
+        フィールドの途中のクォートは値の一部として扱う。
+        """
+        pos = 0
+        length = len(record)
+        while pos < length:
+            if record[pos] == 0x22:  # '"'
+                pos += 1
+                while True:
+                    close = record.find(b'"', pos)
+                    if close < 0:
+                        return True
+                    if record[close + 1 : close + 2] != b'"':
+                        break
+                    pos = close + 2  # 2つ続くクォートはエスケープされたクォート
+                pos = close + 1
+            comma = record.find(b",", pos)
+            if comma < 0:
+                return False
+            pos = comma + 1
+        return False
+
+    @staticmethod
+    def _check_values(values: Sequence, line_num: Optional[int]) -> None:
+        """
+        必須フィールドの値がすべて空でないことを検証する
+        （line_numがNoneの場合はエラーメッセージに行番号を含めない）
+
+        Raises:
+            ValueError: 必須フィールドが欠けている場合
+        """
+        if not all(values):
+            missing_fields = [
+                field for field, value in zip(REQUIRED_FIELDS, values) if not value
+            ]
+            location = "" if line_num is None else f" Line{line_num}"
+            raise ValueError(
+                f"Missing fields{location}: {', '.join(missing_fields)}"
+            )
+
+    @staticmethod
+    def _collect_rows(
+        projected: Iterator[List[str]],
+        extra_count: int = 0,
+        record_filter: Optional[RecordFilter] = None,
+        sink: Optional[RowSink] = None,
+    ) -> List[Tuple[int, str, str, str]]:
+        """
+        必須フィールドの値を検証し、正規化した行のリストを返す
+
+        extra_count個の追加の列の値は検証せずに行の末尾に加える。
+        record_filterを指定した場合、サイトとアプリを照合してから時刻を変換する。
+        sinkを指定した場合、行はリストに溜めずにsinkに渡し、空のリストを返す。
+
+        Raises:
+            ValueError: ヘッダや必須フィールドの欠損、データ行がない場合
+        """
+        required_count = len(REQUIRED_FIELDS)
+        interned: Dict[str, str] = {}
+        rows = []
+        append = rows.append if sink is None else sink
+        line_num = 0
+        for values in projected:
+            line_num += 1
+            if values is None:
+                continue  # 取り込み済みのファイルと重複する行
+            required = values[:required_count] if extra_count else values
+            RecordReader._check_values(required, line_num)
+
+            endtime, site, app, rc = required
+            if record_filter is not None and not record_filter.accepts_fields(
+                site, app
+            ):
+                continue
+            minute = RecordReader.to_epoch_minute(endtime)
+            if record_filter is not None and not record_filter.accepts_time(minute):
+                continue
+            row = (
+                minute,
+                interned.setdefault(site, site),
+                interned.setdefault(app, app),
+                interned.setdefault(rc, rc),
+            )
+            if extra_count:
+                row += tuple(values[required_count:])
+            append(row)
+
+        if not line_num:
+            raise ValueError("No data rows found in the file")
+        return rows
 
     @staticmethod
     def validate_lines(reader: csv.DictReader) -> None:
@@ -58,22 +913,15 @@ class RecordReader:
         Raises:
             ValueError: 必要なフィールドが欠けている場合
         """
-        required_fields = [
-            CSV_HEADER_END_TIME,
-            CSV_HEADER_SITE,
-            CSV_HEADER_APP,
-            CSV_HEADER_RC,
-        ]
-
         header = reader.fieldnames
-        missing_headers = [field for field in required_fields if field not in header]
+        missing_headers = [field for field in REQUIRED_FIELDS if field not in header]
         if missing_headers:
             raise ValueError(f"Missing required headers: {', '.join(missing_headers)}")
 
         line_count = 0
         for line_num, line in enumerate(reader):
             line_count += 1
-            missing_fields = [field for field in required_fields if not line.get(field)]
+            missing_fields = [field for field in REQUIRED_FIELDS if not line.get(field)]
             if missing_fields:
                 raise ValueError(
                     f"Missing fields Line{line_num + 1}: {', '.join(missing_fields)}"
@@ -88,11 +936,35 @@ class RecordReader:
         秒を基準に時刻を分単位で丸める。
         30秒未満は切り捨て、30秒以上は切り上げ。
         """
-        dt = datetime.strptime(time_str, "%Y/%m/%d %H:%M:%S")
-        if dt.second >= 30:
-            dt += timedelta(minutes=1)
-        dt = dt.replace(second=0)
-        return dt.strftime("%Y/%m/%d %H:%M:%S")
+        return format_epoch_minute(RecordReader.to_epoch_minute(time_str))
+
+    @staticmethod
+    def to_epoch_minute(time_str: str) -> int:
+        """
+        秒を基準に時刻を分単位で丸め、エポックからの経過分で返す。
+        30秒未満は切り捨て、30秒以上は切り上げ。
+
+        固定長の"%Y/%m/%d %H:%M:%S"は分までの部分をキャッシュして直接解析し、
+        それ以外の表記はdatetime.strptimeで解析する。
+
+        Raises:
+            ValueError: 時刻の形式が不正な場合
+        """
+        try:
+            if len(time_str) == 19 and time_str[16] == ":":
+                seconds = time_str[17:19]
+                if seconds.isdigit() and int(seconds) <= 59:
+                    epoch_minute = _minute_prefix_to_epoch(time_str[:16])
+                    return epoch_minute + 1 if int(seconds) >= 30 else epoch_minute
+
+            dt = datetime.strptime(time_str, TIME_FORMAT)
+        except ValueError:
+            # 範囲外の値でも、どの時刻が不正かわかるよう元の文字列を含める
+            raise ValueError(
+                f"time data {time_str!r} does not match format {TIME_FORMAT!r}"
+            ) from None
+        epoch_minute = (dt.replace(second=0) - _EPOCH) // _ONE_MINUTE
+        return epoch_minute + 1 if dt.second >= 30 else epoch_minute
 
     # @staticmethod
     # def from_csv(file_path: str) -> Iterator[AggregationRecord]:
@@ -111,10 +983,11 @@ class RecordReader:
 class RecordAggregator:
     """レコードの集計を行うクラス"""
 
-    def __init__(self):
+    def __init__(self, success_rules: Optional[SuccessRules] = None):
+        self.success_rules = success_rules or DEFAULT_SUCCESS_RULES
         self.site_app_stats: DefaultDict[
-            Tuple[str, str, str], Dict[str, int]
-        ] = defaultdict(lambda: {"total": 0, "success": 0})
+            Tuple[int, str, str], Dict[str, int]
+        ] = defaultdict(_new_counts)
 
     def process(self, records: Iterator[AggregationRecord]) -> None:
         """レコードを数え上げる"""
@@ -124,24 +997,136 @@ class RecordAggregator:
             stats["total"] += 1
             stats["success"] += record.is_success
 
+    def process_encoded(self, encoded: EncodedRecords) -> None:
+        """辞書符号化したレコードを数え上げる"""
+        totals = Counter(encoded.group_codes)
+        successes = Counter(compress(encoded.group_codes, encoded.successes))
+        for code, total in totals.items():
+            stats = self.site_app_stats[encoded.groups[code]]
+            stats["total"] += total
+            stats["success"] += successes[code]
+
+    def merge(self, other: "RecordAggregator") -> "RecordAggregator":
+        """他のアグリゲータの集計途中の結果を取り込み、自身を返す"""
+        for key, counts in other.site_app_stats.items():
+            stats = self.site_app_stats[key]
+            stats["total"] += counts["total"]
+            stats["success"] += counts["success"]
+        return self
+
+    def __add__(self, other: "RecordAggregator") -> "RecordAggregator":
+        """2つのアグリゲータを合算した新しいアグリゲータを返す"""
+        if not isinstance(other, RecordAggregator):
+            return NotImplemented
+        return type(self)(success_rules=self.success_rules).merge(self).merge(other)
+
     def summarize(self) -> List[Dict]:
         """レコードを集計する"""
-        stats = []
-        for (endtime, site, app), counts in sorted(self.site_app_stats.items()):
-            stats.append(
-                {
-                    "EndTime": endtime,
-                    "Site": site,
-                    "App": app,
-                    "TotalCount": counts["total"],
-                    "SuccessCount": counts["success"],
-                }
-            )
-        return stats
+        return list(self.iter_summary())
+
+    def iter_summary(self) -> Iterator[Dict]:
+        """集計キーの順にレコードの集計結果を1件ずつ返す"""
+        for key, counts in sorted(self.site_app_stats.items()):
+            yield self._summary_row(key, counts)
+
+    def iter_summary_lazy(self) -> Iterator[Dict]:
+        """
+        集計キーの順にレコードの集計結果を1件ずつ返す。
+        全件を整列せずヒープから順に取り出すため、先頭の一部だけ読む場合に速い。
+        """
+        heap = list(self.iter_entries())
+        heapq.heapify(heap)
+        while heap:
+            key, total, success = heapq.heappop(heap)
+            # 一時ファイルに書き出したアグリゲータでは同じキーが複数回現れるため合算する
+            while heap and heap[0][0] == key:
+                _, more_total, more_success = heapq.heappop(heap)
+                total += more_total
+                success += more_success
+            yield self._summary_row(key, {"total": total, "success": success})
 
-    def format_summary(self) -> List[Dict]:
-        """集計結果のサマリーをCSV出力用に整形する"""
-        site_app_stats = self.summarize()
+    def iter_entries(self) -> Iterator[Tuple[Tuple[int, str, str], int, int]]:
+        """集計キーと総件数、成功件数を順不同で返す"""
+        for key, counts in self.site_app_stats.items():
+            yield key, counts["total"], counts["success"]
+
+    def iter_combined_entries(
+        self,
+    ) -> Iterator[Tuple[Tuple[int, str, str], int, int]]:
+        """iter_entriesと同じ形式で、同じ集計キーを合算済みの結果を順不同で返す"""
+        return self.iter_entries()
+
+    def rollup(
+        self, dimensions: Sequence[str], bucket_minutes: int = 1
+    ) -> "GroupByAggregator":
+        """
+        集計結果をより粗い粒度にまとめ直す。入力は読み直さない。
+        dimensionsはendtime, site, appから選び、bucket_minutesでendtimeをまとめる。
+
+        Raises:
+            ValueError: 不正な軸またはbucket_minutesを指定した場合
+        """
+        return self.rollups([(dimensions, bucket_minutes)])[0]
+
+    def rollups(
+        self, specs: Sequence[Tuple[Sequence[str], int]]
+    ) -> List["GroupByAggregator"]:
+        """
+        (軸, endtimeをまとめる分数) の指定ごとのロールアップを、集計結果の1回の走査で求める。
+
+        Raises:
+            ValueError: 不正な軸またはbucket_minutesを指定した場合
+        """
+        return _rollup_entries(self.iter_entries(), RECORD_DIMENSIONS, specs)
+
+    def top_k(self, k: int, by: Sequence[str] = RECORD_DIMENSIONS) -> List[Dict]:
+        """
+        総件数の多い順に上位k件のグループを返す。
+        byに指定した軸(endtime, site, app)が同じ集計結果を1グループとして合算する。
+
+        Raises:
+            ValueError: byに不正な軸を指定した場合
+        """
+        groups = GroupByAggregator(by)
+        if groups.dimensions != RECORD_DIMENSIONS:
+            return self.rollup(by).top_k(k)
+        # 集計キーそのものでまとめる場合は、集計結果を写さずに選ぶ
+        top = _top_k_entries(self.iter_combined_entries(), k)
+        return [groups._summary_row(*entry) for entry in top]
+
+    def bottom_k_success_rate(
+        self, k: int, by: Sequence[str] = RECORD_DIMENSIONS, min_total: int = 1
+    ) -> List[Dict]:
+        """
+        成功率の低い順に下位k件のグループを返す。
+
+        Raises:
+            ValueError: byに不正な軸を指定した場合
+        """
+        groups = GroupByAggregator(by)
+        if groups.dimensions != RECORD_DIMENSIONS:
+            return self.rollup(by).bottom_k_success_rate(k, min_total)
+        bottom = _bottom_k_entries(self.iter_combined_entries(), k, min_total)
+        return [groups._summary_row(*entry) for entry in bottom]
+
+    def _summary_row(self, key: Tuple[int, str, str], counts: Dict[str, int]) -> Dict:
+        """集計キー1件分の集計結果を生成する"""
+        endtime, site, app = key
+        return {
+            "EndTime": format_epoch_minute(endtime),
+            "Site": site,
+            "App": app,
+            "TotalCount": counts["total"],
+            "SuccessCount": counts["success"],
+        }
+
+    def format_summary(self, by_minute: bool = False) -> List[Dict]:
+        """
+        集計結果のサマリーをCSV出力用に整形する
+
+        サイトごとに1行にまとめる。by_minuteが真の場合は(EndTime, Site)ごとに1行にする。
+        """
+        site_app_stats = self.iter_summary()
 
         site_stats = {}
         for site_app_stat in site_app_stats:
@@ -151,20 +1136,23 @@ class RecordAggregator:
                 site_app_stat["TotalCount"], site_app_stat["SuccessCount"]
             )
 
-            site_stat = site_stats.get(site)
+            row_key = (site_app_stat["EndTime"], site) if by_minute else site
+            site_stat = site_stats.get(row_key)
             if site_stat is None:
-                site_stats[site] = {
+                site_stats[row_key] = {
                     "Site": site,
                     "EndTime": site_app_stat["EndTime"],
                 }
 
-            site_stats[site].update(
+            site_stats[row_key].update(
                 {
                     f"{app}_Total": site_app_stat["TotalCount"],
                     f"{app}_Success": site_app_stat["SuccessCount"],
                     f"{app}_SR": sr,
                 }
             )
+            for metric in self._extra_metric_names():
+                site_stats[row_key][f"{app}_{metric}"] = site_app_stat[metric]
 
         header = self._generate_header()
 
@@ -175,20 +1163,34 @@ class RecordAggregator:
             for col in header:
                 if col.endswith("_SR"):
                     row[col] = format(stats.get(col, DEFAULT_SUCCESS_RATE), ".2f")
+                elif col in stats:
+                    row[col] = stats[col]
                 else:
-                    row[col] = stats.get(col, "0")
+                    row[col] = self._missing_value(col)
             result.append(row)
         return result
 
+    def _missing_value(self, column: str) -> str:
+        """format_summaryで行のない列に入れる値（サブクラスで拡張する）"""
+        return "0"
+
     def _calculate_sr(self, total: int, success: int) -> float:
         """成功率を計算して浮動小数点数で返す"""
         return success / total * 100 if total else DEFAULT_SUCCESS_RATE
 
+    def _extra_metric_names(self) -> List[str]:
+        """summarizeの各行に加える追加の指標名（サブクラスで拡張する）"""
+        return []
+
+    def summary_header(self) -> List[str]:
+        """format_summaryが出力する行の列名を順に返す"""
+        return self._generate_header()
+
     def _generate_header(self):
         """出力するCSVのヘッダーを生成する"""
         ini_header = ["EndTime", "Site"]
-        app_order = AggregationRecord.APP_NAMES
-        metric_order = ["Total", "Success", "SR"]
+        app_order = self.success_rules.app_names
+        metric_order = ["Total", "Success", "SR"] + self._extra_metric_names()
         cols_metric = [f"{app}_{met}" for app in app_order for met in metric_order]
         return ini_header + cols_metric
 
@@ -211,3 +1213,380 @@ class RecordAggregator:
     #         }
     #         for app, counts in sorted(app_stats.items())
     #     ]
+
+
+class NumpyRecordAggregator(RecordAggregator):
+    """
+    numpyで列指向に集計を行うクラス
+
+    レコードをバッチ単位で列に詰め、endtime・site・appを整数コードに
+    辞書符号化したうえで、結合キーごとの件数をまとめて数え上げる。
+    集計結果はsite_app_statsに反映するため、出力はRecordAggregatorと同一。
+    """
+
+    DEFAULT_BATCH_SIZE = 100_000
+
+    def __init__(
+        self,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        success_rules: Optional[SuccessRules] = None,
+    ):
+        if np is None:
+            raise ImportError("numpy is required for the numpy aggregate engine")
+        super().__init__(success_rules)
+        self.batch_size = batch_size
+
+    def process(self, records: Iterator[AggregationRecord]) -> None:
+        """レコードをバッチ単位で数え上げる"""
+        endtimes: List[int] = []
+        sites: List[str] = []
+        apps: List[str] = []
+        successes: List[bool] = []
+        for record in records:
+            endtimes.append(record.endtime)
+            sites.append(record.site)
+            apps.append(record.app)
+            successes.append(record.is_success)
+            if len(endtimes) >= self.batch_size:
+                self.process_columns(endtimes, sites, apps, successes)
+                endtimes, sites, apps, successes = [], [], [], []
+
+        if endtimes:
+            self.process_columns(endtimes, sites, apps, successes)
+
+    def process_encoded(self, encoded: EncodedRecords) -> None:
+        """辞書符号化したレコードをbincountで数え上げる"""
+        if not len(encoded):
+            return
+
+        group_codes = np.frombuffer(encoded.group_codes, dtype=np.uint32)
+        successes = np.frombuffer(encoded.successes, dtype=np.uint8)
+        totals = np.bincount(group_codes, minlength=len(encoded.groups))
+        success_counts = np.bincount(
+            group_codes, weights=successes, minlength=len(encoded.groups)
+        )
+        for key, total, success in zip(
+            encoded.groups, totals.tolist(), success_counts.astype(np.int64).tolist()
+        ):
+            stats = self.site_app_stats[key]
+            stats["total"] += total
+            stats["success"] += success
+
+    def process_columns(
+        self,
+        endtimes: Sequence[int],
+        sites: Sequence[str],
+        apps: Sequence[str],
+        successes: Sequence[bool],
+    ) -> None:
+        """列形式の1バッチを数え上げる"""
+        if len(endtimes) == 0:
+            return
+
+        endtime_values, endtime_codes = self._encode(endtimes)
+        site_values, site_codes = self._encode(sites)
+        app_values, app_codes = self._encode(apps)
+
+        n_sites = len(site_values)
+        n_apps = len(app_values)
+        keys = (endtime_codes * n_sites + site_codes) * n_apps + app_codes
+        group_keys, group_codes = np.unique(keys, return_inverse=True)
+        group_codes = group_codes.ravel()
+
+        totals = np.bincount(group_codes, minlength=len(group_keys))
+        success_counts = np.zeros(len(group_keys), dtype=np.int64)
+        np.add.at(success_counts, group_codes, np.asarray(successes, dtype=np.int64))
+
+        for key, total, success in zip(
+            group_keys.tolist(), totals.tolist(), success_counts.tolist()
+        ):
+            endtime_site, app_code = divmod(key, n_apps)
+            endtime_code, site_code = divmod(endtime_site, n_sites)
+            stats = self.site_app_stats[
+                (
+                    endtime_values[endtime_code],
+                    site_values[site_code],
+                    app_values[app_code],
+                )
+            ]
+            stats["total"] += total
+            stats["success"] += success
+
+    @staticmethod
+    def _encode(values: Sequence) -> Tuple[List, "np.ndarray"]:
+        """列を値リストと整数コードの配列に辞書符号化する"""
+        uniques, codes = np.unique(np.asarray(values), return_inverse=True)
+        return uniques.tolist(), codes.ravel().astype(np.int64)
+
+
+class GroupByAggregator:
+    """
+    指定した軸の組み合わせごとに総件数と成功件数を数えるクラス
+
+    軸はレコードの属性名で指定する(例: endtime, site, app や、旧形式の app, cc)。
+    最も細かい粒度で1回だけ数え上げ、サイト別・アプリ別や5分・1時間単位などの
+    粗い粒度の集計はrollup/rollupsでその結果から導く。
+    """
+
+    def __init__(self, dimensions: Sequence[str]):
+        self.dimensions = _validate_dimensions(dimensions)
+        self.stats: Dict[Tuple, List[int]] = {}
+        if len(self.dimensions) == 1:
+            name = self.dimensions[0]
+            self._key_of = lambda record: (getattr(record, name),)
+        else:
+            self._key_of = attrgetter(*self.dimensions)
+
+    def process(self, records: Iterable) -> None:
+        """レコードを軸の値の組み合わせごとに数え上げる"""
+        stats = self.stats
+        key_of = self._key_of
+        for record in records:
+            key = key_of(record)
+            counts = stats.get(key)
+            if counts is None:
+                stats[key] = [1, int(record.is_success)]
+            else:
+                counts[0] += 1
+                counts[1] += record.is_success
+
+    def add(self, key: Tuple, total: int, success: int) -> None:
+        """集計済みの件数を加える"""
+        counts = self.stats.get(key)
+        if counts is None:
+            self.stats[key] = [total, success]
+        else:
+            counts[0] += total
+            counts[1] += success
+
+    def merge(self, other: "GroupByAggregator") -> "GroupByAggregator":
+        """
+        別のアグリゲータの集計結果を自身に合算し、自身を返す。
+
+        Raises:
+            ValueError: 軸が異なる場合
+        """
+        if other.dimensions != self.dimensions:
+            raise ValueError(
+                f"Cannot merge dimensions {other.dimensions} into {self.dimensions}"
+            )
+        for key, total, success in other.iter_entries():
+            self.add(key, total, success)
+        return self
+
+    def iter_entries(self) -> Iterator[Tuple[Tuple, int, int]]:
+        """軸の値の組み合わせと総件数、成功件数を順不同で返す"""
+        for key, (total, success) in self.stats.items():
+            yield key, total, success
+
+    def rollup(
+        self, dimensions: Sequence[str], bucket_minutes: int = 1
+    ) -> "GroupByAggregator":
+        """
+        集計結果をより粗い粒度にまとめ直す。
+
+        Raises:
+            ValueError: 不正な軸またはbucket_minutesを指定した場合
+        """
+        return self.rollups([(dimensions, bucket_minutes)])[0]
+
+    def rollups(
+        self, specs: Sequence[Tuple[Sequence[str], int]]
+    ) -> List["GroupByAggregator"]:
+        """
+        (軸, endtimeをまとめる分数) の指定ごとのロールアップを、集計結果の1回の走査で求める。
+
+        Raises:
+            ValueError: 不正な軸またはbucket_minutesを指定した場合
+        """
+        return _rollup_entries(self.iter_entries(), self.dimensions, specs)
+
+    def summarize(self) -> List[Dict]:
+        """軸の値の順に集計結果を返す"""
+        return [
+            self._summary_row(key, total, success)
+            for key, (total, success) in sorted(self.stats.items())
+        ]
+
+    def top_k(self, k: int) -> List[Dict]:
+        """総件数の多い順に上位k件を返す。総件数が同じ場合は軸の値の順とする。"""
+        top = _top_k_entries(self.iter_entries(), k)
+        return [self._summary_row(*entry) for entry in top]
+
+    def bottom_k_success_rate(self, k: int, min_total: int = 1) -> List[Dict]:
+        """
+        成功率の低い順に下位k件を返す。
+        成功率が同じ場合は総件数の多い方、さらに軸の値の順とする。
+        総件数がmin_totalに満たないものは、成功率が偏りやすいため対象外とする。
+        """
+        bottom = _bottom_k_entries(self.iter_entries(), k, min_total)
+        return [self._summary_row(*entry) for entry in bottom]
+
+    def _summary_row(self, key: Tuple, total: int, success: int) -> Dict:
+        row = {}
+        for dim, value in zip(self.dimensions, key):
+            if dim == TIME_DIMENSION:
+                value = format_epoch_minute(value)
+            row[DIMENSION_COLUMNS.get(dim, dim)] = value
+        row["TotalCount"] = total
+        row["SuccessCount"] = success
+        row["SR"] = success / total * 100 if total else DEFAULT_SUCCESS_RATE
+        return row
+
+
+def _top_k_entries(
+    entries: Iterable[Tuple[Tuple, int, int]], k: int
+) -> List[Tuple[Tuple, int, int]]:
+    """総件数の多い順に上位k件を選ぶ。総件数が同じ場合は軸の値の順とする。"""
+    return heapq.nsmallest(k, entries, key=lambda entry: (-entry[1], entry[0]))
+
+
+def _bottom_k_entries(
+    entries: Iterable[Tuple[Tuple, int, int]], k: int, min_total: int
+) -> List[Tuple[Tuple, int, int]]:
+    """成功率の低い順に、総件数がmin_total以上のものから下位k件を選ぶ"""
+    candidates = (entry for entry in entries if entry[1] >= min_total)
+    return heapq.nsmallest(
+        k,
+        candidates,
+        key=lambda entry: (entry[2] / entry[1], -entry[1], entry[0]),
+    )
+
+
+def _validate_dimensions(dimensions: Sequence[str]) -> Tuple[str, ...]:
+    """
+    Raises:
+        ValueError: 軸が空、または重複している場合
+    """
+    dimensions = tuple(dimensions)
+    if not dimensions or len(set(dimensions)) != len(dimensions):
+        raise ValueError(f"Invalid dimensions: {dimensions}")
+    return dimensions
+
+
+def _rollup_entries(
+    entries: Iterable[Tuple[Tuple, int, int]],
+    source_dimensions: Sequence[str],
+    specs: Sequence[Tuple[Sequence[str], int]],
+) -> List[GroupByAggregator]:
+    """
+    集計結果を1回だけ走査し、指定ごとに粗い粒度へまとめ直したアグリゲータを返す。
+
+    Raises:
+        ValueError: 元の軸にない軸、または1未満のbucket_minutesを指定した場合
+    """
+    plans = []
+    for dimensions, bucket_minutes in specs:
+        target = GroupByAggregator(dimensions)
+        if not set(target.dimensions) <= set(source_dimensions):
+            raise ValueError(
+                f"Dimensions {target.dimensions} are not in {tuple(source_dimensions)}"
+            )
+        if bucket_minutes < 1:
+            raise ValueError(f"bucket_minutes must be positive: {bucket_minutes}")
+
+        indexes = [source_dimensions.index(dim) for dim in target.dimensions]
+        bucket_at = -1
+        if bucket_minutes > 1 and TIME_DIMENSION in target.dimensions:
+            bucket_at = source_dimensions.index(TIME_DIMENSION)
+        plans.append((target, indexes, bucket_at, bucket_minutes))
+
+    for key, total, success in entries:
+        for target, indexes, bucket_at, bucket_minutes in plans:
+            group = tuple(
+                key[i] - key[i] % bucket_minutes if i == bucket_at else key[i]
+                for i in indexes
+            )
+            target.add(group, total, success)
+    return [target for target, _, _, _ in plans]
+
+
+def create_aggregator(
+    engine: str = AGGREGATE_ENGINE_PYTHON,
+    success_rules: Optional[SuccessRules] = None,
+) -> RecordAggregator:
+    """
+    集計エンジン名に応じたアグリゲータを生成する
+
+    Raises:
+        ValueError: 未知のエンジン名が指定された場合
+        ImportError: numpyエンジン指定時にnumpyが利用できない場合
+    """
+    if engine == AGGREGATE_ENGINE_PYTHON:
+        return RecordAggregator(success_rules=success_rules)
+    if engine == AGGREGATE_ENGINE_NUMPY:
+        return NumpyRecordAggregator(success_rules=success_rules)
+    raise ValueError(f"Unknown aggregate engine: {engine}")
+
+
+def merge_aggregators(aggregators: List[RecordAggregator]) -> RecordAggregator:
+    """
+    アグリゲータのリストを2つずつトーナメント形式で合算する
+
+    Raises:
+        ValueError: アグリゲータが1つも渡されない場合
+    """
+    if not aggregators:
+        raise ValueError("No aggregators to merge")
+
+    level = list(aggregators)
+    while len(level) > 1:
+        merged = [left.merge(right) for left, right in zip(level[::2], level[1::2])]
+        if len(level) % 2:
+            merged.append(level[-1])
+        level = merged
+    return level[0]
+
+
+def aggregate_file(
+    file_path: str,
+    engine: str = AGGREGATE_ENGINE_PYTHON,
+    reader_mode: str = READER_MODE_TEXT,
+    success_rules: Optional[SuccessRules] = None,
+    record_filter: Optional[RecordFilter] = None,
+) -> RecordAggregator:
+    """
+    1ファイル分を集計したアグリゲータを返す（プロセスプールのワーカー用）
+
+    Raises:
+        OSError: ファイルを開けない場合
+        ValueError: フォーマット不正の場合
+    """
+    aggregator = create_aggregator(engine, success_rules)
+    aggregator.process_encoded(
+        RecordReader.read_encoded(
+            file_path, reader_mode, success_rules, record_filter
+        )
+    )
+    return aggregator
+
+
+def aggregate_range(
+    file_path: str,
+    header: List[str],
+    start: int,
+    end: int,
+    engine: str = AGGREGATE_ENGINE_PYTHON,
+    success_rules: Optional[SuccessRules] = None,
+    record_filter: Optional[RecordFilter] = None,
+) -> RecordAggregator:
+    """
+    1ファイルのバイト範囲を集計したアグリゲータを返す（プロセスプールのワーカー用）
+
+    Raises:
+        OSError: ファイルを開けない場合
+        ChunkBoundaryError: クォート内の改行が範囲の終端をまたぐ場合
+        ValueError: フォーマット不正の場合
+    """
+    aggregator = create_aggregator(engine, success_rules)
+    encoded = EncodedRecords()
+    RecordReader.read_rows_range(
+        file_path,
+        header,
+        start,
+        end,
+        record_filter,
+        sink=encoded.encoder(success_rules),
+    )
+    aggregator.process_encoded(encoded)
+    return aggregator
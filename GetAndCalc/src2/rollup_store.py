@@ -0,0 +1,189 @@
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from models import RECORD_DIMENSIONS, TIME_DIMENSION, GroupByAggregator, RecordReader
+
+# 保存する粒度(分)。1分、5分、1時間、1日
+ROLLUP_RESOLUTIONS = (1, 5, 60, 24 * 60)
+
+
+class RollupStore:
+    """
+    1分単位の集計結果を、複数の粒度にまとめた状態でSQLiteに保存するクラス
+
+    updateで受け取った1分単位の値で保存済みの値を置き換え、変化した分だけを
+    1つ細かい粒度の差分から順に粗い粒度へ伝播する。粗い粒度の行を細かい粒度から
+    集計し直すことはない。queryは範囲と集計単位を満たす最も粗い粒度の行だけを読む。
+    """
+
+    def __init__(self, db_path: str, resolutions: Sequence[int] = ROLLUP_RESOLUTIONS):
+        """
+        Raises:
+            ValueError: 粒度が1分から始まらない、または前の粒度で割り切れない場合
+        """
+        resolutions = tuple(resolutions)
+        if not resolutions or resolutions[0] != 1:
+            raise ValueError(f"Resolutions must start with 1 minute: {resolutions}")
+        for finer, coarser in zip(resolutions, resolutions[1:]):
+            if coarser <= finer or coarser % finer:
+                raise ValueError(
+                    f"Resolution {coarser} is not a multiple of {finer}: {resolutions}"
+                )
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.resolutions = resolutions
+        self.connection = sqlite3.connect(db_path)
+        self._create_table()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _create_table(self) -> None:
+        with self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS rollups (
+                    resolution INTEGER NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    site TEXT NOT NULL,
+                    app TEXT NOT NULL,
+                    total INTEGER NOT NULL,
+                    success INTEGER NOT NULL,
+                    PRIMARY KEY (resolution, bucket, site, app)
+                ) WITHOUT ROWID
+                """
+            )
+
+    def update(self, entries: Iterable[Tuple[Tuple[int, str, str], int, int]]) -> int:
+        """
+        (endtime, site, app)ごとの総件数と成功件数で1分単位の値を置き換え、
+        粗い粒度に差分を反映する。値が変わった1分単位の行の数を返す。
+
+        entriesはRecordAggregator.iter_entriesと同じ形式で、同じ分を再集計した
+        結果が届いた場合は最新の値を正とする。entries内で同じキーが複数回現れる場合
+        (一時ファイルに書き出したアグリゲータなど)は、その合計を今回の値とする。
+        """
+        current = GroupByAggregator(RECORD_DIMENSIONS)
+        for key, total, success in entries:
+            current.add(key, total, success)
+        latest = current.stats
+        if not latest:
+            return 0
+
+        minutes = [endtime for endtime, _, _ in latest]
+        previous = {
+            (bucket, site, app): (total, success)
+            for bucket, site, app, total, success in self.connection.execute(
+                """
+                SELECT bucket, site, app, total, success FROM rollups
+                WHERE resolution = 1 AND bucket BETWEEN ? AND ?
+                """,
+                (min(minutes), max(minutes)),
+            )
+        }
+
+        deltas = GroupByAggregator(RECORD_DIMENSIONS)
+        for key, (total, success) in latest.items():
+            old_total, old_success = previous.get(key, (0, 0))
+            if total != old_total or success != old_success:
+                deltas.add(key, total - old_total, success - old_success)
+        if not deltas.stats:
+            return 0
+
+        with self.connection:
+            self.connection.executemany(
+                """
+                INSERT INTO rollups (resolution, bucket, site, app, total, success)
+                VALUES (1, ?, ?, ?, ?, ?)
+                ON CONFLICT (resolution, bucket, site, app) DO UPDATE SET
+                    total = excluded.total,
+                    success = excluded.success
+                """,
+                (
+                    (endtime, site, app, *latest[(endtime, site, app)])
+                    for endtime, site, app in deltas.stats
+                ),
+            )
+            changed = len(deltas.stats)
+
+            # 1つ細かい粒度の差分をまとめ、次の粒度の差分とする
+            for resolution in self.resolutions[1:]:
+                deltas = deltas.rollup(RECORD_DIMENSIONS, resolution)
+                self.connection.executemany(
+                    """
+                    INSERT INTO rollups (resolution, bucket, site, app, total, success)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (resolution, bucket, site, app) DO UPDATE SET
+                        total = total + excluded.total,
+                        success = success + excluded.success
+                    """,
+                    (
+                        (resolution, *key, total, success)
+                        for key, total, success in deltas.iter_entries()
+                        if total or success
+                    ),
+                )
+        return changed
+
+    def resolution_for(self, start: int, end: int, granularity: int) -> int:
+        """
+        エポック分の範囲[start, end)をgranularity分単位で集計するのに使える、
+        最も粗い粒度を返す。範囲の両端と集計単位がその粒度で割り切れる必要がある。
+
+        Raises:
+            ValueError: granularityが1未満の場合
+        """
+        if granularity < 1:
+            raise ValueError(f"granularity must be positive: {granularity}")
+        return max(
+            resolution
+            for resolution in self.resolutions
+            if not (start % resolution or end % resolution or granularity % resolution)
+        )
+
+    def query(
+        self,
+        start: str,
+        end: str,
+        granularity: int = 1,
+        dimensions: Sequence[str] = RECORD_DIMENSIONS,
+        sites: Optional[Iterable[str]] = None,
+        apps: Optional[Iterable[str]] = None,
+    ) -> List[Dict]:
+        """
+        "%Y/%m/%d %H:%M:%S"形式の範囲[start, end)の集計結果を、granularity分単位・
+        dimensionsの軸ごとにまとめて返す。行の形式はGroupByAggregator.summarizeと同じ。
+        dimensionsにendtimeを含まない場合、granularityは使わず範囲全体を1つにまとめる。
+
+        Raises:
+            ValueError: 時刻の形式、granularityまたは軸が不正な場合
+        """
+        start_minute = RecordReader.to_epoch_minute(start)
+        end_minute = RecordReader.to_epoch_minute(end)
+        if TIME_DIMENSION not in dimensions:
+            granularity = max(1, end_minute - start_minute)
+        resolution = self.resolution_for(start_minute, end_minute, granularity)
+
+        sql = (
+            "SELECT bucket, site, app, total, success FROM rollups "
+            "WHERE resolution = ? AND bucket >= ? AND bucket < ?"
+        )
+        params: List = [resolution, start_minute, end_minute]
+        for column, values in (("site", sites), ("app", apps)):
+            if values is not None:
+                values = sorted(set(values))
+                sql += f" AND {column} IN ({', '.join('?' * len(values))})"
+                params += values
+
+        groups = GroupByAggregator(RECORD_DIMENSIONS)
+        for bucket, site, app, total, success in self.connection.execute(sql, params):
+            groups.add((bucket, site, app), total, success)
+        return groups.rollup(dimensions, granularity).summarize()
@@ -0,0 +1,213 @@
+import math
+import os
+import random
+from collections import Counter
+from itertools import compress
+from statistics import NormalDist
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from exceptions import ChunkBoundaryError
+from models import (
+    DEFAULT_SUCCESS_RATE,
+    READER_MODE_MMAP,
+    AggregationRecord,
+    EncodedRecords,
+    RecordAggregator,
+    RecordFilter,
+    RecordReader,
+)
+from success_rules import SuccessRules
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+DEFAULT_CONFIDENCE = 0.95
+
+GroupKey = Tuple[int, str, str]
+UnitCounts = Dict[GroupKey, List[int]]
+
+
+class SampledRecordAggregator(RecordAggregator):
+    """
+    ファイルの一部の区間だけを読み、件数と成功率を推定するアグリゲータ
+
+    ファイルを改行位置で揃えたblock_sizeバイトごとの区間に分け、各区間を
+    sample_rateの確率で選ぶ。選ぶ区間はseedとファイル名から決まるため、
+    同じ入力に対しては毎回同じ結果になる。
+
+    総件数と成功件数は選んだ区間の件数を抽出確率で割って推定し、
+    区間単位の抽出に基づく分散から信頼区間を求める。format_summaryは通常の
+    集計と同じ形で、アプリごとに Total_Low/Total_High/SR_Low/SR_High の列を加える。
+    """
+
+    def __init__(
+        self,
+        sample_rate: float,
+        confidence: float = DEFAULT_CONFIDENCE,
+        seed: int = 0,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        success_rules: Optional[SuccessRules] = None,
+    ):
+        """
+        Raises:
+            ValueError: sample_rateやconfidenceが範囲外の場合
+        """
+        if not 0 < sample_rate <= 1:
+            raise ValueError(f"sample_rate must be in (0, 1]: {sample_rate}")
+        if not 0 < confidence < 1:
+            raise ValueError(f"confidence must be in (0, 1): {confidence}")
+        super().__init__(success_rules)
+        self.sample_rate = sample_rate
+        self.confidence = confidence
+        self.seed = seed
+        self.block_size = block_size
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+        # 集計キーごとの [推定総件数, 推定成功件数, 総件数の分散, 成功件数の分散, 共分散]
+        self.estimates: Dict[GroupKey, List[float]] = {}
+
+    def process(self, records: Iterator[AggregationRecord]) -> None:
+        """レコードをすべて読んだものとして(抽出確率1で)数え上げる"""
+        unit: UnitCounts = {}
+        for record in records:
+            key = (record.endtime, record.site, record.app)
+            _add_counts(unit, key, 1, record.is_success)
+        self._add_unit(unit, 1.0)
+
+    def process_encoded(self, encoded: EncodedRecords) -> None:
+        """辞書符号化したレコードをすべて読んだものとして(抽出確率1で)数え上げる"""
+        totals = Counter(encoded.group_codes)
+        successes = Counter(compress(encoded.group_codes, encoded.successes))
+        unit: UnitCounts = {
+            encoded.groups[code]: [total, successes[code]]
+            for code, total in totals.items()
+        }
+        self._add_unit(unit, 1.0)
+
+    def process_file(
+        self, file_path: str, record_filter: Optional[RecordFilter] = None
+    ) -> int:
+        """
+        ファイルから区間を抽出して集計し、読んだ行数を返す。
+        クォート内の改行が区間の境界をまたぐファイルは全体を読む。
+        区間に不正な行があった場合、そのファイルの結果は何も反映しない。
+
+        Raises:
+            OSError: ファイルを開けない場合
+            ValueError: フォーマット不正の場合
+        """
+        header, ranges = RecordReader.split_ranges(file_path, self.block_size)
+        rng = random.Random(f"{self.seed}:{os.path.basename(file_path)}")
+        chosen = [r for r in ranges if rng.random() < self.sample_rate]
+
+        try:
+            units = [
+                self._count_rows(
+                    RecordReader.read_rows_range(
+                        file_path, header, start, end, record_filter
+                    )
+                )
+                for start, end in chosen
+            ]
+            probability = self.sample_rate
+        except ChunkBoundaryError:
+            rows = RecordReader.read_file_rows(
+                file_path, READER_MODE_MMAP, record_filter
+            )
+            units = [self._count_rows(rows)]
+            probability = 1.0
+
+        for unit in units:
+            self._add_unit(unit, probability)
+        return sum(counts[0] for unit in units for counts in unit.values())
+
+    def merge(self, other: "RecordAggregator") -> "RecordAggregator":
+        """
+        他のアグリゲータの集計結果と推定値を合算し、自身を返す。
+        推定値を持たないアグリゲータはすべて読んだものとして合算する。
+        """
+        if not isinstance(other, SampledRecordAggregator):
+            unit = {
+                key: [counts["total"], counts["success"]]
+                for key, counts in other.site_app_stats.items()
+            }
+            self._add_unit(unit, 1.0)
+            return self
+
+        super().merge(other)
+        for key, values in other.estimates.items():
+            estimate = self.estimates.setdefault(key, [0.0] * 5)
+            for i, value in enumerate(values):
+                estimate[i] += value
+        return self
+
+    def __add__(self, other: "RecordAggregator") -> "RecordAggregator":
+        if not isinstance(other, RecordAggregator):
+            return NotImplemented
+        merged = SampledRecordAggregator(
+            self.sample_rate,
+            self.confidence,
+            self.seed,
+            self.block_size,
+            self.success_rules,
+        )
+        return merged.merge(self).merge(other)
+
+    def _count_rows(self, rows: Iterable[Tuple[int, str, str, str]]) -> UnitCounts:
+        is_success = self.success_rules.is_success
+        unit: UnitCounts = {}
+        for endtime, site, app, rc in rows:
+            _add_counts(unit, (endtime, site, app), 1, is_success(app, rc))
+        return unit
+
+    def _add_unit(self, unit: UnitCounts, probability: float) -> None:
+        """抽出確率probabilityで選んだ1区間分の件数を加える"""
+        weight = 1 / probability
+        variance_weight = (1 - probability) / probability**2
+        for key, (total, success) in unit.items():
+            stats = self.site_app_stats[key]
+            stats["total"] += total
+            stats["success"] += success
+
+            estimate = self.estimates.setdefault(key, [0.0] * 5)
+            estimate[0] += total * weight
+            estimate[1] += success * weight
+            estimate[2] += variance_weight * total * total
+            estimate[3] += variance_weight * success * success
+            estimate[4] += variance_weight * total * success
+
+    def _summary_row(self, key: GroupKey, counts: Dict[str, int]) -> Dict:
+        """集計キー1件分の推定値と信頼区間を生成する"""
+        row = super()._summary_row(key, counts)
+        total, success, var_total, var_success, covariance = self.estimates[key]
+
+        total_margin = self.z * math.sqrt(var_total)
+        rate = success / total if total else 0.0
+        # 成功率は比推定量として線形化した分散を使う
+        var_rate = max(
+            0.0, var_success - 2 * rate * covariance + rate * rate * var_total
+        ) / (total * total) if total else 0.0
+        rate_margin = self.z * math.sqrt(var_rate)
+
+        row["TotalCount"] = round(total)
+        row["SuccessCount"] = round(success)
+        row["Total_Low"] = max(counts["total"], math.floor(total - total_margin))
+        row["Total_High"] = math.ceil(total + total_margin)
+        row["SR_Low"] = format(max(0.0, rate - rate_margin) * 100, ".2f")
+        row["SR_High"] = format(min(1.0, rate + rate_margin) * 100, ".2f")
+        return row
+
+    def _extra_metric_names(self) -> List[str]:
+        return ["Total_Low", "Total_High", "SR_Low", "SR_High"]
+
+    def _missing_value(self, column: str) -> str:
+        """行のないアプリの成功率の信頼区間は_SR列と同じ既定値にする"""
+        if column.endswith(("_SR_Low", "_SR_High")):
+            return format(DEFAULT_SUCCESS_RATE, ".2f")
+        return super()._missing_value(column)
+
+
+def _add_counts(unit: UnitCounts, key: GroupKey, total: int, success: int) -> None:
+    counts = unit.get(key)
+    if counts is None:
+        unit[key] = [total, int(success)]
+    else:
+        counts[0] += total
+        counts[1] += success
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+SIDECAR_SUFFIX = ".cols"
+SIDECAR_MAGIC = b"GACCOLS1"
+HASH_CHUNK_SIZE = 1024 * 1024
+_HEADER_LENGTH = struct.Struct("<I")
+_ALIGNMENT = 8
+
+Columns = Dict[str, array]
+Dictionaries = Dict[str, List[str]]
+
+
+def sidecar_path(file_path: str) -> str:
+    """ファイルに対応するサイドカーのパスを返す"""
+    return file_path + SIDECAR_SUFFIX
+
+
+def content_hash(file_path: str) -> str:
+    """
+    ファイルの内容のハッシュを返す
+
+    Raises:
+        OSError: ファイルを開けない場合
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_sidecar(
+    path: str, digest: str, dictionaries: Dictionaries, columns: Dict[str, array]
+) -> None:
+    """
+    辞書と列をサイドカーに書き出す。一時ファイルに書き込んでから置き換える。
+
+    形式は マジック / ヘッダ長 / JSONヘッダ / 8バイト境界に揃えた各列のバイト列 で、
+    ヘッダには内容のハッシュ、辞書、各列の型と位置を持つ。
+
+    Raises:
+        OSError: 書き込めない場合
+    """
+    layout = []
+    offset = 0
+    for name, values in columns.items():
+        size = len(values) * values.itemsize
+        layout.append([name, values.typecode, offset, len(values)])
+        offset += _align(size)
+
+    header = json.dumps(
+        {
+            "hash": digest,
+            "byteorder": sys.byteorder,
+            "dictionaries": dictionaries,
+            "columns": layout,
+        },
+        ensure_ascii=False,
+    ).encode("utf-8")
+    prefix = SIDECAR_MAGIC + _HEADER_LENGTH.pack(len(header)) + header
+
+    # 同時に書き出す他のプロセスと一時ファイルが衝突しないよう、名前は一意にする
+    directory, name = os.path.split(path)
+    fd, temp_path = tempfile.mkstemp(
+        prefix=f".{name}.", suffix=".tmp", dir=directory or None
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(prefix)
+            f.write(b"\0" * (_align(len(prefix)) - len(prefix)))
+            for values in columns.values():
+                data = values.tobytes()
+                f.write(data)
+                f.write(b"\0" * (_align(len(data)) - len(data)))
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def load_sidecar(path: str, digest: str) -> Optional[Tuple[Dictionaries, Columns]]:
+    """
+    サイドカーをメモリマップし、辞書と列を返す。
+    サイドカーが無い、壊れている、または内容のハッシュが一致しない場合は None を返す。
+
+    列は配列に写してからマップを閉じるため、返した値はサイドカーのファイルに依存しない。
+    """
+    try:
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    with mapped:
+        try:
+            if mapped[: len(SIDECAR_MAGIC)] != SIDECAR_MAGIC:
+                return None
+            start = len(SIDECAR_MAGIC) + _HEADER_LENGTH.size
+            (header_length,) = _HEADER_LENGTH.unpack_from(mapped, len(SIDECAR_MAGIC))
+            header = json.loads(mapped[start : start + header_length].decode("utf-8"))
+            if header["hash"] != digest or header["byteorder"] != sys.byteorder:
+                return None
+
+            data_start = _align(start + header_length)
+            columns = {}
+            for name, typecode, offset, length in header["columns"]:
+                column = array(typecode)
+                begin = data_start + offset
+                size = length * column.itemsize
+                if begin + size > len(mapped):
+                    return None
+                column.frombytes(mapped[begin : begin + size])
+                columns[name] = column
+            return header["dictionaries"], columns
+        except (KeyError, TypeError, ValueError, struct.error):
+            return None
+
+
+def _align(size: int) -> int:
+    return (size + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
@@ -0,0 +1,283 @@
+import hashlib
+import math
+from collections import Counter, defaultdict
+from typing import (
+    DefaultDict,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    TextIO,
+    Tuple,
+)
+
+from models import AggregationRecord, EncodedRecords, RecordAggregator, RecordReader
+from success_rules import SuccessRules
+
+METRIC_DISTINCT = "distinct"
+METRIC_QUANTILE = "quantile"
+DEFAULT_QUANTILES = (0.5, 0.95, 0.99)
+
+
+class HyperLogLog:
+    """
+    固定メモリで異なり数を推定するスケッチ
+
+    2**precision個のレジスタを持ち、標準誤差はおよそ1.04 / sqrt(2**precision)。
+    同じprecisionのスケッチ同士はレジスタごとの最大値で合算できる。
+    """
+
+    def __init__(self, precision: int = 10):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value: str) -> None:
+        """値を1つ加える"""
+        hashed = int.from_bytes(
+            hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big"
+        )
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        """他のスケッチを取り込み、自身を返す"""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog with different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def estimate(self) -> int:
+        """異なり数の推定値を返す"""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)  # 小さい範囲は線形計数で補正
+        return round(estimate)
+
+
+class LogHistogram:
+    """
+    対数幅のバケットで分位点を推定するヒストグラム
+
+    分位点の相対誤差はrelative_accuracy以下。バケット数は値の桁の広さにだけ
+    依存し、行数には依存しない。バケットごとの件数の和で合算できる。
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets: Counter = Counter()
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        """
+        値を1つ加える
+
+        Raises:
+            ValueError: 負の値の場合
+        """
+        if value < 0:
+            raise ValueError(f"Negative value for quantile metric: {value}")
+        self.count += 1
+        if value == 0:
+            self.zero_count += 1
+        else:
+            self.buckets[math.ceil(math.log(value) / self._log_gamma)] += 1
+
+    def merge(self, other: "LogHistogram") -> "LogHistogram":
+        """他のヒストグラムを取り込み、自身を返す"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge LogHistogram with different accuracy")
+        self.buckets.update(other.buckets)
+        self.zero_count += other.zero_count
+        self.count += other.count
+        return self
+
+    def quantile(self, q: float) -> Optional[float]:
+        """分位点の推定値を返す。値がなければ None"""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # バケットの上端と下端の中間を代表値にする
+                return 2 * self._gamma**index / (self._gamma + 1)
+        return 2 * self._gamma ** max(self.buckets) / (self._gamma + 1)
+
+
+class MetricSpec:
+    """スケッチで集計する指標の定義"""
+
+    def __init__(
+        self,
+        name: str,
+        column: str,
+        kind: str,
+        quantiles: Sequence[float] = DEFAULT_QUANTILES,
+        precision: int = 10,
+        relative_accuracy: float = 0.01,
+    ):
+        if kind not in (METRIC_DISTINCT, METRIC_QUANTILE):
+            raise ValueError(f"Unknown metric kind: {kind}")
+        self.name = name
+        self.column = column
+        self.kind = kind
+        self.quantiles = tuple(quantiles)
+        self.precision = precision
+        self.relative_accuracy = relative_accuracy
+
+    def new_sketch(self):
+        if self.kind == METRIC_DISTINCT:
+            return HyperLogLog(self.precision)
+        return LogHistogram(self.relative_accuracy)
+
+    def output_names(self) -> List[str]:
+        """summarizeの各行に出力する列名"""
+        if self.kind == METRIC_DISTINCT:
+            return [self.name]
+        return [f"{self.name}_p{q * 100:g}" for q in self.quantiles]
+
+    def outputs(self, sketch) -> List:
+        """スケッチから出力する値"""
+        if self.kind == METRIC_DISTINCT:
+            return [sketch.estimate()]
+        return [
+            "" if value is None else format(value, ".3f")
+            for value in (sketch.quantile(q) for q in self.quantiles)
+        ]
+
+
+class SketchRecordAggregator(RecordAggregator):
+    """
+    件数に加え、集計キーごとに固定メモリのスケッチで指標を集計するクラス
+
+    異なり数はHyperLogLog、分位点は対数幅ヒストグラムで推定する。
+    スケッチはファイル間・プロセス間でmerge()により合算できる。
+    """
+
+    def __init__(
+        self,
+        metrics: Sequence[MetricSpec],
+        success_rules: Optional[SuccessRules] = None,
+    ):
+        super().__init__(success_rules)
+        self.metrics = list(metrics)
+        self.sketches: DefaultDict[Tuple[int, str, str], List] = defaultdict(
+            self._new_sketches
+        )
+
+    def __add__(self, other: "RecordAggregator") -> "RecordAggregator":
+        if not isinstance(other, SketchRecordAggregator):
+            return NotImplemented
+        merged = SketchRecordAggregator(self.metrics, self.success_rules)
+        return merged.merge(self).merge(other)
+
+    def _new_sketches(self) -> List:
+        return [metric.new_sketch() for metric in self.metrics]
+
+    def extra_fields(self) -> List[str]:
+        """RecordReader.read_rowsに渡す追加の列"""
+        return [metric.column for metric in self.metrics]
+
+    def process(self, records: Iterator[AggregationRecord]) -> None:
+        """
+        AggregationRecordは指標の列を持たないため集計できない
+
+        Raises:
+            TypeError: 常に送出する。process_textioかprocess_rowsを使う
+        """
+        raise TypeError("SketchRecordAggregator requires metric columns")
+
+    def process_encoded(self, encoded: EncodedRecords) -> None:
+        """
+        辞書符号化したレコードは指標の列を持たないため集計できない
+
+        Raises:
+            TypeError: 常に送出する。process_textioかprocess_rowsを使う
+        """
+        raise TypeError("SketchRecordAggregator requires metric columns")
+
+    def process_textio(self, textio: TextIO) -> None:
+        """
+        ファイルオブジェクトを読み、件数とスケッチを集計する
+
+        Raises:
+            ValueError: フォーマット不正、または分位点の列が数値でない場合
+        """
+        rows = RecordReader.read_rows(textio, self.extra_fields())
+        self.process_rows(rows)
+
+    def process_rows(self, rows: Iterable[Tuple]) -> None:
+        """
+        (endtime, site, app, rc, 追加の列...)の行を集計する
+
+        追加の列が空の行はその指標に加えない。
+
+        Raises:
+            ValueError: 分位点の列が有限の非負の数値でない場合
+        """
+        rows = list(rows)
+        is_success = self.success_rules.is_success
+        kinds = [metric.kind for metric in self.metrics]
+        for row in rows:
+            # 不正な値で途中終了して件数が中途半端にならないよう、先に検証する
+            for value, kind in zip(row[4:], kinds):
+                if value and kind == METRIC_QUANTILE:
+                    number = float(value)
+                    if not (math.isfinite(number) and number >= 0):
+                        raise ValueError(f"Invalid value for quantile metric: {value}")
+
+        for row in rows:
+            key = row[:3]
+            stats = self.site_app_stats[key]
+            stats["total"] += 1
+            stats["success"] += is_success(row[2], row[3])
+            for sketch, value, kind in zip(self.sketches[key], row[4:], kinds):
+                if value:
+                    sketch.add(float(value) if kind == METRIC_QUANTILE else value)
+
+    def merge(self, other: "RecordAggregator") -> "RecordAggregator":
+        """他のアグリゲータの件数とスケッチを取り込み、自身を返す"""
+        super().merge(other)
+        for key, sketches in getattr(other, "sketches", {}).items():
+            for own, theirs in zip(self.sketches[key], sketches):
+                own.merge(theirs)
+        return self
+
+    def _summary_row(self, key: Tuple[int, str, str], counts: Dict[str, int]) -> Dict:
+        """件数にスケッチの推定値を加えた集計結果を生成する"""
+        row = super()._summary_row(key, counts)
+        sketches = self.sketches.get(key) or self._new_sketches()
+        for metric, sketch in zip(self.metrics, sketches):
+            row.update(zip(metric.output_names(), metric.outputs(sketch)))
+        return row
+
+    def _extra_metric_names(self) -> List[str]:
+        return [name for metric in self.metrics for name in metric.output_names()]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["sketches"] = dict(self.sketches)
+        return state
+
+    def __setstate__(self, state):
+        sketches = state.pop("sketches")
+        self.__dict__.update(state)
+        self.sketches = defaultdict(self._new_sketches, sketches)
@@ -0,0 +1,201 @@
+import heapq
+import os
+import pickle
+import tempfile
+import zlib
+from collections import Counter
+from itertools import compress, islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from models import AggregationRecord, EncodedRecords, RecordAggregator
+from success_rules import SuccessRules
+
+SpilledEntry = Tuple[Tuple[int, str, str], int, int]
+
+DEFAULT_MAX_GROUPS = 1_000_000
+DEFAULT_PARTITIONS = 16
+PROCESS_BATCH_SIZE = 100_000
+
+
+class SpillingRecordAggregator(RecordAggregator):
+    """
+    メモリ上の集計キー数に上限を設け、超えた分を一時ファイルに書き出すクラス
+
+    集計キー数がmax_groupsを超えると、全キーをハッシュで分割したパーティション
+    ごとの一時ファイルに追記してメモリを空ける。summarize時にパーティション
+    ごとに合算・整列し、整列済みの結果をマージしてキー順に返すため、
+    出力はメモリ上だけで集計した場合と同じになる。
+    """
+
+    def __init__(
+        self,
+        max_groups: int = DEFAULT_MAX_GROUPS,
+        partitions: int = DEFAULT_PARTITIONS,
+        spill_dir: Optional[str] = None,
+        success_rules: Optional[SuccessRules] = None,
+    ):
+        if max_groups < 1 or partitions < 1:
+            raise ValueError("max_groups and partitions must be positive")
+        super().__init__(success_rules)
+        self.max_groups = max_groups
+        self.partitions = partitions
+        self.spill_dir = spill_dir
+        self.spill_count = 0
+        self._temp_dir: Optional[tempfile.TemporaryDirectory] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        """一時ファイルを削除する"""
+        if self._temp_dir is not None:
+            self._temp_dir.cleanup()
+            self._temp_dir = None
+            self.spill_count = 0
+
+    def __getstate__(self):
+        raise TypeError("SpillingRecordAggregator cannot be pickled")
+
+    def process(self, records: Iterator[AggregationRecord]) -> None:
+        """レコードを数え上げ、上限を超えたら一時ファイルに書き出す"""
+        records = iter(records)
+        while True:
+            batch = list(islice(records, PROCESS_BATCH_SIZE))
+            if not batch:
+                break
+            super().process(iter(batch))
+            self._spill_if_needed()
+
+    def process_encoded(self, encoded: EncodedRecords) -> None:
+        """
+        辞書符号化したレコードを数え上げ、上限を超えたら一時ファイルに書き出す。
+        1ファイル分の集計キーが上限を超える場合もあるため、キーを加えるたびに確かめる。
+        """
+        totals = Counter(encoded.group_codes)
+        successes = Counter(compress(encoded.group_codes, encoded.successes))
+        for code, total in totals.items():
+            stats = self.site_app_stats[encoded.groups[code]]
+            stats["total"] += total
+            stats["success"] += successes[code]
+            if len(self.site_app_stats) > self.max_groups:
+                self._spill()
+
+    def merge(self, other: "RecordAggregator") -> "RecordAggregator":
+        """他のアグリゲータの集計途中の結果（書き出し済みの分を含む）を取り込む"""
+        for key, total, success in other.iter_entries():
+            stats = self.site_app_stats[key]
+            stats["total"] += total
+            stats["success"] += success
+            if len(self.site_app_stats) > self.max_groups:
+                self._spill()
+        return self
+
+    def __add__(self, other: "RecordAggregator") -> "RecordAggregator":
+        if not isinstance(other, RecordAggregator):
+            return NotImplemented
+        merged = SpillingRecordAggregator(
+            self.max_groups, self.partitions, self.spill_dir, self.success_rules
+        )
+        return merged.merge(self).merge(other)
+
+    def iter_summary(self) -> Iterator[Dict]:
+        """パーティションごとに合算・整列した結果をマージし、集計キーの順に返す"""
+        if not self.spill_count:
+            yield from super().iter_summary()
+            return
+
+        for key, total, success in self.iter_combined_entries():
+            yield self._summary_row(key, {"total": total, "success": success})
+
+    def iter_combined_entries(self) -> Iterator[SpilledEntry]:
+        """
+        書き出し済みの分を含め、同じ集計キーを合算した結果を返す。
+        書き出し済みの場合はパーティションごとに合算・整列した結果をキーの順にマージする。
+        """
+        if not self.spill_count:
+            yield from super().iter_combined_entries()
+            return
+
+        runs = [self._write_sorted_run(p) for p in range(self.partitions)]
+        yield from heapq.merge(*(_read_entries(r) for r in runs))
+
+    def iter_entries(self) -> Iterator[SpilledEntry]:
+        """書き出し済みの分を含め、集計途中の結果を順不同で返す"""
+        if self._temp_dir is not None:
+            for partition in range(self.partitions):
+                yield from _read_entries(self._partition_path(partition))
+        for key, counts in self.site_app_stats.items():
+            yield key, counts["total"], counts["success"]
+
+    def _spill_if_needed(self) -> None:
+        if len(self.site_app_stats) > self.max_groups:
+            self._spill()
+
+    def _spill(self) -> None:
+        """メモリ上の集計結果をパーティションごとの一時ファイルに追記して空にする"""
+        if self._temp_dir is None:
+            self._temp_dir = tempfile.TemporaryDirectory(dir=self.spill_dir)
+
+        buckets: List[List[SpilledEntry]] = [[] for _ in range(self.partitions)]
+        for key, counts in self.site_app_stats.items():
+            buckets[self._partition_of(key)].append(
+                (key, counts["total"], counts["success"])
+            )
+        for partition, entries in enumerate(buckets):
+            if entries:
+                with open(self._partition_path(partition), "ab") as f:
+                    pickle.dump(entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        self.site_app_stats.clear()
+        self.spill_count += 1
+
+    def _write_sorted_run(self, partition: int) -> str:
+        """1パーティション分を合算・整列して一時ファイルに書き出し、そのパスを返す"""
+        combined: Dict[Tuple[int, str, str], List[int]] = {}
+        for key, total, success in _read_entries(self._partition_path(partition)):
+            counts = combined.setdefault(key, [0, 0])
+            counts[0] += total
+            counts[1] += success
+        for key, counts in self.site_app_stats.items():
+            if self._partition_of(key) == partition:
+                merged = combined.setdefault(key, [0, 0])
+                merged[0] += counts["total"]
+                merged[1] += counts["success"]
+
+        run_path = os.path.join(self._temp_dir.name, f"run_{partition}.pickle")
+        with open(run_path, "wb") as f:
+            entries = [
+                (key, total, success) for key, (total, success) in combined.items()
+            ]
+            entries.sort()
+            for start in range(0, len(entries), PROCESS_BATCH_SIZE):
+                pickle.dump(
+                    entries[start : start + PROCESS_BATCH_SIZE],
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+        return run_path
+
+    def _partition_path(self, partition: int) -> str:
+        return os.path.join(self._temp_dir.name, f"partition_{partition}.pickle")
+
+    def _partition_of(self, key: Tuple[int, str, str]) -> int:
+        """プロセスに依らない安定したハッシュでパーティション番号を求める"""
+        endtime, site, app = key
+        return zlib.crc32(f"{endtime}\0{site}\0{app}".encode("utf-8")) % self.partitions
+
+
+def _read_entries(path: str) -> Iterator[SpilledEntry]:
+    """一時ファイルに書き出した結果を順に読み出す"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        while True:
+            try:
+                entries = pickle.load(f)
+            except EOFError:
+                break
+            yield from entries
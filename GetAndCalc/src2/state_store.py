@@ -0,0 +1,194 @@
+import hashlib
+import os
+import sqlite3
+from typing import Optional, Tuple
+
+from models import (
+    AGGREGATE_ENGINE_PYTHON,
+    EncodedRecords,
+    RecordAggregator,
+    RecordReader,
+    create_aggregator,
+)
+from success_rules import SuccessRules
+
+FINGERPRINT_BYTES = 4096
+LOAD_BATCH_SIZE = 100_000
+
+
+class AggregationStateStore:
+    """
+    集計途中の結果と、ファイルごとの読み込み済み位置をSQLiteに保存するクラス
+
+    ファイルは先頭バイトのハッシュで同一性を判定し、前回から追記された
+    バイトだけを集計する。集計結果と読み込み位置は同じトランザクションで
+    更新するため、途中で失敗しても二重計上しない。
+    """
+
+    def __init__(self, db_path: str):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(db_path)
+        self._create_tables()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _create_tables(self) -> None:
+        with self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS site_app_stats (
+                    endtime INTEGER NOT NULL,
+                    site TEXT NOT NULL,
+                    app TEXT NOT NULL,
+                    total INTEGER NOT NULL,
+                    success INTEGER NOT NULL,
+                    PRIMARY KEY (endtime, site, app)
+                )
+                """
+            )
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS file_offsets (
+                    file_key TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    offset INTEGER NOT NULL
+                )
+                """
+            )
+
+    def load(self, aggregator: RecordAggregator) -> RecordAggregator:
+        """
+        保存済みの集計結果をアグリゲータに取り込んで返す。
+        LOAD_BATCH_SIZE件ずつmergeで取り込むため、集計キー数に上限のある
+        アグリゲータでは上限を超えた分が一時ファイルに書き出される。
+        """
+        cursor = self.connection.execute(
+            "SELECT endtime, site, app, total, success FROM site_app_stats"
+        )
+        while True:
+            rows = cursor.fetchmany(LOAD_BATCH_SIZE)
+            if not rows:
+                break
+            batch = RecordAggregator(aggregator.success_rules)
+            for endtime, site, app, total, success in rows:
+                stats = batch.site_app_stats[(endtime, site, app)]
+                stats["total"] = total
+                stats["success"] = success
+            aggregator.merge(batch)
+        return aggregator
+
+    def latest_endtime(self) -> Optional[int]:
+        """保存済みの集計結果のうち最新のエポック分を返す。未保存なら None"""
+        return self.connection.execute(
+            "SELECT MAX(endtime) FROM site_app_stats"
+        ).fetchone()[0]
+
+    def prune(self, before_endtime: int) -> None:
+        """指定したエポック分より前の集計結果を削除する"""
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM site_app_stats WHERE endtime < ?", (before_endtime,)
+            )
+
+    def get_offset(self, file_key: str) -> Optional[Tuple[str, int]]:
+        """ファイルの指紋と読み込み済み位置を返す。未読なら None"""
+        return self.connection.execute(
+            "SELECT fingerprint, offset FROM file_offsets WHERE file_key = ?",
+            (file_key,),
+        ).fetchone()
+
+    def commit_file(
+        self,
+        file_key: str,
+        fingerprint: str,
+        offset: int,
+        delta: RecordAggregator,
+    ) -> None:
+        """1ファイル分の差分の集計結果と読み込み位置をまとめて保存する"""
+        with self.connection:
+            self.connection.executemany(
+                """
+                INSERT INTO site_app_stats (endtime, site, app, total, success)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (endtime, site, app) DO UPDATE SET
+                    total = total + excluded.total,
+                    success = success + excluded.success
+                """,
+                (
+                    (endtime, site, app, counts["total"], counts["success"])
+                    for (endtime, site, app), counts in delta.site_app_stats.items()
+                ),
+            )
+            self.connection.execute(
+                """
+                INSERT INTO file_offsets (file_key, fingerprint, offset)
+                VALUES (?, ?, ?)
+                ON CONFLICT (file_key) DO UPDATE SET
+                    fingerprint = excluded.fingerprint,
+                    offset = excluded.offset
+                """,
+                (file_key, fingerprint, offset),
+            )
+
+    def aggregate_file(
+        self,
+        file_key: str,
+        file_path: str,
+        engine: str = AGGREGATE_ENGINE_PYTHON,
+        success_rules: Optional[SuccessRules] = None,
+    ) -> int:
+        """
+        前回の読み込み位置以降の完結した行だけを集計して保存し、集計した行数を返す
+
+        先頭バイトが前回と異なるファイルはローテーションされたものとみなし、
+        先頭から集計する。追記部分に1行でも不正があれば何も保存しない。
+
+        Raises:
+            OSError: ファイルを開けない場合
+            ValueError: フォーマット不正の場合
+        """
+        header, data_start = RecordReader.read_header(file_path)
+        end = RecordReader.complete_lines_end(file_path)
+
+        start = data_start
+        saved = self.get_offset(file_key)
+        if saved is not None:
+            fingerprint, offset = saved
+            if data_start <= offset <= end and fingerprint == file_fingerprint(
+                file_path, offset
+            ):
+                start = offset
+
+        encoded = EncodedRecords()
+        RecordReader.read_rows_range(
+            file_path, header, start, end, sink=encoded.encoder(success_rules)
+        )
+        if not encoded:
+            if start == data_start:
+                raise ValueError("No data rows found in the file")
+            return 0
+
+        delta = create_aggregator(engine, success_rules)
+        delta.process_encoded(encoded)
+        self.commit_file(file_key, file_fingerprint(file_path, end), end, delta)
+        return len(encoded)
+
+
+def file_fingerprint(file_path: str, offset: int) -> str:
+    """
+    ファイル先頭からmin(offset, FINGERPRINT_BYTES)バイトのハッシュを返す
+
+    Raises:
+        OSError: ファイルを開けない場合
+    """
+    with open(file_path, "rb") as f:
+        return hashlib.sha1(f.read(min(offset, FINGERPRINT_BYTES))).hexdigest()
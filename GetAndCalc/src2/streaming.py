@@ -0,0 +1,123 @@
+import csv
+import heapq
+import sys
+from collections import defaultdict
+from typing import DefaultDict, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from models import (
+    DEFAULT_SUCCESS_RATE,
+    AggregationRecord,
+    RecordReader,
+    _new_counts,
+    format_epoch_minute,
+)
+
+STREAM_HEADER = ["EndTime", "Site", "App", "TotalCount", "SuccessCount", "SR"]
+
+
+class StreamingRecordAggregator:
+    """
+    1分単位のタンブリングウィンドウでレコードを集計するクラス
+
+    (site, app)ごとに未確定の分のウィンドウだけを保持する。これまでに見た
+    最大のEnd Time Localから許容遅延を引いた値をウォーターマークとし、
+    ウォーターマークより前のウィンドウを確定して出力・破棄する。
+    確定済みのウィンドウに届いた遅延レコードは数えずにlate_recordsに計上する。
+    process_textioでは、不正な行(ローテーションで再度届いたヘッダなど)を
+    数えずにinvalid_recordsに計上し、読み込みを続ける。
+    """
+
+    def __init__(self, allowed_lateness: int = 0):
+        """
+        Args:
+            allowed_lateness: 遅延レコードを受け付ける分数
+        """
+        if allowed_lateness < 0:
+            raise ValueError("allowed_lateness must be zero or positive")
+        self.allowed_lateness = allowed_lateness
+        self.open_windows: Dict[int, DefaultDict[Tuple[str, str], Dict[str, int]]] = {}
+        self.watermark: Optional[int] = None
+        self.late_records = 0
+        self.invalid_records = 0
+        self._window_heap: List[int] = []
+
+    def process(self, records: Iterator[AggregationRecord]) -> Iterator[Dict]:
+        """レコードを数え上げ、確定したウィンドウの集計結果を順に返す"""
+        for record in records:
+            endtime = record.endtime
+            if self.watermark is not None and endtime < self.watermark:
+                self.late_records += 1
+                continue
+
+            window = self.open_windows.get(endtime)
+            if window is None:
+                window = self.open_windows[endtime] = defaultdict(_new_counts)
+                heapq.heappush(self._window_heap, endtime)
+            stats = window[(record.site, record.app)]
+            stats["total"] += 1
+            stats["success"] += record.is_success
+
+            watermark = endtime - self.allowed_lateness
+            if self.watermark is None or watermark > self.watermark:
+                self.watermark = watermark
+                yield from self._close_windows(watermark)
+
+    def process_textio(self, textio: TextIO) -> Iterator[Dict]:
+        """
+        ファイルオブジェクトを1行ずつ読んで数え上げ、確定したウィンドウの集計結果を順に返す
+
+        Raises:
+            ValueError: ヘッダが欠けている場合
+        """
+        records = RecordReader.stream_textio(textio, on_invalid=self._count_invalid)
+        return self.process(records)
+
+    def _count_invalid(self, error: ValueError) -> None:
+        self.invalid_records += 1
+
+    def flush(self) -> Iterator[Dict]:
+        """未確定のウィンドウをすべて確定して返す（入力の終端で呼ぶ）"""
+        while self._window_heap:
+            yield from self._emit(heapq.heappop(self._window_heap))
+
+    def _close_windows(self, watermark: int) -> Iterator[Dict]:
+        """ウォーターマークより前のウィンドウを確定して返す"""
+        while self._window_heap and self._window_heap[0] < watermark:
+            yield from self._emit(heapq.heappop(self._window_heap))
+
+    def _emit(self, endtime: int) -> Iterator[Dict]:
+        """1分のウィンドウの集計結果を(site, app)順に返して破棄する"""
+        window = self.open_windows.pop(endtime)
+        formatted_endtime = format_epoch_minute(endtime)
+        for (site, app), counts in sorted(window.items()):
+            total = counts["total"]
+            success = counts["success"]
+            sr = success / total * 100 if total else DEFAULT_SUCCESS_RATE
+            yield {
+                "EndTime": formatted_endtime,
+                "Site": site,
+                "App": app,
+                "TotalCount": total,
+                "SuccessCount": success,
+                "SR": format(sr, ".2f"),
+            }
+
+
+if __name__ == "__main__":
+    # 標準入力のCSVを集計し、確定したウィンドウから順に標準出力へ書き出す
+    # 例: tail -F feed.csv | python streaming.py 2
+    lateness = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    aggregator = StreamingRecordAggregator(allowed_lateness=lateness)
+    writer = csv.DictWriter(sys.stdout, STREAM_HEADER)
+    writer.writeheader()
+    try:
+        for row in aggregator.process_textio(sys.stdin):
+            writer.writerow(row)
+            sys.stdout.flush()
+    finally:
+        writer.writerows(aggregator.flush())
+        print(
+            f"late records: {aggregator.late_records}, "
+            f"invalid records: {aggregator.invalid_records}",
+            file=sys.stderr,
+        )
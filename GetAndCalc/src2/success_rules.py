@@ -0,0 +1,109 @@
+import json
+import re
+from typing import Dict, List, Mapping, Pattern, Tuple, Union
+
+SUCCESS_CACHE_SIZE = 65536
+
+RuleConfig = Union[List[str], Mapping[str, List[str]]]
+
+
+class SuccessRules:
+    """
+    appごとに成功とみなす結果コードの判定規則
+
+    完全一致のコードは(app, rc)をキーとする1つのハッシュ表に展開する。
+    前方一致・正規表現の規則は、表にない(app, rc)が初めて現れたときに
+    1回だけ評価し、結果を同じ表にキャッシュする。
+    """
+
+    def __init__(
+        self,
+        app_names: List[str],
+        codes: Mapping[str, List[str]],
+        prefixes: Mapping[str, List[str]],
+        patterns: Mapping[str, List[Pattern]],
+    ):
+        self.app_names = list(app_names)
+        self._prefixes = {app: tuple(values) for app, values in prefixes.items()}
+        self._patterns = {app: list(values) for app, values in patterns.items()}
+        self._table: Dict[Tuple[str, str], bool] = {
+            (app, rc): True for app, values in codes.items() for rc in values
+        }
+        self._exact_size = len(self._table)
+
+    @classmethod
+    def from_dict(cls, config: Mapping[str, RuleConfig]) -> "SuccessRules":
+        """
+        設定の辞書から判定規則を生成する。appの順序は出力ヘッダの順序になる。
+
+        {"app1": ["PROC_OK"], "app2": {"codes": [...], "prefixes": [...],
+        "patterns": [...]}} の形式を受け付ける。
+
+        Raises:
+            ValueError: 設定の形式が不正な場合
+        """
+        if not isinstance(config, Mapping):
+            raise ValueError("Success rules must be an object keyed by app")
+
+        codes: Dict[str, List[str]] = {}
+        prefixes: Dict[str, List[str]] = {}
+        patterns: Dict[str, List[Pattern]] = {}
+        for app, rule in config.items():
+            if isinstance(rule, list):
+                rule = {"codes": rule}
+            if not isinstance(rule, Mapping):
+                raise ValueError(f"Invalid success rule for {app}")
+
+            unknown_keys = set(rule) - {"codes", "prefixes", "patterns"}
+            if unknown_keys:
+                raise ValueError(
+                    f"Unknown success rule keys for {app}: "
+                    f"{', '.join(sorted(unknown_keys))}"
+                )
+
+            codes[app] = cls._string_list(app, rule.get("codes", []))
+            prefixes[app] = cls._string_list(app, rule.get("prefixes", []))
+            try:
+                patterns[app] = [
+                    re.compile(p)
+                    for p in cls._string_list(app, rule.get("patterns", []))
+                ]
+            except re.error as e:
+                raise ValueError(f"Invalid success pattern for {app}: {e}")
+
+        return cls(list(config), codes, prefixes, patterns)
+
+    @classmethod
+    def load(cls, config_path: str) -> "SuccessRules":
+        """
+        JSONの設定ファイルから判定規則を読み込む。
+
+        Raises:
+            FileNotFoundError: 設定ファイルが存在しない場合
+            ValueError: JSON形式や設定の形式が不正な場合
+        """
+        with open(config_path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    @staticmethod
+    def _string_list(app: str, values) -> List[str]:
+        if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+            raise ValueError(f"Success rule values for {app} must be a list of strings")
+        return values
+
+    def is_success(self, app: str, rc: str) -> bool:
+        """appの結果コードが成功かどうかを返す"""
+        key = (app, rc)
+        result = self._table.get(key)
+        if result is None:
+            result = self._resolve(app, rc)
+            if len(self._table) - self._exact_size < SUCCESS_CACHE_SIZE:
+                self._table[key] = result
+        return result
+
+    def _resolve(self, app: str, rc: str) -> bool:
+        """完全一致以外の規則で判定する"""
+        prefixes = self._prefixes.get(app)
+        if prefixes and rc.startswith(prefixes):
+            return True
+        return any(pattern.fullmatch(rc) for pattern in self._patterns.get(app, []))
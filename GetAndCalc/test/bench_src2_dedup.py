@@ -0,0 +1,98 @@
+"""
+重複除去なしの読み出しと、重複除去(集合/ブルームフィルタ)ありの読み出しの比較
+
+ローテーションで前後のファイルが一部重複する収集結果を想定する。
+
+    python test/bench_src2_dedup.py [1ファイルの行数] [ファイル数]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src2"))
+
+from dedup import RecordDeduplicator
+from models import READER_MODE_MMAP, READER_MODE_TEXT, RecordAggregator, RecordReader
+
+OVERLAP = 0.2  # 前のファイルの末尾と重複する行の割合
+
+
+def write_files(directory: str, rows: int, files: int):
+    step = int(rows * (1 - OVERLAP))
+    paths = []
+    for n in range(files):
+        path = os.path.join(directory, f"input{n}.csv")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            f.write("Id,End Time Local,Site,APP,RC\n")
+            for i in range(n * step, n * step + rows):
+                second = i % 3600
+                f.write(
+                    f"{i},2024/01/01 10:{second // 60:02d}:{second % 60:02d},"
+                    f"Site{i % 50},app{i % 2 + 1},{'ERROR' if i % 7 else 'PROC_OK'}\n"
+                )
+        paths.append(path)
+    return paths, step * (files - 1) + rows
+
+
+def aggregate(paths, mode, deduplicator):
+    aggregator = RecordAggregator()
+    for path in paths:
+        aggregator.process_encoded(
+            RecordReader.read_encoded(path, mode, deduplicator=deduplicator)
+        )
+    return aggregator
+
+
+def measure(name, paths, mode, make_deduplicator):
+    deduplicator = make_deduplicator()
+    start = time.perf_counter()
+    aggregator = aggregate(paths, mode, deduplicator)
+    elapsed = time.perf_counter() - start
+
+    # tracemallocは実行を遅くするため、メモリは別に計測する
+    tracemalloc.start()
+    aggregate(paths, mode, make_deduplicator())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = sum(total for _, total, _ in aggregator.iter_entries())
+    detail = ""
+    if deduplicator is not None:
+        state = state_size(deduplicator) / 1024 / 1024
+        detail = f" {deduplicator.mode}, state {state:.1f} MiB"
+    print(
+        f"{name:<20} {elapsed:8.3f} s {peak / 1024 / 1024:8.1f} MiB "
+        f"{total:>9} rows{detail}"
+    )
+    return total
+
+
+def state_size(deduplicator: RecordDeduplicator) -> int:
+    """重複判定に使う集合またはブルームフィルタのおおよそのバイト数"""
+    if deduplicator.bloom is not None:
+        return deduplicator.bloom.size_in_bytes
+    seen = deduplicator.seen
+    return sys.getsizeof(seen) + sum(map(sys.getsizeof, seen))
+
+
+if __name__ == "__main__":
+    row_count = int(sys.argv[1]) if len(sys.argv) > 1 else 250_000
+    file_count = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths, unique = write_files(tmp_dir, row_count, file_count)
+        print(f"{file_count} files x {row_count} rows, {unique} unique rows")
+        for mode in (READER_MODE_TEXT, READER_MODE_MMAP):
+            measure(f"{mode} plain", paths, mode, lambda: None)
+            exact = measure(f"{mode} dedup exact", paths, mode, RecordDeduplicator)
+            bloom = measure(
+                f"{mode} dedup bloom",
+                paths,
+                mode,
+                lambda: RecordDeduplicator(max_exact_entries=row_count // 2),
+            )
+            assert exact == unique
+            assert unique * 0.99 <= bloom <= unique
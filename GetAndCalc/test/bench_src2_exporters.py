@@ -0,0 +1,46 @@
+"""
+CSVFormatterの行ごとにキーを確認する経路と、schemaを指定した経路の比較
+
+    python test/bench_src2_exporters.py [行数]
+"""
+import io
+import os
+import sys
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src2"))
+
+from exporters import CSVFormatter
+from models import RecordAggregator
+
+
+def build_summary(rows: int):
+    header = RecordAggregator().summary_header()
+    summary = []
+    for i in range(rows):
+        row = {"EndTime": f"2024/01/01 {i // 60 % 24:02d}:{i % 60:02d}:00"}
+        row["Site"] = f"Site{i}"
+        for col in header[2:]:
+            row[col] = "100.00" if col.endswith("_SR") else str(i % 97)
+        summary.append(row)
+    return header, summary
+
+
+def measure(name, formatter, summary):
+    output = io.StringIO()
+    start = time.perf_counter()
+    formatter.write(summary, output)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>10}: {elapsed:.2f}s")
+    return output.getvalue()
+
+
+if __name__ == "__main__":
+    row_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    header, summary = build_summary(row_count)
+
+    print(f"{row_count} rows x {len(header)} columns")
+    expected = measure("per-row", CSVFormatter(), summary)
+    actual = measure("schema", CSVFormatter(header), summary)
+    assert actual == expected
@@ -0,0 +1,81 @@
+"""
+ファイルから集計結果までの、AggregationRecordを行ごとに生成する経路と
+辞書符号化した経路の比較
+
+どちらの経路も解析を含めて計測する。AggregationRecordの経路はread_file_rowsが
+(endtime, site, app, rc)の行のリストを作るが、辞書符号化の経路は行をリストに
+溜めずに符号化するため、ピークには異なる行と組の分だけが含まれる。
+
+    python test/bench_src2_records.py [行数]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src2"))
+
+from models import (
+    READER_MODE_MMAP,
+    READER_MODE_TEXT,
+    RecordAggregator,
+    RecordReader,
+    aggregate_file,
+)
+
+RC_VALUES = ["PROC_SUCCESS", "PROC_OK", "PROC_COMPLETED", "ERROR"]
+
+
+def write_csv(path: str, rows: int) -> None:
+    rng = random.Random(0)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write("End Time Local,Site,APP,RC\n")
+        for _ in range(rows):
+            # 1時間分の収集ファイルを想定し、時刻は1時間内に散らばらせる
+            second = rng.randrange(3600)
+            f.write(
+                f"2024/01/01 10:{second // 60:02d}:{second % 60:02d},"
+                f"Site{rng.randrange(50)},app{rng.randrange(1, 3)},"
+                f"{rng.choice(RC_VALUES)}\n"
+            )
+
+
+def run_records(path, mode):
+    # 辞書符号化の導入前と同じく、行ごとのAggregationRecordを1件ずつ数える
+    aggregator = RecordAggregator()
+    aggregator.process(RecordReader.from_file(path, mode))
+    return aggregator
+
+
+def run_encoded(path, mode):
+    return aggregate_file(path, reader_mode=mode)
+
+
+def measure(name, func, path, mode):
+    start = time.perf_counter()
+    aggregator = func(path, mode)
+    elapsed = time.perf_counter() - start
+
+    # tracemallocは実行を遅くするため、メモリは別に計測する
+    tracemalloc.start()
+    func(path, mode)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<20} {mode:<6} {elapsed:8.3f} s {peak / 1024 / 1024:10.1f} MiB")
+    return aggregator
+
+
+if __name__ == "__main__":
+    row_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "input.csv")
+        write_csv(path, row_count)
+
+        print(f"{row_count} rows (parse included)")
+        for mode in (READER_MODE_TEXT, READER_MODE_MMAP):
+            expected = measure("AggregationRecord", run_records, path, mode)
+            actual = measure("EncodedRecords", run_encoded, path, mode)
+            assert actual.summarize() == expected.summarize()
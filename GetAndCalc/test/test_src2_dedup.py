@@ -0,0 +1,213 @@
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src2"))
+
+from dedup import (
+    DEDUP_MODE_BLOOM,
+    DEDUP_MODE_EXACT,
+    RecordDeduplicator,
+    ScalableBloomFilter,
+    line_fingerprint,
+)
+from models import (
+    READER_MODE_COLUMNAR,
+    READER_MODE_MMAP,
+    READER_MODE_TEXT,
+    RecordReader,
+)
+
+HEADER = "Id,End Time Local,Site,APP,RC\n"
+
+
+def build_lines(start, stop):
+    return [
+        f"{i},2024/01/01 10:{i % 60:02d}:00,Site{i % 3},app{i % 2 + 1},PROC_OK\n"
+        for i in range(start, stop)
+    ]
+
+
+class TestRecordDeduplicatorReader(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_file(self, name, lines):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            f.write(HEADER + "".join(lines))
+        return path
+
+    def test_overlapping_rows_counted_once(self):
+        """ローテーションで2つのファイルに現れた行を1回だけ返すことをテスト"""
+        first = self.write_file("a.csv", build_lines(0, 100))
+        second = self.write_file("b.csv", build_lines(80, 150))
+
+        for mode in (READER_MODE_TEXT, READER_MODE_MMAP):
+            with self.subTest(mode=mode):
+                deduplicator = RecordDeduplicator()
+                rows = []
+                for path in (first, second):
+                    rows += RecordReader.read_file_rows(
+                        path, mode, deduplicator=deduplicator
+                    )
+                self.assertEqual(len(rows), 150)
+                self.assertEqual(deduplicator.duplicates, 20)
+                self.assertEqual(len(deduplicator), 150)
+
+    def test_repeated_rows_within_file_kept(self):
+        """同じファイル内で繰り返される行は重複としないことをテスト"""
+        path = self.write_file("a.csv", build_lines(0, 10) * 2)
+        deduplicator = RecordDeduplicator()
+        rows = RecordReader.read_rows_mmap(path, deduplicator=deduplicator)
+        self.assertEqual(len(rows), 20)
+        self.assertEqual(deduplicator.duplicates, 0)
+
+    def test_fully_duplicated_file_is_not_an_error(self):
+        """すべての行が重複するファイルを空として読めることをテスト"""
+        path = self.write_file("a.csv", build_lines(0, 10))
+        for mode in (READER_MODE_TEXT, READER_MODE_MMAP):
+            with self.subTest(mode=mode):
+                deduplicator = RecordDeduplicator()
+                RecordReader.read_file_rows(path, mode, deduplicator=deduplicator)
+                rows = RecordReader.read_file_rows(path, mode, deduplicator=deduplicator)
+                self.assertEqual(rows, [])
+
+    def test_invalid_file_not_recorded(self):
+        """フォーマット不正で読めなかったファイルの行を記録しないことをテスト"""
+        lines = build_lines(0, 10)
+        invalid = self.write_file("bad.csv", lines + ["11,,SiteA,app1,PROC_OK\n"])
+        valid = self.write_file("good.csv", lines)
+
+        deduplicator = RecordDeduplicator()
+        with self.assertRaises(ValueError):
+            RecordReader.read_rows_mmap(invalid, deduplicator=deduplicator)
+        rows = RecordReader.read_rows_mmap(valid, deduplicator=deduplicator)
+        self.assertEqual(len(rows), 10)
+
+    def test_line_endings_ignored(self):
+        """改行コードだけが異なる行を重複とすることをテスト"""
+        deduplicator = RecordDeduplicator()
+        RecordReader.read_rows_mmap(
+            self.write_file("a.csv", build_lines(0, 5)), deduplicator=deduplicator
+        )
+        crlf = [line.replace("\n", "\r\n") for line in build_lines(0, 5)]
+        rows = RecordReader.read_rows_mmap(
+            self.write_file("b.csv", crlf), deduplicator=deduplicator
+        )
+        self.assertEqual(rows, [])
+
+    def test_text_mode_stream(self):
+        """read_rowsでもファイルをまたいだ重複を除くことをテスト"""
+        deduplicator = RecordDeduplicator()
+        RecordReader.read_rows(
+            io.StringIO(HEADER + "".join(build_lines(0, 5))), deduplicator=deduplicator
+        )
+        rows = RecordReader.read_rows(
+            io.StringIO(HEADER + "".join(build_lines(3, 8))), deduplicator=deduplicator
+        )
+        self.assertEqual(len(rows), 3)
+
+    def test_columnar_mode_rejected(self):
+        """列形式の読み出しでは重複除去を指定できないことをテスト"""
+        path = self.write_file("a.csv", build_lines(0, 5))
+        with self.assertRaises(ValueError):
+            RecordReader.read_file_rows(
+                path, READER_MODE_COLUMNAR, deduplicator=RecordDeduplicator()
+            )
+
+
+class TestRecordDeduplicatorBloom(unittest.TestCase):
+    def test_switches_to_bloom_over_limit(self):
+        """上限を超えるとブルームフィルタに切り替え、記録済みの行を判定できることをテスト"""
+        deduplicator = RecordDeduplicator(max_exact_entries=100)
+        lines = [f"line{i}".encode() for i in range(500)]
+        for chunk in range(0, 500, 50):
+            with deduplicator.transaction():
+                for line in lines[chunk : chunk + 50]:
+                    self.assertTrue(deduplicator.is_new(line))
+
+        self.assertEqual(deduplicator.mode, DEDUP_MODE_BLOOM)
+        self.assertEqual(deduplicator.seen, set())
+        self.assertTrue(all(not deduplicator.is_new(line) for line in lines))
+        self.assertEqual(deduplicator.duplicates, 500)
+
+    def test_pending_bounded_within_file(self):
+        """1ファイル分の保留が上限を超えると仮のフィルタに移し、commitで記録することをテスト"""
+        deduplicator = RecordDeduplicator(max_exact_entries=100)
+        with deduplicator.transaction():
+            deduplicator.is_new(b"first")
+        lines = [f"line{i}".encode() for i in range(500)]
+
+        with self.assertRaises(ValueError):
+            with deduplicator.transaction():
+                for line in lines:
+                    self.assertTrue(deduplicator.is_new(line))
+                    self.assertLessEqual(len(deduplicator.pending), 100)
+                raise ValueError("invalid file")
+        self.assertIsNone(deduplicator.pending_bloom)
+        self.assertEqual(deduplicator.mode, DEDUP_MODE_EXACT)
+
+        with deduplicator.transaction():
+            for line in lines:
+                self.assertTrue(deduplicator.is_new(line))
+            self.assertIsNotNone(deduplicator.pending_bloom)
+
+        self.assertEqual(deduplicator.mode, DEDUP_MODE_BLOOM)
+        self.assertEqual(len(deduplicator), 501)
+        self.assertTrue(all(not deduplicator.is_new(line) for line in lines))
+        self.assertFalse(deduplicator.is_new(b"first"))
+
+    def test_extend_requires_following_stages(self):
+        """続きの段の番号から始めたフィルタだけを連結できることをテスト"""
+        bloom = ScalableBloomFilter(10)
+        with self.assertRaises(ValueError):
+            bloom.extend(ScalableBloomFilter(10))
+
+        following = ScalableBloomFilter(10, first_stage=1)
+        following.add(line_fingerprint(b"a"))
+        bloom.extend(following)
+        self.assertIn(line_fingerprint(b"a"), bloom)
+
+    def test_stays_exact_within_limit(self):
+        """上限以内では正確な集合で判定することをテスト"""
+        deduplicator = RecordDeduplicator(max_exact_entries=100)
+        with deduplicator.transaction():
+            deduplicator.is_new(b"a")
+        self.assertEqual(deduplicator.mode, DEDUP_MODE_EXACT)
+        self.assertFalse(deduplicator.is_new(b"a"))
+
+    def test_false_positive_rate_bound(self):
+        """スケーラブルブルームフィルタの偽陽性率が指定値以下に収まることをテスト"""
+        bloom = ScalableBloomFilter(1000, false_positive_rate=0.01)
+        for i in range(20000):
+            bloom.add(line_fingerprint(f"in{i}".encode()))
+        self.assertGreater(len(bloom.filters), 1)
+        self.assertTrue(
+            all(line_fingerprint(f"in{i}".encode()) in bloom for i in range(20000))
+        )
+
+        trials = 20000
+        false_positives = sum(
+            line_fingerprint(f"out{i}".encode()) in bloom for i in range(trials)
+        )
+        self.assertLessEqual(false_positives / trials, 0.01)
+
+    def test_invalid_arguments(self):
+        """範囲外の引数でValueErrorを送出することをテスト"""
+        with self.assertRaises(ValueError):
+            RecordDeduplicator(max_exact_entries=0)
+        with self.assertRaises(ValueError):
+            RecordDeduplicator(false_positive_rate=1.0)
+        with self.assertRaises(ValueError):
+            ScalableBloomFilter(0)
+
+
+if __name__ == "__main__":
+    unittest.main()
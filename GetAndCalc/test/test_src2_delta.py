@@ -0,0 +1,93 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src2"))
+
+from delta import SummaryDeltaIndex, write_manifest
+
+
+def summary_rows(totals):
+    return [
+        {"EndTime": "2024/01/01 10:00:00", "Site": site, "app1_Total": str(total)}
+        for site, total in totals.items()
+    ]
+
+
+class TestSummaryDeltaIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, "STATE", "export_index.db")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def export(self, rows, commit=True):
+        with SummaryDeltaIndex(self.db_path) as index:
+            changed = list(index.changed_rows(rows))
+            if commit:
+                index.commit()
+            return changed, index.counts
+
+    def test_only_inserted_and_changed_rows(self):
+        """追加・変更された行だけが返されることをテスト"""
+        self.export(summary_rows({"SiteA": 1, "SiteB": 2}))
+
+        changed, counts = self.export(summary_rows({"SiteA": 1, "SiteB": 3, "SiteC": 1}))
+
+        self.assertEqual([row["Site"] for row in changed], ["SiteB", "SiteC"])
+        self.assertEqual(counts, {"inserted": 1, "changed": 1, "unchanged": 1})
+
+    def test_uncommitted_rows_exported_again(self):
+        """commitしなかった行は次回も差分として返されることをテスト"""
+        self.export(summary_rows({"SiteA": 1}), commit=False)
+
+        changed, counts = self.export(summary_rows({"SiteA": 1}))
+
+        self.assertEqual(len(changed), 1)
+        self.assertEqual(counts["inserted"], 1)
+
+    def test_prune(self):
+        """指定時刻より前のハッシュが削除されることをテスト"""
+        self.export(summary_rows({"SiteA": 1}))
+        with SummaryDeltaIndex(self.db_path) as index:
+            index.prune("2024/01/01 11:00:00")
+
+        changed, _ = self.export(summary_rows({"SiteA": 1}))
+        self.assertEqual(len(changed), 1)
+
+    def test_latest_end_time(self):
+        """保存済みの最新の時刻を返すことをテスト"""
+        with SummaryDeltaIndex(self.db_path) as index:
+            self.assertIsNone(index.latest_end_time())
+        rows = summary_rows({"SiteA": 1}) + [
+            {"EndTime": "2024/01/01 10:05:00", "Site": "SiteA", "app1_Total": "1"}
+        ]
+        self.export(rows)
+        with SummaryDeltaIndex(self.db_path) as index:
+            self.assertEqual(index.latest_end_time(), "2024/01/01 10:05:00")
+
+    def test_missing_key_column(self):
+        """EndTimeやSiteがない行でValueErrorとなることをテスト"""
+        with self.assertRaises(ValueError):
+            self.export([{"Site": "SiteA"}])
+
+    def test_write_manifest(self):
+        """マニフェストに件数と出力ファイル名が含まれることをテスト"""
+        manifest_path = os.path.join(self.temp_dir.name, "delta.manifest.json")
+        with SummaryDeltaIndex(self.db_path) as index:
+            list(index.changed_rows(summary_rows({"SiteA": 1, "SiteB": 2})))
+            write_manifest(index.manifest(["OUTPUT/delta.csv"]), manifest_path)
+
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest["outputs"], ["delta.csv"])
+        self.assertEqual(manifest["rows"], 2)
+        self.assertEqual(manifest["inserted"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,284 @@
+import io
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src2"))
+
+import exporters
+from exporters import (
+    CSVFormatter,
+    FanOutExporter,
+    JSONFormatter,
+    NDJSONFormatter,
+    SQLiteStatisticsExporter,
+    StatisticsExporter,
+)
+
+
+def sample_rows():
+    return [
+        {"EndTime": "2024/01/01 10:00:00", "Site": "SiteA", "app1_Total": "3"},
+        {"EndTime": "2024/01/01 10:01:00", "Site": "SiteB", "app1_Total": "5"},
+    ]
+
+
+class TestFormatters(unittest.TestCase):
+    def test_csv_write_matches_format(self):
+        """逐次書き込みがformatと同じCSVを出力することをテスト"""
+        output = io.StringIO()
+        CSVFormatter().write(iter(sample_rows()), output)
+        self.assertEqual(output.getvalue(), CSVFormatter().format(sample_rows()))
+        self.assertTrue(output.getvalue().startswith("EndTime,Site,app1_Total"))
+
+    def test_csv_empty(self):
+        """空の統計結果では何も出力しないことをテスト"""
+        self.assertEqual(CSVFormatter().format([]), "")
+
+    def test_csv_key_mismatch(self):
+        """キーが揃っていない場合にValueErrorとなることをテスト"""
+        rows = sample_rows() + [{"Site": "SiteC"}]
+        with self.assertRaises(ValueError):
+            CSVFormatter().format(rows)
+
+    def test_csv_schema_matches_unchecked_output(self):
+        """schema指定時も同じCSVを出力し、schemaの列順に従うことをテスト"""
+        schema = ["EndTime", "Site", "app1_Total"]
+        self.assertEqual(
+            CSVFormatter(schema).format(sample_rows()),
+            CSVFormatter().format(sample_rows()),
+        )
+        output = CSVFormatter(["Site", "EndTime"]).format(sample_rows())
+        self.assertTrue(output.startswith("Site,EndTime\r\nSiteA,2024/01/01"))
+
+    def test_csv_schema_missing_column(self):
+        """schemaの列が無い行でValueErrorとなることをテスト"""
+        rows = sample_rows() + [{"Site": "SiteC"}]
+        with self.assertRaises(ValueError):
+            CSVFormatter(["EndTime", "Site"]).format(rows)
+
+    def test_invalid_schema(self):
+        """不正なschemaは生成時にValueErrorとなることをテスト"""
+        for schema in ([], ["Site", "Site"], ["Site", 1]):
+            with self.subTest(schema=schema):
+                with self.assertRaises(ValueError):
+                    CSVFormatter(schema)
+
+    def test_json_write_matches_dumps(self):
+        """逐次書き込みがjson.dumpsと同じJSONを出力することをテスト"""
+        for rows in (sample_rows(), []):
+            with self.subTest(rows=len(rows)):
+                output = io.StringIO()
+                JSONFormatter().write(iter(rows), output)
+                self.assertEqual(
+                    output.getvalue(), json.dumps(rows, ensure_ascii=False, indent=2)
+                )
+
+    def test_ndjson_one_row_per_line(self):
+        """NDJSONが1行に1要素を出力することをテスト"""
+        output = NDJSONFormatter().format(sample_rows() + [{"Site": "サイトC"}])
+        lines = output.splitlines()
+        self.assertTrue(output.endswith("\n"))
+        self.assertEqual([json.loads(line) for line in lines[:2]], sample_rows())
+        self.assertEqual(lines[2], '{"Site":"サイトC"}')
+
+    def test_ndjson_encoder_without_orjson(self):
+        """orjsonが無い場合も同じ出力になることをテスト"""
+        expected = NDJSONFormatter().format(sample_rows())
+        original, exporters.orjson = exporters.orjson, None
+        try:
+            self.assertEqual(NDJSONFormatter().format(sample_rows()), expected)
+        finally:
+            exporters.orjson = original
+
+
+class TestStatisticsExporter(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.output_path = os.path.join(self.temp_dir.name, "OUTPUT", "summary.csv")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_export_generator(self):
+        """ジェネレータを受け取り、一時ファイルを残さず出力することをテスト"""
+        StatisticsExporter(CSVFormatter()).export(
+            (row for row in sample_rows()), self.output_path
+        )
+
+        with open(self.output_path, encoding="utf-8", newline="") as f:
+            self.assertEqual(f.read(), CSVFormatter().format(sample_rows()))
+        self.assertEqual(os.listdir(os.path.dirname(self.output_path)), ["summary.csv"])
+
+    def test_failed_export_keeps_previous_file(self):
+        """書き込み途中で失敗した場合、既存ファイルが残り一時ファイルが削除されることをテスト"""
+        exporter = StatisticsExporter(CSVFormatter())
+        exporter.export(sample_rows(), self.output_path)
+
+        def broken_rows():
+            yield from sample_rows()
+            raise RuntimeError("aggregation failed")
+
+        with self.assertRaises(RuntimeError):
+            exporter.export(broken_rows(), self.output_path)
+
+        with open(self.output_path, encoding="utf-8", newline="") as f:
+            self.assertEqual(f.read(), CSVFormatter().format(sample_rows()))
+        self.assertEqual(os.listdir(os.path.dirname(self.output_path)), ["summary.csv"])
+
+    def test_append_across_runs(self):
+        """appendで既存ファイルの末尾に追記されることをテスト"""
+        exporter = StatisticsExporter(NDJSONFormatter())
+        exporter.append(sample_rows(), self.output_path)
+        exporter.append(iter(sample_rows()[:1]), self.output_path)
+
+        with open(self.output_path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(rows, sample_rows() + sample_rows()[:1])
+
+
+def summary_rows(total):
+    return [
+        {
+            "EndTime": f"2024/01/01 10:0{minute}:00",
+            "Site": site,
+            "App": "app1",
+            "TotalCount": total,
+            "SuccessCount": 1,
+        }
+        for minute in range(2)
+        for site in ("SiteA", "SiteB")
+    ]
+
+
+class TestSQLiteStatisticsExporter(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, "OUTPUT", "summary.db")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def fetch(self, sql, params=()):
+        connection = sqlite3.connect(self.db_path)
+        try:
+            return connection.execute(sql, params).fetchall()
+        finally:
+            connection.close()
+
+    def test_upsert(self):
+        """アプリごとの行に展開し、同じキーは上書きされることをテスト"""
+        exporter = SQLiteStatisticsExporter()
+        exporter.export(summary_rows(2), self.db_path)
+        exporter.export(summary_rows(4), self.db_path)
+
+        rows = self.fetch(
+            "SELECT end_time, site, app, total, success, success_rate "
+            "FROM success_rate_summary ORDER BY site, end_time"
+        )
+        # 行のないアプリは作らず、分ごとの件数を別の行に保存する
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0], ("2024/01/01 10:00:00", "SiteA", "app1", 4, 1, 25.0))
+        self.assertEqual(rows[1], ("2024/01/01 10:01:00", "SiteA", "app1", 4, 1, 25.0))
+
+    def test_site_range_query_uses_index(self):
+        """サイトと期間を指定した検索がインデックスを使うことをテスト"""
+        SQLiteStatisticsExporter().export(summary_rows(2), self.db_path)
+
+        plan = self.fetch(
+            "EXPLAIN QUERY PLAN SELECT * FROM success_rate_summary "
+            "WHERE site = ? AND end_time BETWEEN ? AND ?",
+            ("SiteA", "2024/01/01 00:00:00", "2024/01/08 00:00:00"),
+        )
+        self.assertIn("USING INDEX", " ".join(str(step) for step in plan))
+
+    def test_invalid_rows_rolled_back(self):
+        """不正な行を含む場合は何も書き込まれないことをテスト"""
+        rows = summary_rows(2)
+        del rows[1]["App"]
+
+        with self.assertRaises(ValueError):
+            SQLiteStatisticsExporter().export(rows, self.db_path)
+        self.assertEqual(self.fetch("SELECT COUNT(*) FROM success_rate_summary"), [(0,)])
+
+
+class TestFanOutExporter(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    def read(self, name):
+        with open(self.path(name), encoding="utf-8", newline="") as f:
+            return f.read()
+
+    def test_rows_read_once_and_written_to_all_sinks(self):
+        """統計結果を1回だけ走査し、全出力先に同じ行が書き込まれることをテスト"""
+        pulled = []
+
+        def rows():
+            for row in sample_rows() * 3:
+                pulled.append(row)
+                yield row
+
+        csv_exporter = StatisticsExporter(CSVFormatter())
+        ndjson_exporter = StatisticsExporter(NDJSONFormatter())
+        FanOutExporter(
+            [
+                lambda stats: csv_exporter.export(stats, self.path("a.csv")),
+                lambda stats: ndjson_exporter.export(stats, self.path("a.ndjson")),
+            ],
+            batch_size=2,
+            queue_batches=1,
+        ).export(rows())
+
+        self.assertEqual(len(pulled), 6)
+        self.assertEqual(self.read("a.csv"), CSVFormatter().format(sample_rows() * 3))
+        self.assertEqual(
+            self.read("a.ndjson"), NDJSONFormatter().format(sample_rows() * 3)
+        )
+
+    def test_sink_error_does_not_block_others(self):
+        """出力先の1つが失敗しても他の出力先は書き終え、例外が再送出されることをテスト"""
+
+        def broken_sink(stats):
+            next(iter(stats))
+            raise OSError("disk full")
+
+        exporter = StatisticsExporter(CSVFormatter())
+        with self.assertRaises(OSError):
+            FanOutExporter(
+                [broken_sink, lambda stats: exporter.export(stats, self.path("a.csv"))],
+                batch_size=1,
+                queue_batches=1,
+            ).export(sample_rows() * 5)
+
+        self.assertEqual(self.read("a.csv"), CSVFormatter().format(sample_rows() * 5))
+
+    def test_source_error_aborts_sinks(self):
+        """統計結果の走査が失敗した場合、どの出力先にもファイルが作られないことをテスト"""
+
+        def broken_rows():
+            yield from sample_rows()
+            raise RuntimeError("aggregation failed")
+
+        exporter = StatisticsExporter(CSVFormatter())
+        with self.assertRaises(RuntimeError):
+            FanOutExporter(
+                [lambda stats: exporter.export(stats, self.path("a.csv"))],
+                batch_size=1,
+            ).export(broken_rows())
+
+        self.assertEqual(os.listdir(self.temp_dir.name), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
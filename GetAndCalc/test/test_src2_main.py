@@ -0,0 +1,227 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src2"))
+
+import main
+from main import Main
+from models import READER_MODE_COLUMNAR, aggregate_file
+
+HEADER = "End Time Local,Site,APP,RC\n"
+
+
+def build_lines(count, site="SiteA"):
+    return [
+        f"2024/01/01 00:{i % 60:02d}:10,{site}{i % 7},app{i % 2 + 1},"
+        f"{'PROC_OK' if i % 3 else 'ERROR'}\n"
+        for i in range(count)
+    ]
+
+
+class RecordingMain(Main):
+    """ファイルの投入と結果の取り込みの順序を記録する"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.events = []
+
+    def _submit_file(self, executor, file_path):
+        self.events.append("submit")
+        return super()._submit_file(executor, file_path)
+
+    def _merge_file_result(self, aggregator, file_path, futures):
+        self.events.append("merge")
+        return super()._merge_file_result(aggregator, file_path, futures)
+
+
+class MainTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(main, "BASE_DIR", self.tmp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_file(self, name, data):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            f.write(data)
+        return path
+
+    def sequential_summary(self, files):
+        return Main()._aggregate_records(files)
+
+
+class TestMainParallel(MainTestCase):
+    def test_spilling_merges_as_files_complete(self):
+        """並列集計で1ファイル分ずつ上限付きのアグリゲータに取り込むことをテスト"""
+        files = [
+            self.write_file(f"input{n}.csv", HEADER + "".join(build_lines(50, f"S{n}")))
+            for n in range(6)
+        ]
+        manager = RecordingMain(workers=2, max_groups=5)
+        with mock.patch.object(main, "FILES_IN_FLIGHT_PER_WORKER", 1):
+            summary = manager._aggregate_records(files)
+
+        self.assertEqual(summary, self.sequential_summary(files))
+        # ワーカー数より多くのファイルを投入する前に結果を取り込み始める
+        self.assertEqual(manager.events[:3], ["submit", "submit", "merge"])
+        self.assertEqual(manager.events.count("merge"), len(files))
+
+    def test_chunked_files_match_sequential(self):
+        """chunk_sizeを超えるファイルを範囲ごとに集計しても結果が変わらないことをテスト"""
+        files = [
+            self.write_file(f"input{n}.csv", HEADER + "".join(build_lines(80, f"S{n}")))
+            for n in range(3)
+        ]
+        summary = Main(workers=2, chunk_size=256)._aggregate_records(files)
+        self.assertEqual(summary, self.sequential_summary(files))
+
+    def test_quoted_newline_across_chunks_reread(self):
+        """クォート内の改行が範囲をまたぐファイルを全体で集計し直すことをテスト"""
+        lines = [
+            f'2024/01/01 00:{i % 60:02d}:10,"Site\n{i % 3}",app1,PROC_OK\n'
+            for i in range(60)
+        ]
+        path = self.write_file("quoted.csv", HEADER + "".join(lines))
+
+        with self.assertLogs("main", level="INFO") as logs:
+            summary = Main(workers=2, chunk_size=64)._aggregate_records([path])
+
+        self.assertTrue(any("Quoted newline across chunks" in m for m in logs.output))
+        self.assertEqual(summary, self.sequential_summary([path]))
+
+    def test_stray_quote_matches_sequential(self):
+        """フィールドの途中のクォートを含むファイルを範囲ごとに集計できることをテスト"""
+        lines = build_lines(60)
+        lines[10] = '2024/01/01 00:10:10,Si"teA,app1,PROC_OK\n'
+        path = self.write_file("stray.csv", HEADER + "".join(lines))
+
+        with self.assertLogs("main", level="INFO") as logs:
+            summary = Main(workers=2, chunk_size=256)._aggregate_records([path])
+
+        # 範囲の終端をまたぐクォートとみなして全体を読み直すことはしない
+        self.assertFalse(any("Quoted newline" in m for m in logs.output))
+        self.assertEqual(summary, self.sequential_summary([path]))
+        self.assertIn('Si"teA', [row["Site"] for row in summary])
+
+    def test_failed_files_logged_and_skipped(self):
+        """不正なファイル・ヘッダのみのファイル・開けないファイルを記録して除外することをテスト"""
+        good = self.write_file("good.csv", HEADER + "".join(build_lines(80)))
+        bad = self.write_file(
+            "bad.csv",
+            HEADER + "".join(build_lines(80)) + "2024/01/01 00:59:10,,app1,ERROR\n",
+        )
+        header_only = self.write_file("header_only.csv", HEADER)
+        missing = os.path.join(self.tmp_dir.name, "missing.csv")
+        files = [good, bad, header_only, missing]
+
+        # ヘッダだけでchunk_sizeを超える場合は範囲分割の経路を通る
+        for chunk_size in (256, 16):
+            with self.subTest(chunk_size=chunk_size):
+                manager = Main(workers=2, chunk_size=chunk_size)
+                with self.assertLogs("main", level="WARNING") as logs:
+                    summary = manager._aggregate_records(files)
+
+                self.assertEqual(summary, self.sequential_summary([good]))
+                self.assertEqual(len(logs.output), 3)
+                for path, message in (
+                    (bad, "Invalid format file"),
+                    (header_only, "Invalid format file"),
+                    (missing, "Failed to open file"),
+                ):
+                    self.assertTrue(
+                        any(path in m and message in m for m in logs.output), path
+                    )
+
+
+class TestMainIncremental(MainTestCase):
+    def test_backfilled_rows_kept(self):
+        """実行時刻より古いデータを遡って集計しても保存直後に削除しないことをテスト"""
+        input_dir = os.path.join(self.tmp_dir.name, "input")
+        os.makedirs(input_dir)
+        path = os.path.join(input_dir, "input.csv")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            f.write(HEADER + "".join(build_lines(50)))
+            # 保持期間より古い行は最新の終了時刻を基準に削除する
+            f.write("2023/12/30 00:00:10,SiteOld,app1,PROC_OK\n")
+
+        summary = Main(incremental=True)._aggregate_records([path])
+
+        expected = self.write_file("expected.csv", HEADER + "".join(build_lines(50)))
+        self.assertEqual(summary, aggregate_file(expected).format_summary(True))
+
+    def test_rows_per_minute(self):
+        """累積集計の結果をサイトごとにまとめず分ごとに出力することをテスト"""
+        input_dir = os.path.join(self.tmp_dir.name, "input")
+        os.makedirs(input_dir)
+        path = os.path.join(input_dir, "input.csv")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            f.write(HEADER)
+            f.write("2024/01/01 00:00:10,SiteA,app1,PROC_OK\n")
+            f.write("2024/01/01 00:01:10,SiteA,app1,ERROR\n")
+
+        summary = Main(incremental=True)._aggregate_records([path])
+
+        self.assertEqual(
+            [(row["EndTime"], row["app1_Total"], row["app1_SR"]) for row in summary],
+            [("2024/01/01 00:00:00", 1, "100.00"), ("2024/01/01 00:01:00", 1, "0.00")],
+        )
+
+    def test_columnar_mode_rejected(self):
+        """ファイル全体のサイドカーを使う読み出しモードとの併用を拒否することをテスト"""
+        with self.assertRaises(ValueError):
+            Main(incremental=True, reader_mode=READER_MODE_COLUMNAR)
+
+
+class TestMainExport(MainTestCase):
+    def test_sqlite_stores_entries_per_minute(self):
+        """SQLiteへは集計キーごとの行を、現れなかったアプリの行なしで保存することをテスト"""
+        path = self.write_file(
+            "input.csv",
+            HEADER
+            + "2024/01/01 00:00:10,SiteA,app1,PROC_OK\n"
+            + "2024/01/01 00:01:10,SiteA,app1,ERROR\n"
+            + "2024/01/01 00:01:10,SiteA,app1,ERROR\n",
+        )
+        Main(export_sqlite=True)._aggregate_records([path])
+
+        db_path = os.path.join(self.tmp_dir.name, "OUTPUT", "success_rate_summary.db")
+        connection = sqlite3.connect(db_path)
+        try:
+            rows = connection.execute(
+                "SELECT end_time, site, app, total, success, success_rate "
+                "FROM success_rate_summary ORDER BY end_time"
+            ).fetchall()
+        finally:
+            connection.close()
+        self.assertEqual(
+            rows,
+            [
+                ("2024/01/01 00:00:00", "SiteA", "app1", 1, 1, 100.0),
+                ("2024/01/01 00:01:00", "SiteA", "app1", 2, 0, 0.0),
+            ],
+        )
+
+    def test_delta_backfill_not_exported_again(self):
+        """実行時刻より古い行を差分出力しても、次回に追加として出力し直さないことをテスト"""
+        path = self.write_file("input.csv", HEADER + "".join(build_lines(50)))
+        manager = Main(delta_export=True)
+        summary = manager._aggregate_records([path])
+
+        for inserted in (len(summary), 0):
+            expected = f"Delta exported: {inserted} inserted"
+            with self.assertLogs("main", level="INFO") as logs:
+                manager._export_summary(summary)
+            self.assertTrue(any(expected in m for m in logs.output), logs.output)
+
+
+if __name__ == "__main__":
+    unittest.main()
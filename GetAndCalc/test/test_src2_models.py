@@ -0,0 +1,713 @@
+import io
+import mmap
+import os
+import pickle
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src2"))
+
+from exceptions import ChunkBoundaryError
+from models import (
+    AGGREGATE_ENGINE_NUMPY,
+    READER_MODE_COLUMNAR,
+    READER_MODE_MMAP,
+    EncodedRecords,
+    GroupByAggregator,
+    RecordAggregator,
+    RecordFilter,
+    RecordReader,
+    aggregate_file,
+    aggregate_range,
+    create_aggregator,
+    format_epoch_minute,
+    merge_aggregators,
+    np,
+)
+
+CSV_DATA = (
+    "End Time Local,Site,APP,RC\n"
+    "2024/01/01 00:00:10,SiteA,app1,PROC_SUCCESS\n"
+    "2024/01/01 00:00:20,SiteA,app1,ERROR\n"
+    "2024/01/01 00:00:29,SiteA,app2,PROC_COMPLETED\n"
+    "2024/01/01 00:01:40,SiteB,app1,PROC_OK\n"
+    "2024/01/01 00:02:10,SiteB,app2,ERROR\n"
+)
+
+
+def read_records(csv_data: str = CSV_DATA):
+    return RecordReader.from_textio(io.StringIO(csv_data))
+
+
+class UnseekableStringIO(io.StringIO):
+    def seekable(self):
+        return False
+
+    def seek(self, *args):
+        raise io.UnsupportedOperation("seek")
+
+
+class TestRecordReader(unittest.TestCase):
+    def test_from_unseekable_stream(self):
+        """シークできないストリームからの読み出しをテスト"""
+        records = list(RecordReader.from_textio(UnseekableStringIO(CSV_DATA)))
+
+        self.assertEqual(len(records), 5)
+        self.assertEqual(format_epoch_minute(records[0].endtime), "2024/01/01 00:00:00")
+        self.assertEqual(records[0].site, "SiteA")
+        self.assertTrue(records[0].is_success)
+        self.assertFalse(records[1].is_success)
+
+    def test_invalid_line_rejects_whole_file(self):
+        """不正な行を含むファイルはレコードを1件も返さないことをテスト"""
+        csv_data = CSV_DATA + "2024/01/01 00:03:00,SiteC,,ERROR\n"
+        records = RecordReader.from_textio(io.StringIO(csv_data))
+
+        with self.assertRaisesRegex(ValueError, "Line6: APP"):
+            next(records)
+
+    def test_normalize_time(self):
+        """30秒以上の切り上げと時・日・月・年の繰り上がりをテスト"""
+        cases = {
+            "2024/01/01 00:00:29": "2024/01/01 00:00:00",
+            "2024/01/01 00:00:30": "2024/01/01 00:01:00",
+            "2024/01/01 10:59:30": "2024/01/01 11:00:00",
+            "2024/01/31 23:59:45": "2024/02/01 00:00:00",
+            "2024/02/28 23:59:30": "2024/02/29 00:00:00",
+            "2023/02/28 23:59:30": "2023/03/01 00:00:00",
+            "2023/12/31 23:59:59": "2024/01/01 00:00:00",
+            "2024/1/1 0:0:31": "2024/01/01 00:01:00",
+        }
+        for time_str, expected in cases.items():
+            with self.subTest(time_str=time_str):
+                self.assertEqual(RecordReader.normalize_time(time_str), expected)
+
+    def test_normalize_time_matches_strptime(self):
+        """strptimeによる丸めと同じ結果になることをテスト"""
+        dt = datetime(2023, 12, 31, 22, 58, 0)
+        while dt < datetime(2024, 1, 1, 1, 2, 0):
+            time_str = dt.strftime("%Y/%m/%d %H:%M:%S")
+            expected = dt + timedelta(minutes=1) if dt.second >= 30 else dt
+            self.assertEqual(
+                RecordReader.normalize_time(time_str),
+                expected.replace(second=0).strftime("%Y/%m/%d %H:%M:%S"),
+            )
+            dt += timedelta(seconds=7)
+
+    def test_normalize_time_invalid(self):
+        """不正な時刻文字列をテスト"""
+        for time_str in [
+            "2024/13/01 00:00:00",
+            "2024-01-01 00:00:00",
+            "2024/01/01",
+            "2024/01/01 00:00:60",
+            "2024/01/01 00:00:61",
+        ]:
+            with self.subTest(time_str=time_str):
+                with self.assertRaisesRegex(ValueError, repr(time_str)):
+                    RecordReader.normalize_time(time_str)
+
+    def test_missing_header(self):
+        """必須ヘッダが欠損したファイルをテスト"""
+        csv_data = "End Time Local,Site,RC\n2024/01/01 00:00:00,SiteA,ERROR\n"
+
+        with self.assertRaisesRegex(ValueError, "Missing required headers: APP"):
+            list(RecordReader.from_textio(io.StringIO(csv_data)))
+
+    def test_no_data_rows(self):
+        """データ行のないファイルをテスト"""
+        with self.assertRaisesRegex(ValueError, "No data rows"):
+            list(RecordReader.from_textio(io.StringIO("End Time Local,Site,APP,RC\n")))
+
+
+class TestRecordReaderMmap(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_file(self, data: str) -> str:
+        path = os.path.join(self.tmp_dir.name, "input.csv")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            f.write(data)
+        return path
+
+    def test_same_rows_as_text_mode(self):
+        """mmapモードがテキストモードと同じ行を返すことをテスト"""
+        csv_data = (
+            "Id,RC,APP,Extra,End Time Local,Site\r\n"
+            "1,PROC_OK,app1,x,2024/01/01 00:00:10,SiteA\r\n"
+            "\r\n"
+            '2,ERROR,app2,"a,""b""\nc",2024/01/01 00:00:40,"Site,B"\r\n'
+            "3,PROC_COMPLETED,app2,,2024/01/01 00:01:00,サイトC\r\n"
+        )
+        path = self.write_file(csv_data)
+
+        expected = RecordReader.read_rows(io.StringIO(csv_data, newline=""))
+        rows = RecordReader.read_rows_mmap(path)
+
+        self.assertEqual(rows, expected)
+        self.assertEqual(rows[1][1], "Site,B")
+        self.assertEqual(rows[2][1], "サイトC")
+
+    def test_stray_quote_same_as_text_mode(self):
+        """フィールドの途中のクォートをテキストモードと同じく値として読むことをテスト"""
+        csv_data = (
+            "End Time Local,Site,APP,RC\n"
+            '2024/01/01 00:00:10,Si"teA,app1,PROC_OK\n'
+            "2024/01/01 00:00:20,SiteB,app1,ERROR\n"
+            '2024/01/01 00:00:30,"Site""C",app2,PROC_OK\n'
+        )
+        path = self.write_file(csv_data)
+
+        expected = RecordReader.read_rows(io.StringIO(csv_data, newline=""))
+        rows = RecordReader.read_rows_mmap(path)
+
+        self.assertEqual(rows, expected)
+        self.assertEqual([row[1] for row in rows], ['Si"teA', "SiteB", 'Site"C'])
+
+    def test_from_file(self):
+        """mmapモードでのレコード読み出しをテスト"""
+        path = self.write_file(CSV_DATA)
+
+        records = list(RecordReader.from_file(path, READER_MODE_MMAP))
+
+        self.assertEqual(len(records), 5)
+        self.assertTrue(records[0].is_success)
+
+    def test_invalid_line(self):
+        """不足した列を含む行をテスト"""
+        path = self.write_file(CSV_DATA + "2024/01/01 00:03:00,SiteC\n")
+
+        with self.assertRaisesRegex(ValueError, "Line6: APP, RC"):
+            RecordReader.read_rows_mmap(path)
+
+    def test_empty_file(self):
+        """空のファイルをテスト"""
+        path = self.write_file("")
+
+        with self.assertRaisesRegex(ValueError, "Missing required headers"):
+            RecordReader.read_rows_mmap(path)
+
+
+class TestRecordFilter(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "input.csv")
+        with open(self.path, "w", encoding="utf-8", newline="") as f:
+            f.write(CSV_DATA + '2024/01/01 00:01:50,"Site,Q",app1,PROC_OK\n')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_same_rows_in_every_mode(self):
+        """どの読み出しモードでも、全行を読んでから絞り込んだ結果と一致することをテスト"""
+        filters = [
+            RecordFilter(sites={"SiteA"}),
+            RecordFilter(apps={"app2"}),
+            RecordFilter(sites={"SiteB", "Site,Q"}, start="2024/01/01 00:02:00"),
+            RecordFilter(start="2024/01/01 00:00:30", end="2024/01/01 00:02:00"),
+            RecordFilter(sites={"SiteX"}),
+        ]
+        full = RecordReader.read_file_rows(self.path)
+        for record_filter in filters:
+            expected = record_filter.filter_rows(full)
+            for mode in ("text", READER_MODE_MMAP, READER_MODE_COLUMNAR):
+                with self.subTest(mode=mode, sites=record_filter.sites):
+                    rows = RecordReader.read_file_rows(self.path, mode, record_filter)
+                    self.assertEqual(rows, expected)
+
+    def test_time_range_uses_rounded_minute(self):
+        """時刻の範囲は分に丸めた時刻で判定することをテスト"""
+        record_filter = RecordFilter(
+            start="2024/01/01 00:02:00", end="2024/01/01 00:03:00"
+        )
+
+        rows = RecordReader.read_file_rows(self.path, READER_MODE_MMAP, record_filter)
+
+        # 00:01:40と00:01:50は00:02に切り上がるため範囲に含まれる
+        self.assertEqual([row[1] for row in rows], ["SiteB", "SiteB", "Site,Q"])
+
+    def test_invalid_rows_still_rejected(self):
+        """除外される行でも必須フィールドの欠損は検出することをテスト"""
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("2024/01/01 00:03:00,SiteC,app1,\n")
+
+        for mode in ("text", READER_MODE_MMAP):
+            with self.subTest(mode=mode):
+                with self.assertRaisesRegex(ValueError, "Missing fields"):
+                    RecordReader.read_file_rows(
+                        self.path, mode, RecordFilter(sites={"SiteA"})
+                    )
+
+    def test_invalid_time_in_filtered_out_row_not_detected(self):
+        """除外される行の時刻の形式不正は検出しないことをテスト"""
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("2024/01/01 00:03:60,SiteC,app1,PROC_OK\n")
+
+        for mode in ("text", READER_MODE_MMAP):
+            with self.subTest(mode=mode):
+                with self.assertRaises(ValueError):
+                    RecordReader.read_file_rows(self.path, mode)
+                rows = RecordReader.read_file_rows(
+                    self.path, mode, RecordFilter(sites={"SiteA"})
+                )
+                self.assertEqual({row[1] for row in rows}, {"SiteA"})
+
+    def test_aggregate_file(self):
+        """絞り込んだ行だけが集計されることをテスト"""
+        aggregator = aggregate_file(
+            self.path,
+            reader_mode=READER_MODE_MMAP,
+            record_filter=RecordFilter(apps={"app1"}),
+        )
+
+        self.assertEqual({key[2] for key in aggregator.site_app_stats}, {"app1"})
+
+
+class TestRecordReaderColumnar(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "input.csv")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_file(self, data: str) -> None:
+        with open(self.path, "w", encoding="utf-8", newline="") as f:
+            f.write(data)
+
+    def test_sidecar_written_and_reused(self):
+        """初回にサイドカーを書き出し、次回は解析せずサイドカーから読むことをテスト"""
+        self.write_file(CSV_DATA + "2024/01/01 00:03:00,サイトC,app1,PROC_OK\n")
+        expected = RecordReader.read_file_rows(self.path, READER_MODE_MMAP)
+
+        self.assertEqual(RecordReader.read_rows_columnar(self.path), expected)
+        self.assertTrue(os.path.exists(self.path + ".cols"))
+
+        with mock.patch.object(
+            RecordReader, "read_rows_mmap", side_effect=AssertionError("reparsed")
+        ):
+            self.assertEqual(
+                RecordReader.read_file_rows(self.path, READER_MODE_COLUMNAR), expected
+            )
+
+    def test_sidecar_rebuilt_when_content_changes(self):
+        """ファイルの内容が変わった場合はサイドカーを作り直すことをテスト"""
+        self.write_file(CSV_DATA)
+        RecordReader.read_rows_columnar(self.path)
+
+        self.write_file(CSV_DATA + "2024/01/01 00:03:00,SiteC,app1,PROC_OK\n")
+        rows = RecordReader.read_rows_columnar(self.path)
+
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[-1][1], "SiteC")
+
+    def test_corrupt_sidecar_ignored(self):
+        """壊れたサイドカーは無視して解析し直すことをテスト"""
+        self.write_file(CSV_DATA)
+        with open(self.path + ".cols", "wb") as f:
+            f.write(b"broken")
+
+        self.assertEqual(len(RecordReader.read_rows_columnar(self.path)), 5)
+
+    def test_sidecar_mapping_closed(self):
+        """サイドカーのメモリマップを、読めた場合も壊れていた場合も閉じることをテスト"""
+        self.write_file(CSV_DATA)
+        expected = RecordReader.read_rows_columnar(self.path)
+        with open(self.path + ".cols", "rb") as f:
+            valid = f.read()
+
+        open_mmap = mmap.mmap
+        mapped = []
+
+        def tracking_mmap(*args, **kwargs):
+            mapped.append(open_mmap(*args, **kwargs))
+            return mapped[-1]
+
+        for data in (valid, valid[:-4]):
+            with open(self.path + ".cols", "wb") as f:
+                f.write(data)
+            with mock.patch("mmap.mmap", side_effect=tracking_mmap):
+                self.assertEqual(RecordReader.read_rows_columnar(self.path), expected)
+
+        self.assertTrue(mapped)
+        self.assertTrue(all(m.closed for m in mapped))
+
+    def test_no_temporary_files_left(self):
+        """サイドカーの一時ファイルを残さないことをテスト"""
+        self.write_file(CSV_DATA)
+        RecordReader.read_rows_columnar(self.path)
+
+        self.assertEqual(
+            sorted(os.listdir(self.tmp_dir.name)), ["input.csv", "input.csv.cols"]
+        )
+
+    def test_invalid_file_has_no_sidecar(self):
+        """フォーマット不正のファイルではサイドカーを書き出さないことをテスト"""
+        self.write_file(CSV_DATA + "2024/01/01 00:03:00,SiteC\n")
+
+        with self.assertRaises(ValueError):
+            RecordReader.read_rows_columnar(self.path)
+        self.assertFalse(os.path.exists(self.path + ".cols"))
+
+
+class TestRecordReaderRange(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_file(self, data: str) -> str:
+        path = os.path.join(self.tmp_dir.name, "input.csv")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            f.write(data)
+        return path
+
+    def test_split_ranges(self):
+        """改行位置で区切ったバイト範囲が全データ行を過不足なく覆うことをテスト"""
+        path = self.write_file(CSV_DATA)
+
+        header, ranges = RecordReader.split_ranges(path, 30)
+        rows = []
+        for start, end in ranges:
+            rows.extend(RecordReader.read_rows_range(path, header, start, end))
+
+        self.assertGreater(len(ranges), 1)
+        self.assertEqual(header, ["End Time Local", "Site", "APP", "RC"])
+        self.assertEqual(rows, RecordReader.read_rows_mmap(path))
+
+    def test_stray_quote_in_ranges(self):
+        """フィールドの途中のクォートを含むファイルを範囲ごとに読めることをテスト"""
+        path = self.write_file(
+            CSV_DATA + '2024/01/01 00:03:00,Si"teC,app1,PROC_OK\n' + CSV_DATA[27:]
+        )
+
+        header, ranges = RecordReader.split_ranges(path, 60)
+        rows = []
+        for start, end in ranges:
+            rows.extend(RecordReader.read_rows_range(path, header, start, end))
+
+        self.assertGreater(len(ranges), 1)
+        self.assertEqual(rows, RecordReader.read_rows_mmap(path))
+        self.assertEqual(rows[5][1], 'Si"teC')
+
+    def test_aggregate_range(self):
+        """バイト範囲ごとの集計の合算が1ファイル分の集計と一致することをテスト"""
+        path = self.write_file(CSV_DATA)
+
+        header, ranges = RecordReader.split_ranges(path, 50)
+        partials = [aggregate_range(path, header, start, end) for start, end in ranges]
+
+        self.assertEqual(
+            merge_aggregators(partials).summarize(), aggregate_file(path).summarize()
+        )
+
+    def test_invalid_line_in_range(self):
+        """範囲内の不正な行をテスト"""
+        path = self.write_file(CSV_DATA + "2024/01/01 00:03:00,SiteC,,ERROR\n")
+
+        header, ranges = RecordReader.split_ranges(path, 1024)
+
+        message = r"^Missing fields: APP \(bytes \d+-\d+\)$"
+        with self.assertRaisesRegex(ValueError, message):
+            RecordReader.read_rows_range(path, header, *ranges[0])
+
+    def test_quoted_newline_across_ranges(self):
+        """クォート内の改行が範囲をまたぐ場合をテスト"""
+        path = self.write_file(
+            "End Time Local,Site,APP,RC\n"
+            '2024/01/01 00:00:00,"Site\nA",app1,PROC_OK\n'
+        )
+
+        header, ranges = RecordReader.split_ranges(path, 1)
+
+        with self.assertRaises(ChunkBoundaryError):
+            RecordReader.read_rows_range(path, header, *ranges[0])
+
+
+class TestRecordAggregator(unittest.TestCase):
+    def test_format_summary(self):
+        """python集計エンジンのサマリー出力をテスト"""
+        aggregator = RecordAggregator()
+        aggregator.process(read_records())
+
+        result = aggregator.format_summary()
+
+        self.assertEqual(len(result), 2)
+        site_a = next(r for r in result if r["Site"] == "SiteA")
+        self.assertEqual(site_a["EndTime"], "2024/01/01 00:00:00")
+        self.assertEqual(site_a["app1_Total"], 2)
+        self.assertEqual(site_a["app1_SR"], "50.00")
+        self.assertEqual(site_a["app2_Success"], 1)
+
+
+class TestRecordAggregatorQueries(unittest.TestCase):
+    def setUp(self):
+        self.aggregator = RecordAggregator()
+        self.aggregator.process(read_records())
+
+    def test_top_k(self):
+        """総件数の多い順に上位k件が返されることをテスト"""
+        top = self.aggregator.top_k(1)
+        self.assertEqual(
+            top,
+            [
+                {
+                    "EndTime": "2024/01/01 00:00:00",
+                    "Site": "SiteA",
+                    "App": "app1",
+                    "TotalCount": 2,
+                    "SuccessCount": 1,
+                    "SR": 50.0,
+                }
+            ],
+        )
+
+        by_site = self.aggregator.top_k(5, by=("site",))
+        self.assertEqual(
+            [(r["Site"], r["TotalCount"]) for r in by_site], [("SiteA", 3), ("SiteB", 2)]
+        )
+
+    def test_bottom_k_success_rate(self):
+        """成功率の低い順に下位k件が返されることをテスト"""
+        bottom = self.aggregator.bottom_k_success_rate(2)
+        self.assertEqual(
+            [(r["Site"], r["App"], r["SR"]) for r in bottom],
+            [("SiteB", "app2", 0.0), ("SiteA", "app1", 50.0)],
+        )
+
+        by_site = self.aggregator.bottom_k_success_rate(1, by=("site",))
+        self.assertEqual([(r["Site"], r["SR"]) for r in by_site], [("SiteB", 50.0)])
+
+        frequent = self.aggregator.bottom_k_success_rate(5, min_total=2)
+        self.assertEqual([(r["Site"], r["App"]) for r in frequent], [("SiteA", "app1")])
+
+    def test_invalid_group_columns(self):
+        """不正な列でグループ化するとValueErrorとなることをテスト"""
+        for by in ((), ("rc",), ("site", "site")):
+            with self.subTest(by=by):
+                with self.assertRaises(ValueError):
+                    self.aggregator.top_k(1, by=by)
+
+    def test_iter_summary_lazy(self):
+        """ヒープから取り出す順がiter_summaryと同じであることをテスト"""
+        self.assertEqual(
+            list(self.aggregator.iter_summary_lazy()),
+            list(self.aggregator.iter_summary()),
+        )
+
+
+class TestGroupByAggregator(unittest.TestCase):
+    def test_rollups_match_direct_aggregation(self):
+        """最も細かい粒度から導いたロールアップが、直接集計した結果と一致することをテスト"""
+        finest = GroupByAggregator(["endtime", "site", "app"])
+        finest.process(read_records())
+
+        by_site, by_app, per_five = finest.rollups(
+            [(["site"], 1), (["app"], 1), (["endtime", "site"], 5)]
+        )
+
+        for rollup, dimensions in ((by_site, ["site"]), (by_app, ["app"])):
+            direct = GroupByAggregator(dimensions)
+            direct.process(read_records())
+            self.assertEqual(rollup.summarize(), direct.summarize())
+        self.assertEqual(
+            [(r["EndTime"], r["Site"], r["TotalCount"]) for r in per_five.summarize()],
+            [("2024/01/01 00:00:00", "SiteA", 3), ("2024/01/01 00:00:00", "SiteB", 2)],
+        )
+
+    def test_record_aggregator_rollup(self):
+        """RecordAggregatorの集計結果から1時間単位のロールアップを導けることをテスト"""
+        aggregator = RecordAggregator()
+        aggregator.process(read_records())
+
+        hourly = aggregator.rollup(["endtime", "app"], bucket_minutes=60)
+
+        self.assertEqual(
+            [(r["App"], r["TotalCount"], r["SuccessCount"]) for r in hourly.summarize()],
+            [("app1", 3, 2), ("app2", 2, 1)],
+        )
+
+    def test_other_dimensions(self):
+        """旧形式の(app, cc)のような任意の属性を軸にできることをテスト"""
+
+        class Request:
+            def __init__(self, app, cc, is_success):
+                self.app, self.cc, self.is_success = app, cc, is_success
+
+        aggregator = GroupByAggregator(["app", "cc"])
+        aggregator.process(
+            [
+                Request("app1", "JP", True),
+                Request("app1", "JP", False),
+                Request("app1", "US", True),
+            ]
+        )
+
+        self.assertEqual(
+            aggregator.summarize()[0],
+            {"App": "app1", "CC": "JP", "TotalCount": 2, "SuccessCount": 1, "SR": 50.0},
+        )
+        self.assertEqual(aggregator.rollup(["app"]).summarize()[0]["TotalCount"], 3)
+
+    def test_invalid_rollup(self):
+        """元の軸にない軸や不正な分数でのロールアップがValueErrorとなることをテスト"""
+        aggregator = GroupByAggregator(["site", "app"])
+        for dimensions, bucket_minutes in ((["endtime"], 1), (["site"], 0), ([], 1)):
+            with self.subTest(dimensions=dimensions, bucket_minutes=bucket_minutes):
+                with self.assertRaises(ValueError):
+                    aggregator.rollup(dimensions, bucket_minutes)
+
+    def test_merge_different_dimensions(self):
+        """軸が異なるアグリゲータの合算がValueErrorとなることをテスト"""
+        with self.assertRaises(ValueError):
+            GroupByAggregator(["site"]).merge(GroupByAggregator(["app"]))
+
+
+class TestEncodedRecords(unittest.TestCase):
+    def test_from_rows(self):
+        """(endtime, site, app)の組ごとの符号化をテスト"""
+        rows = RecordReader.read_rows(io.StringIO(CSV_DATA))
+
+        encoded = EncodedRecords.from_rows(rows)
+
+        self.assertEqual(len(encoded), 5)
+        self.assertEqual(len(encoded.groups), 4)
+        self.assertEqual(list(encoded.group_codes), [0, 0, 1, 2, 3])
+        self.assertEqual(list(encoded.successes), [1, 0, 1, 1, 0])
+
+    def test_process_encoded(self):
+        """符号化したレコードの集計がprocessと一致することをテスト"""
+        expected = RecordAggregator()
+        expected.process(read_records())
+
+        aggregator = RecordAggregator()
+        aggregator.process_encoded(
+            EncodedRecords.from_rows(RecordReader.read_rows(io.StringIO(CSV_DATA)))
+        )
+
+        self.assertEqual(aggregator.summarize(), expected.summarize())
+
+
+class TestRecordAggregatorMerge(unittest.TestCase):
+    def test_merge(self):
+        """集計途中の結果の合算をテスト"""
+        expected = RecordAggregator()
+        expected.process(read_records())
+        expected.process(read_records())
+
+        left = RecordAggregator()
+        left.process(read_records())
+        right = RecordAggregator()
+        right.process(read_records())
+
+        self.assertEqual(left.merge(right).summarize(), expected.summarize())
+
+    def test_add(self):
+        """+演算子が元のアグリゲータを変更しないことをテスト"""
+        left = RecordAggregator()
+        left.process(read_records())
+        right = RecordAggregator()
+        right.process(read_records())
+
+        merged = left + right
+
+        self.assertEqual(merged.summarize()[0]["TotalCount"], 4)
+        self.assertEqual(left.summarize()[0]["TotalCount"], 2)
+
+    def test_merge_aggregators(self):
+        """複数アグリゲータのトーナメント形式の合算をテスト"""
+        partials = []
+        for _ in range(5):
+            aggregator = RecordAggregator()
+            aggregator.process(read_records())
+            partials.append(aggregator)
+
+        merged = merge_aggregators(partials)
+
+        self.assertEqual(merged.summarize()[0]["TotalCount"], 10)
+        self.assertEqual(merged.summarize()[0]["SuccessCount"], 5)
+        with self.assertRaises(ValueError):
+            merge_aggregators([])
+
+    def test_pickle(self):
+        """プロセス間で受け渡せることをテスト"""
+        aggregator = RecordAggregator()
+        aggregator.process(read_records())
+
+        restored = pickle.loads(pickle.dumps(aggregator))
+
+        self.assertEqual(restored.summarize(), aggregator.summarize())
+
+    def test_aggregate_file(self):
+        """ファイル単位の集計をテスト"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "input.csv")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(CSV_DATA)
+
+            aggregator = aggregate_file(path)
+
+        self.assertEqual(len(aggregator.summarize()), 4)
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestNumpyRecordAggregator(unittest.TestCase):
+    def test_same_summary_as_python_engine(self):
+        """numpy集計エンジンがpython集計エンジンと同じ結果を返すことをテスト"""
+        expected = RecordAggregator()
+        expected.process(read_records())
+
+        aggregator = create_aggregator(AGGREGATE_ENGINE_NUMPY)
+        aggregator.batch_size = 2
+        aggregator.process(read_records())
+
+        self.assertEqual(aggregator.summarize(), expected.summarize())
+        self.assertEqual(aggregator.format_summary(), expected.format_summary())
+
+    def test_process_encoded(self):
+        """numpy集計エンジンでの符号化したレコードの集計をテスト"""
+        expected = RecordAggregator()
+        expected.process(read_records())
+
+        aggregator = create_aggregator(AGGREGATE_ENGINE_NUMPY)
+        aggregator.process_encoded(
+            EncodedRecords.from_rows(RecordReader.read_rows(io.StringIO(CSV_DATA)))
+        )
+
+        self.assertEqual(aggregator.summarize(), expected.summarize())
+
+    def test_process_columns(self):
+        """列形式のバッチ集計をテスト"""
+        aggregator = create_aggregator(AGGREGATE_ENGINE_NUMPY)
+        aggregator.process_columns(
+            [1, 1, 1, 2],
+            ["SiteA", "SiteA", "SiteB", "SiteA"],
+            ["app1", "app1", "app1", "app2"],
+            [True, False, True, True],
+        )
+
+        self.assertEqual(
+            aggregator.site_app_stats[(1, "SiteA", "app1")],
+            {"total": 2, "success": 1},
+        )
+        self.assertEqual(
+            aggregator.site_app_stats[(2, "SiteA", "app2")],
+            {"total": 1, "success": 1},
+        )
+
+    def test_unknown_engine(self):
+        """未知のエンジン名の指定をテスト"""
+        with self.assertRaises(ValueError):
+            create_aggregator("unknown")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src2"))
+
+from models import (
+    AggregationRecord,
+    GroupByAggregator,
+    RecordReader,
+    format_epoch_minute,
+)
+from rollup_store import RollupStore
+from spill import SpillingRecordAggregator
+
+BASE_MINUTE = RecordReader.to_epoch_minute("2024/01/01 00:00:00")
+
+
+def build_entries(seed, minutes=3 * 24 * 60, keys=2000):
+    rng = random.Random(seed)
+    entries = {}
+    for _ in range(keys):
+        key = (
+            BASE_MINUTE + rng.randrange(minutes),
+            f"Site{rng.randrange(3)}",
+            f"app{rng.randrange(1, 3)}",
+        )
+        total = rng.randrange(1, 20)
+        entries[key] = (total, rng.randrange(total + 1))
+    return entries
+
+
+class TestRollupStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = RollupStore(os.path.join(self.tmp_dir.name, "rollups.db"))
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp_dir.cleanup()
+
+    def update(self, entries):
+        return self.store.update(
+            (key, total, success) for key, (total, success) in entries.items()
+        )
+
+    def expected(self, entries, start, end, granularity, dimensions):
+        groups = GroupByAggregator(("endtime", "site", "app"))
+        for key, (total, success) in entries.items():
+            if start <= key[0] < end:
+                groups.add(key, total, success)
+        return groups.rollup(dimensions, granularity).summarize()
+
+    def test_levels_match_minute_rollup(self):
+        """各粒度の問い合わせ結果が1分単位から集計し直した結果と一致することをテスト"""
+        entries = build_entries(0)
+        self.update(entries)
+        end = BASE_MINUTE + 3 * 24 * 60
+
+        for granularity in (1, 5, 15, 60, 24 * 60):
+            with self.subTest(granularity=granularity):
+                actual = self.store.query(
+                    "2024/01/01 00:00:00", "2024/01/04 00:00:00", granularity
+                )
+                expected = self.expected(
+                    entries, BASE_MINUTE, end, granularity, ("endtime", "site", "app")
+                )
+                self.assertEqual(actual, expected)
+
+    def test_replacing_minutes_propagates_deltas(self):
+        """同じ分の値を置き換えると粗い粒度にも差分だけが反映されることをテスト"""
+        entries = build_entries(0)
+        self.update(entries)
+
+        changed = build_entries(1)
+        entries.update(changed)
+        self.assertGreater(self.update(changed), 0)
+        self.assertEqual(self.update(changed), 0)
+
+        end = BASE_MINUTE + 3 * 24 * 60
+        dimensions = ("endtime", "site")
+        actual = self.store.query(
+            "2024/01/01 00:00:00", "2024/01/04 00:00:00", 24 * 60, dimensions
+        )
+        expected = self.expected(entries, BASE_MINUTE, end, 24 * 60, dimensions)
+        self.assertEqual(actual, expected)
+
+        # 時刻の軸を含まない問い合わせは範囲全体で1日単位の行を使う
+        actual = self.store.query(
+            "2024/01/01 00:00:00", "2024/01/04 00:00:00", dimensions=("app",)
+        )
+        self.assertEqual(actual, self.expected(entries, BASE_MINUTE, end, 1, ("app",)))
+
+    def test_spilled_entries_summed_per_key(self):
+        """書き出しで同じキーが複数回現れる集計結果を合算して保存することをテスト"""
+        records = [
+            AggregationRecord(BASE_MINUTE + i % 3, "SiteA", "app1", "PROC_OK")
+            for i in range(30)
+        ]
+        with SpillingRecordAggregator(max_groups=1) as aggregator:
+            for record in records:
+                aggregator.process([record])
+            self.assertGreater(aggregator.spill_count, 0)
+            self.store.update(aggregator.iter_entries())
+
+        for granularity in (1, 5):
+            with self.subTest(granularity=granularity):
+                rows = self.store.query(
+                    "2024/01/01 00:00:00", "2024/01/01 00:05:00", granularity
+                )
+                self.assertEqual(sum(row["TotalCount"] for row in rows), 30)
+                if granularity == 1:
+                    self.assertEqual([row["TotalCount"] for row in rows], [10, 10, 10])
+
+    def test_resolution_for_picks_coarsest_level(self):
+        """範囲と集計単位を満たす最も粗い粒度を選ぶことをテスト"""
+        day = 24 * 60
+        week = BASE_MINUTE + 7 * day
+        resolution_for = self.store.resolution_for
+        self.assertEqual(resolution_for(BASE_MINUTE, week, day), day)
+        self.assertEqual(resolution_for(BASE_MINUTE, week, 120), 60)
+        self.assertEqual(resolution_for(BASE_MINUTE + 30, BASE_MINUTE + day, 60), 5)
+        self.assertEqual(resolution_for(BASE_MINUTE + 1, BASE_MINUTE + day, 60), 1)
+        with self.assertRaises(ValueError):
+            resolution_for(BASE_MINUTE, BASE_MINUTE + day, 0)
+
+    def test_unaligned_range_and_filters(self):
+        """粒度に揃わない範囲と、サイト・アプリの絞り込みをテスト"""
+        entries = build_entries(0)
+        self.update(entries)
+        start = BASE_MINUTE + 7
+        end = BASE_MINUTE + 24 * 60 + 3
+
+        actual = self.store.query(
+            format_epoch_minute(start),
+            format_epoch_minute(end),
+            granularity=60,
+            dimensions=("site", "app"),
+            sites=["Site0"],
+            apps=["app1"],
+        )
+        expected = [
+            row
+            for row in self.expected(entries, start, end, 60, ("site", "app"))
+            if row["Site"] == "Site0" and row["App"] == "app1"
+        ]
+        self.assertEqual(actual, expected)
+
+    def test_invalid_resolutions(self):
+        """1分から始まらない、または割り切れない粒度でValueErrorを送出することをテスト"""
+        path = os.path.join(self.tmp_dir.name, "invalid.db")
+        for resolutions in ((5, 60), (1, 7, 60), ()):
+            with self.subTest(resolutions=resolutions):
+                with self.assertRaises(ValueError):
+                    RollupStore(path, resolutions)
+
+
+if __name__ == "__main__":
+    unittest.main()
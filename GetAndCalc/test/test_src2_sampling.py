@@ -0,0 +1,171 @@
+import io
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src2"))
+
+from models import EncodedRecords, RecordAggregator, RecordFilter, RecordReader
+from sampling import SampledRecordAggregator
+
+
+def build_csv(rows, seed=0, failure_rate=0.1):
+    rng = random.Random(seed)
+    lines = ["End Time Local,Site,APP,RC"]
+    for _ in range(rows):
+        second = rng.randrange(600)
+        app = f"app{rng.randrange(1, 3)}"
+        if rng.random() < failure_rate:
+            rc = "ERROR"
+        else:
+            rc = "PROC_OK" if app == "app1" else "PROC_COMPLETED"
+        lines.append(
+            f"2024/01/01 10:{second // 60:02d}:{second % 60:02d},"
+            f"Site{rng.randrange(3)},{app},{rc}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+class TestSampledRecordAggregator(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_data = build_csv(20000)
+        self.file_path = os.path.join(self.tmp_dir.name, "input.csv")
+        with open(self.file_path, "w", encoding="utf-8", newline="") as f:
+            f.write(self.csv_data)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _exact(self):
+        aggregator = RecordAggregator()
+        aggregator.process(RecordReader.from_textio(io.StringIO(self.csv_data)))
+        return {
+            row["EndTime"] + row["Site"]: row for row in aggregator.format_summary()
+        }
+
+    def test_full_rate_matches_exact_summary(self):
+        """抽出率1では通常の集計と同じ値になり、信頼区間の幅が0になることをテスト"""
+        aggregator = SampledRecordAggregator(1.0, block_size=4096)
+        aggregator.process_file(self.file_path)
+        exact = self._exact()
+
+        summary = aggregator.format_summary()
+        self.assertEqual(len(summary), len(exact))
+        for row in summary:
+            expected = exact[row["EndTime"] + row["Site"]]
+            for app in ("app1", "app2"):
+                for metric in ("Total", "Success", "SR"):
+                    column = f"{app}_{metric}"
+                    self.assertEqual(row[column], expected[column])
+                self.assertEqual(row[f"{app}_Total_Low"], row[f"{app}_Total"])
+                self.assertEqual(row[f"{app}_Total_High"], row[f"{app}_Total"])
+                self.assertEqual(row[f"{app}_SR_Low"], row[f"{app}_SR"])
+                self.assertEqual(row[f"{app}_SR_High"], row[f"{app}_SR"])
+
+    def test_estimates_cover_exact_values(self):
+        """抽出した区間からの推定値の信頼区間が実際の値をおおむね含むことをテスト"""
+        aggregator = SampledRecordAggregator(0.3, confidence=0.99, block_size=2048)
+        sampled = aggregator.process_file(self.file_path)
+        self.assertLess(sampled, 20000)
+        exact = self._exact()
+
+        covered = checked = 0
+        for row in aggregator.format_summary():
+            expected = exact[row["EndTime"] + row["Site"]]
+            for app in ("app1", "app2"):
+                total = int(expected[f"{app}_Total"])
+                sr = float(expected[f"{app}_SR"])
+                checked += 2
+                covered += row[f"{app}_Total_Low"] <= total <= row[f"{app}_Total_High"]
+                covered += (
+                    float(row[f"{app}_SR_Low"]) <= sr <= float(row[f"{app}_SR_High"])
+                )
+        self.assertGreaterEqual(covered / checked, 0.9)
+
+    def test_deterministic_for_same_seed(self):
+        """同じseedでは同じ区間を選び、同じ結果になることをテスト"""
+        results = []
+        for seed in (1, 1, 2):
+            aggregator = SampledRecordAggregator(0.2, seed=seed, block_size=2048)
+            aggregator.process_file(self.file_path)
+            results.append(aggregator.format_summary())
+        self.assertEqual(results[0], results[1])
+        self.assertNotEqual(results[0], results[2])
+
+    def test_header_adds_interval_columns(self):
+        """ヘッダーに信頼区間の列が加わることをテスト"""
+        header = SampledRecordAggregator(0.5).summary_header()
+        self.assertEqual(
+            header[:8],
+            [
+                "EndTime",
+                "Site",
+                "app1_Total",
+                "app1_Success",
+                "app1_SR",
+                "app1_Total_Low",
+                "app1_Total_High",
+                "app1_SR_Low",
+            ],
+        )
+
+    def test_quoted_newline_falls_back_to_whole_file(self):
+        """クォート内の改行が区間をまたぐファイルは全体を読むことをテスト"""
+        lines = ["End Time Local,Site,APP,RC"]
+        lines += ['2024/01/01 10:00:00,"Site\nA",app1,PROC_OK'] * 200
+        with open(self.file_path, "w", encoding="utf-8", newline="") as f:
+            f.write("\n".join(lines) + "\n")
+
+        aggregator = SampledRecordAggregator(0.5, block_size=64)
+        self.assertEqual(aggregator.process_file(self.file_path), 200)
+        (row,) = aggregator.format_summary()
+        self.assertEqual(row["app1_Total"], 200)
+        self.assertEqual(row["app1_Total_High"], 200)
+
+    def test_missing_app_defaults(self):
+        """行のないアプリの成功率と信頼区間の列が同じ既定値になることをテスト"""
+        with open(self.file_path, "w", encoding="utf-8", newline="") as f:
+            f.write("End Time Local,Site,APP,RC\n")
+            f.write("2024/01/01 10:00:00,SiteA,app1,ERROR\n")
+
+        aggregator = SampledRecordAggregator(1.0)
+        aggregator.process_file(self.file_path)
+        (row,) = aggregator.format_summary()
+        self.assertEqual(row["app1_SR_High"], "0.00")
+        self.assertEqual(row["app2_SR"], "100.00")
+        self.assertEqual(row["app2_SR_Low"], "100.00")
+        self.assertEqual(row["app2_SR_High"], "100.00")
+        self.assertEqual(row["app2_Total_High"], "0")
+
+    def test_record_filter_applied(self):
+        """絞り込み条件が抽出した区間にも適用されることをテスト"""
+        aggregator = SampledRecordAggregator(1.0, block_size=4096)
+        aggregator.process_file(self.file_path, RecordFilter(sites={"Site0"}))
+        sites = {row["Site"] for row in aggregator.format_summary()}
+        self.assertEqual(sites, {"Site0"})
+
+    def test_merge_with_exact_aggregator(self):
+        """推定値を持たないアグリゲータはすべて読んだものとして合算することをテスト"""
+        exact = RecordAggregator()
+        exact.process_encoded(
+            EncodedRecords.from_rows(RecordReader.read_rows(io.StringIO(self.csv_data)))
+        )
+        merged = SampledRecordAggregator(1.0) + exact
+        self.assertIsInstance(merged, SampledRecordAggregator)
+        for row in merged.summarize():
+            self.assertEqual(row["Total_Low"], row["TotalCount"])
+            self.assertEqual(row["Total_High"], row["TotalCount"])
+
+    def test_invalid_rate(self):
+        """範囲外の抽出率でValueErrorを送出することをテスト"""
+        for rate in (0, -0.1, 1.5):
+            with self.assertRaises(ValueError):
+                SampledRecordAggregator(rate)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import io
+import os
+import pickle
+import random
+import sys
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src2"))
+
+from models import AggregationRecord, EncodedRecords, RecordReader
+from sketches import (
+    METRIC_DISTINCT,
+    METRIC_QUANTILE,
+    HyperLogLog,
+    LogHistogram,
+    MetricSpec,
+    SketchRecordAggregator,
+)
+
+METRICS = [
+    MetricSpec("Subscribers", "IMSI", METRIC_DISTINCT),
+    MetricSpec("Duration", "Duration", METRIC_QUANTILE, quantiles=(0.5, 0.99)),
+]
+
+
+def build_csv(rows, seed):
+    rng = random.Random(seed)
+    lines = ["End Time Local,Site,APP,RC,IMSI,Duration"]
+    for _ in range(rows):
+        lines.append(
+            f"2024/01/01 00:00:10,SiteA,app1,PROC_OK,"
+            f"imsi{rng.randrange(500)},{rng.uniform(1, 100):.3f}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+class TestHyperLogLog(unittest.TestCase):
+    def test_estimate_and_merge(self):
+        """異なり数の推定と合算をテスト"""
+        left = HyperLogLog(precision=12)
+        right = HyperLogLog(precision=12)
+        for i in range(20000):
+            left.add(f"user{i}")
+            right.add(f"user{i + 10000}")
+
+        self.assertAlmostEqual(left.estimate(), 20000, delta=20000 * 0.05)
+        self.assertAlmostEqual(left.merge(right).estimate(), 30000, delta=30000 * 0.05)
+
+    def test_small_cardinality(self):
+        """小さい異なり数の推定をテスト"""
+        sketch = HyperLogLog()
+        for i in range(50):
+            sketch.add(str(i))
+            sketch.add(str(i))
+
+        self.assertAlmostEqual(sketch.estimate(), 50, delta=3)
+
+
+class TestLogHistogram(unittest.TestCase):
+    def test_quantile_and_merge(self):
+        """分位点の推定と合算をテスト"""
+        left = LogHistogram(relative_accuracy=0.01)
+        right = LogHistogram(relative_accuracy=0.01)
+        for value in range(1, 501):
+            left.add(value)
+        for value in range(501, 1001):
+            right.add(value)
+
+        merged = left.merge(right)
+
+        self.assertEqual(merged.count, 1000)
+        self.assertAlmostEqual(merged.quantile(0.5), 500, delta=500 * 0.01)
+        self.assertAlmostEqual(merged.quantile(0.99), 990, delta=990 * 0.01)
+        self.assertIsNone(LogHistogram().quantile(0.5))
+
+    def test_negative_value(self):
+        """負の値をテスト"""
+        with self.assertRaises(ValueError):
+            LogHistogram().add(-1)
+
+
+class TestSketchRecordAggregator(unittest.TestCase):
+    def test_summarize_with_metrics(self):
+        """件数と推定値が集計キーごとに出力されることをテスト"""
+        aggregator = SketchRecordAggregator(METRICS)
+        aggregator.process_textio(io.StringIO(build_csv(2000, 0)))
+
+        stat = aggregator.summarize()[0]
+
+        self.assertEqual(stat["TotalCount"], 2000)
+        self.assertAlmostEqual(stat["Subscribers"], 500, delta=500 * 0.1)
+        self.assertAlmostEqual(float(stat["Duration_p50"]), 50, delta=5)
+        row = aggregator.format_summary()[0]
+        self.assertIn("app1_Subscribers", row)
+        self.assertIn("app1_Duration_p99", row)
+
+    def test_merge_across_processes(self):
+        """pickleを経由したスケッチの合算をテスト"""
+        left = SketchRecordAggregator(METRICS)
+        left.process_textio(io.StringIO(build_csv(1000, 1)))
+        right = SketchRecordAggregator(METRICS)
+        right.process_textio(io.StringIO(build_csv(1000, 2)))
+        expected = SketchRecordAggregator(METRICS)
+        expected.process_textio(io.StringIO(build_csv(1000, 1)))
+        expected.process_textio(io.StringIO(build_csv(1000, 2)))
+
+        merged = pickle.loads(pickle.dumps(left)) + pickle.loads(pickle.dumps(right))
+
+        self.assertEqual(merged.summarize(), expected.summarize())
+
+    def test_invalid_quantile_value(self):
+        """有限の非負の数値でない分位点の列を含むファイルを集計しないことをテスト"""
+        for value in ("abc", "-1", "inf", "nan"):
+            with self.subTest(value=value):
+                aggregator = SketchRecordAggregator(METRICS)
+                invalid_line = f"2024/01/01 00:00:10,SiteA,app1,RC,imsi,{value}\n"
+                csv_data = build_csv(10, 0) + invalid_line
+
+                with self.assertRaises(ValueError):
+                    aggregator.process_textio(io.StringIO(csv_data))
+
+                self.assertEqual(aggregator.summarize(), [])
+
+    def test_records_without_metric_columns_rejected(self):
+        """指標の列を持たないレコードの集計でTypeErrorを送出することをテスト"""
+        aggregator = SketchRecordAggregator(METRICS)
+        minute = RecordReader.to_epoch_minute("2024/01/01 00:00:10")
+        record = AggregationRecord(minute, "SiteA", "app1", "PROC_OK")
+        encoded = EncodedRecords.from_rows([(minute, "SiteA", "app1", "PROC_OK")])
+
+        with self.assertRaises(TypeError):
+            aggregator.process([record])
+        with self.assertRaises(TypeError):
+            aggregator.process_encoded(encoded)
+        self.assertEqual(aggregator.summarize(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import io
+import os
+import random
+import sys
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src2"))
+
+from models import EncodedRecords, RecordAggregator, RecordReader
+from spill import SpillingRecordAggregator
+
+
+def build_csv(rows, seed=0):
+    rng = random.Random(seed)
+    lines = ["End Time Local,Site,APP,RC"]
+    for _ in range(rows):
+        second = rng.randrange(600)
+        lines.append(
+            f"2024/01/01 10:{second // 60:02d}:{second % 60:02d},"
+            f"Site{rng.randrange(30)},app{rng.randrange(1, 3)},"
+            f"{rng.choice(['PROC_OK', 'PROC_COMPLETED', 'ERROR'])}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+class TestSpillingRecordAggregator(unittest.TestCase):
+    def test_same_summary_as_in_memory(self):
+        """書き出しを伴う集計がメモリ上の集計と同じ結果になることをテスト"""
+        expected = RecordAggregator()
+        with SpillingRecordAggregator(max_groups=50, partitions=4) as aggregator:
+            for seed in range(3):
+                csv_data = build_csv(2000, seed)
+                expected.process(RecordReader.from_textio(io.StringIO(csv_data)))
+                aggregator.process_encoded(
+                    EncodedRecords.from_rows(RecordReader.read_rows(io.StringIO(csv_data)))
+                )
+
+            self.assertGreater(aggregator.spill_count, 0)
+            self.assertLessEqual(len(aggregator.site_app_stats), 50)
+            self.assertEqual(aggregator.summarize(), expected.summarize())
+            self.assertEqual(aggregator.format_summary(), expected.format_summary())
+            self.assertEqual(
+                aggregator.top_k(5, by=("site",)), expected.top_k(5, by=("site",))
+            )
+
+    def test_queries_combine_spilled_entries(self):
+        """書き出しで分かれた同じキーの結果を合算して1行ずつ返すことをテスト"""
+        csv_data = build_csv(3000)
+        expected = RecordAggregator()
+        expected.process(RecordReader.from_textio(io.StringIO(csv_data)))
+        records = list(RecordReader.from_textio(io.StringIO(csv_data)))
+        with SpillingRecordAggregator(max_groups=50, partitions=4) as aggregator:
+            for start in range(0, len(records), 100):
+                aggregator.process(records[start : start + 100])
+            self.assertGreater(aggregator.spill_count, 1)
+
+            rows = list(aggregator.iter_summary_lazy())
+            self.assertEqual(len(rows), len(expected.site_app_stats))
+            self.assertEqual(sum(row["TotalCount"] for row in rows), 3000)
+            self.assertEqual(rows, expected.summarize())
+            self.assertEqual(aggregator.top_k(5), expected.top_k(5))
+            self.assertEqual(
+                aggregator.bottom_k_success_rate(5), expected.bottom_k_success_rate(5)
+            )
+
+    def test_encoded_file_spilled_within_budget(self):
+        """1ファイル分の符号化済みレコードでも上限を超えた時点で書き出すことをテスト"""
+        csv_data = build_csv(3000)
+        expected = RecordAggregator()
+        expected.process(RecordReader.from_textio(io.StringIO(csv_data)))
+        rows = RecordReader.read_rows(io.StringIO(csv_data))
+        with SpillingRecordAggregator(max_groups=50, partitions=4) as aggregator:
+            sizes = []
+            spill = aggregator._spill
+
+            def recording_spill():
+                sizes.append(len(aggregator.site_app_stats))
+                spill()
+
+            aggregator._spill = recording_spill
+            aggregator.process_encoded(EncodedRecords.from_rows(rows))
+
+            self.assertGreater(len(sizes), 1)
+            self.assertLessEqual(max(sizes), 51)
+            self.assertEqual(aggregator.summarize(), expected.summarize())
+
+    def test_merge(self):
+        """書き出し済みのアグリゲータ同士の合算をテスト"""
+        expected = RecordAggregator()
+        partials = []
+        for seed in range(2):
+            csv_data = build_csv(1000, seed)
+            expected.process(RecordReader.from_textio(io.StringIO(csv_data)))
+            partial = SpillingRecordAggregator(max_groups=30, partitions=3)
+            partial.process(RecordReader.from_textio(io.StringIO(csv_data)))
+            partials.append(partial)
+
+        merged = partials[0] + partials[1]
+
+        self.assertEqual(merged.summarize(), expected.summarize())
+        for aggregator in partials + [merged]:
+            aggregator.close()
+
+    def test_no_spill(self):
+        """上限内ではメモリ上だけで集計することをテスト"""
+        aggregator = SpillingRecordAggregator(max_groups=10_000)
+        aggregator.process(RecordReader.from_textio(io.StringIO(build_csv(100))))
+
+        self.assertEqual(aggregator.spill_count, 0)
+        self.assertTrue(aggregator.summarize())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import sys
+import tempfile
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src2"))
+
+from models import RecordAggregator, aggregate_file
+from spill import SpillingRecordAggregator
+from state_store import AggregationStateStore
+
+HEADER = "End Time Local,Site,APP,RC\n"
+LINES = [
+    "2024/01/01 00:00:10,SiteA,app1,PROC_SUCCESS\n",
+    "2024/01/01 00:00:20,SiteA,app1,ERROR\n",
+    "2024/01/01 00:01:10,SiteB,app2,PROC_COMPLETED\n",
+    "2024/01/01 00:02:10,SiteB,app2,ERROR\n",
+]
+
+
+class TestAggregationStateStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "STATE", "state.db")
+        self.csv_path = os.path.join(self.tmp_dir.name, "input.csv")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_file(self, data: str) -> None:
+        with open(self.csv_path, "w", encoding="utf-8") as f:
+            f.write(data)
+
+    def load(self) -> RecordAggregator:
+        with AggregationStateStore(self.db_path) as store:
+            return store.load(RecordAggregator())
+
+    def test_only_appended_lines(self):
+        """追記された行だけを集計することをテスト"""
+        # 書き込み途中の末尾行は次回に回す
+        self.write_file(HEADER + "".join(LINES[:2]) + LINES[2][:10])
+        with AggregationStateStore(self.db_path) as store:
+            self.assertEqual(store.aggregate_file("dir/input.csv", self.csv_path), 2)
+
+        self.write_file(HEADER + "".join(LINES))
+        with AggregationStateStore(self.db_path) as store:
+            self.assertEqual(store.aggregate_file("dir/input.csv", self.csv_path), 2)
+            self.assertEqual(store.aggregate_file("dir/input.csv", self.csv_path), 0)
+
+        self.assertEqual(
+            self.load().summarize(), aggregate_file(self.csv_path).summarize()
+        )
+
+    def test_rotated_file(self):
+        """先頭が変わったファイルを先頭から集計することをテスト"""
+        self.write_file(HEADER + "".join(LINES[:2]))
+        with AggregationStateStore(self.db_path) as store:
+            store.aggregate_file("dir/input.csv", self.csv_path)
+
+        self.write_file(HEADER + "".join(LINES[2:]))
+        with AggregationStateStore(self.db_path) as store:
+            self.assertEqual(store.aggregate_file("dir/input.csv", self.csv_path), 2)
+
+        self.assertEqual(len(self.load().summarize()), 3)
+
+    def test_invalid_appended_line(self):
+        """不正な行を含む追記分を保存しないことをテスト"""
+        self.write_file(HEADER + "".join(LINES[:2]))
+        with AggregationStateStore(self.db_path) as store:
+            store.aggregate_file("dir/input.csv", self.csv_path)
+
+        self.write_file(HEADER + "".join(LINES) + "2024/01/01 00:03:00,,app1,RC\n")
+        with AggregationStateStore(self.db_path) as store:
+            with self.assertRaises(ValueError):
+                store.aggregate_file("dir/input.csv", self.csv_path)
+
+        self.assertEqual(len(self.load().summarize()), 1)
+
+    def test_prune(self):
+        """古い集計結果の削除をテスト"""
+        self.write_file(HEADER + "".join(LINES))
+        with AggregationStateStore(self.db_path) as store:
+            store.aggregate_file("dir/input.csv", self.csv_path)
+            aggregator = store.load(RecordAggregator())
+            endtimes = sorted(key[0] for key in aggregator.site_app_stats)
+            store.prune(endtimes[-1])
+
+        self.assertEqual(len(self.load().summarize()), 1)
+
+    def test_latest_endtime(self):
+        """保存済みの最新の終了時刻を返すことをテスト"""
+        self.write_file(HEADER + "".join(LINES))
+        with AggregationStateStore(self.db_path) as store:
+            self.assertIsNone(store.latest_endtime())
+            store.aggregate_file("dir/input.csv", self.csv_path)
+            endtimes = store.load(RecordAggregator()).site_app_stats
+            self.assertEqual(store.latest_endtime(), max(key[0] for key in endtimes))
+
+    def test_load_into_spilling_aggregator(self):
+        """集計キー数に上限のあるアグリゲータへの読み込みで上限を超えた分が書き出されることをテスト"""
+        self.write_file(HEADER + "".join(LINES))
+        with AggregationStateStore(self.db_path) as store:
+            store.aggregate_file("dir/input.csv", self.csv_path)
+            with SpillingRecordAggregator(max_groups=1) as aggregator:
+                store.load(aggregator)
+                self.assertGreater(aggregator.spill_count, 0)
+                self.assertLessEqual(len(aggregator.site_app_stats), 1)
+                self.assertEqual(
+                    aggregator.summarize(), aggregate_file(self.csv_path).summarize()
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
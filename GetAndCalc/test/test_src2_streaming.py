@@ -0,0 +1,96 @@
+import io
+import os
+import sys
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src2"))
+
+from models import RecordReader
+from streaming import StreamingRecordAggregator
+
+CSV_DATA = (
+    "End Time Local,Site,APP,RC\n"
+    "2024/01/01 00:00:10,SiteA,app1,PROC_SUCCESS\n"
+    "2024/01/01 00:00:20,SiteA,app1,ERROR\n"
+    "2024/01/01 00:01:10,SiteB,app2,PROC_COMPLETED\n"
+    "2024/01/01 00:00:15,SiteA,app1,PROC_OK\n"
+    "2024/01/01 00:02:10,SiteB,app2,ERROR\n"
+    "2024/01/01 00:00:05,SiteA,app1,PROC_OK\n"
+)
+
+
+def stream_records(csv_data: str = CSV_DATA):
+    return RecordReader.stream_textio(io.StringIO(csv_data))
+
+
+class TestStreamingRecordAggregator(unittest.TestCase):
+    def test_emit_closed_windows(self):
+        """ウォーターマークを過ぎたウィンドウから順に確定することをテスト"""
+        aggregator = StreamingRecordAggregator()
+
+        emitted = list(aggregator.process(stream_records()))
+
+        self.assertEqual(len(emitted), 2)
+        self.assertEqual(emitted[0]["EndTime"], "2024/01/01 00:00:00")
+        self.assertEqual(emitted[0]["TotalCount"], 2)
+        self.assertEqual(emitted[0]["SR"], "50.00")
+        self.assertEqual(emitted[1]["EndTime"], "2024/01/01 00:01:00")
+        self.assertEqual(aggregator.late_records, 2)
+
+        rest = list(aggregator.flush())
+        self.assertEqual([row["EndTime"] for row in rest], ["2024/01/01 00:02:00"])
+        self.assertEqual(aggregator.open_windows, {})
+
+    def test_allowed_lateness(self):
+        """許容遅延内のレコードを数えることをテスト"""
+        aggregator = StreamingRecordAggregator(allowed_lateness=2)
+
+        emitted = list(aggregator.process(stream_records()))
+        emitted.extend(aggregator.flush())
+
+        self.assertEqual(aggregator.late_records, 0)
+        self.assertEqual(emitted[0]["TotalCount"], 4)
+        self.assertEqual(emitted[0]["SuccessCount"], 3)
+        self.assertEqual(emitted[0]["SR"], "75.00")
+
+    def test_stream_invalid_line(self):
+        """不正な行の手前までのレコードは返ることをテスト"""
+        records = stream_records(CSV_DATA + "2024/01/01 00:03:00,,app1,RC\n")
+        received = []
+
+        with self.assertRaisesRegex(ValueError, "Line7: Site"):
+            for record in records:
+                received.append(record)
+
+        self.assertEqual(len(received), 6)
+        last = RecordReader.to_epoch_minute("2024/01/01 00:00:05")
+        self.assertEqual((received[-1].endtime, received[-1].site), (last, "SiteA"))
+
+    def test_invalid_lines_skipped(self):
+        """ライブフィードの不正な行を読み飛ばして数え、集計を続けることをテスト"""
+        header, *lines = CSV_DATA.splitlines(keepends=True)
+        # tail -Fでローテーション後のヘッダが再度届く場合を含む
+        csv_data = (
+            header
+            + "".join(lines[:3])
+            + header
+            + "2024/01/01 00:01:20,,app2,ERROR\n"
+            + "2024/01/01 00:01:60,SiteB,app2,ERROR\n"
+            + "".join(lines[3:])
+        )
+        aggregator = StreamingRecordAggregator()
+
+        emitted = list(aggregator.process_textio(io.StringIO(csv_data)))
+        emitted.extend(aggregator.flush())
+
+        expected = StreamingRecordAggregator()
+        self.assertEqual(
+            emitted, list(expected.process(stream_records())) + list(expected.flush())
+        )
+        self.assertEqual(aggregator.invalid_records, 3)
+        self.assertEqual(aggregator.late_records, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
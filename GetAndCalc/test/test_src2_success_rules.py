@@ -0,0 +1,77 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "../src2"))
+
+from models import RecordAggregator, RecordReader
+from success_rules import SuccessRules
+
+RULES = {
+    "app3": {"codes": ["OK"], "prefixes": ["DONE_"], "patterns": ["2\\d\\d"]},
+    "app1": ["PROC_SUCCESS", "PROC_OK"],
+}
+
+
+class TestSuccessRules(unittest.TestCase):
+    def test_is_success(self):
+        """完全一致・前方一致・正規表現での判定をテスト"""
+        rules = SuccessRules.from_dict(RULES)
+
+        self.assertTrue(rules.is_success("app3", "OK"))
+        self.assertTrue(rules.is_success("app3", "DONE_WITH_WARN"))
+        self.assertTrue(rules.is_success("app3", "204"))
+        self.assertFalse(rules.is_success("app3", "2045"))
+        self.assertFalse(rules.is_success("app3", "PROC_OK"))
+        self.assertTrue(rules.is_success("app1", "PROC_OK"))
+        self.assertFalse(rules.is_success("unknown", "OK"))
+        self.assertEqual(rules.app_names, ["app3", "app1"])
+
+    def test_load(self):
+        """設定ファイルからの読み込みをテスト"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "success_rules.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(RULES, f)
+
+            rules = SuccessRules.load(path)
+
+        self.assertTrue(rules.is_success("app3", "DONE_"))
+
+    def test_invalid_config(self):
+        """不正な設定をテスト"""
+        invalid_configs = [
+            [],
+            {"app1": "PROC_OK"},
+            {"app1": {"codes": "PROC_OK"}},
+            {"app1": {"code": ["PROC_OK"]}},
+            {"app1": {"patterns": ["("]}},
+        ]
+        for config in invalid_configs:
+            with self.subTest(config=config):
+                with self.assertRaises(ValueError):
+                    SuccessRules.from_dict(config)
+
+    def test_header_follows_configured_apps(self):
+        """出力ヘッダが設定したappの順序になることをテスト"""
+        rules = SuccessRules.from_dict(RULES)
+        csv_data = (
+            "End Time Local,Site,APP,RC\n"
+            "2024/01/01 00:00:00,SiteA,app3,DONE_1\n"
+            "2024/01/01 00:00:00,SiteA,app3,500\n"
+        )
+        aggregator = RecordAggregator(success_rules=rules)
+        aggregator.process(RecordReader.from_textio(io.StringIO(csv_data), rules))
+
+        result = aggregator.format_summary()
+
+        self.assertEqual(list(result[0])[2:5], ["app3_Total", "app3_Success", "app3_SR"])
+        self.assertEqual(result[0]["app3_SR"], "50.00")
+
+
+if __name__ == "__main__":
+    unittest.main()